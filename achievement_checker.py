@@ -141,6 +141,11 @@ class AchievementChecker:
         if user_id in self.user_sessions:
             del self.user_sessions[user_id]
 
+    def clear_all_caches(self):
+        """Очищает кэши всех пользователей (после массового сброса прогресса)"""
+        self._achievement_cache.clear()
+        self.user_sessions.clear()
+
     @staticmethod
     async def get_user_progress(user_id: int) -> Dict[str, Any]:
         """Возвращает прогресс пользователя по достижениям"""
@@ -1,25 +1,46 @@
 import logging
 import json
-import datetime
+import html
 import io
-from pathlib import Path
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+from typing import Optional
 from aiogram import Router, types, F
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.types import InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from questions import QUESTIONS
-from db import db
+from db import db, BROWSE_NULL_KEY, SEARCH_PAGE_SIZE
+from question_bank import question_bank
+from achievement_checker import achievement_checker
+from backup import (
+    TELEGRAM_DOWNLOAD_LIMIT,
+    create_backup,
+    create_incremental_backup,
+    list_chains,
+    load_manifest,
+    prepare_shadow,
+    prepare_shadow_from_chain,
+    BACKUP_DIR
+)
+from broadcast import broadcast_manager
+from system_stats import format_age, system_stats
 from aiogram import exceptions
 from keyboards import (
     admin_main_keyboard,
     admin_questions_keyboard,
+    admin_question_category_keyboard,
+    admin_question_difficulty_keyboard,
     admin_stats_keyboard,
     admin_users_keyboard,
     admin_broadcast_keyboard,
     admin_manage_admins_keyboard,
     admin_backup_keyboard,
+    admin_restore_keyboard,
     admin_logs_keyboard,
     admin_bulk_operations_keyboard,
     admin_monitoring_keyboard,
@@ -28,7 +49,8 @@ from keyboards import (
     admin_testing_keyboard,
     confirmation_keyboard,
     get_back_to_admin_keyboard,
-    admin_system_operations_keyboard  # ← ДОБАВЬТЕ ЭТУ СТРОКУ
+    admin_system_operations_keyboard,  # ← ДОБАВЬТЕ ЭТУ СТРОКУ
+    admin_pagination_keyboard
 )
 
 logger = logging.getLogger(__name__)
@@ -46,12 +68,15 @@ class AdminStates(StatesGroup):
     removing_admin = State()
     bulk_xp = State()
     bulk_reset = State()
+    restoring_backup = State()
 
 
 class QuestionStates(StatesGroup):
     waiting_for_question = State()
     waiting_for_options = State()
     waiting_for_correct_answer = State()
+    waiting_for_category = State()
+    waiting_for_difficulty = State()
 
 
 # ------------------- Роутер админки -------------------
@@ -121,11 +146,15 @@ async def admin_questions(callback: types.CallbackQuery):
         await callback.answer("❌ Нет прав доступа", show_alert=True)
         return
 
-    total_questions = len(QUESTIONS)
+    stats = await db.get_questions_stats()
+    by_difficulty = stats["by_difficulty"]
 
     text = (
         f"📝 <b>Управление вопросами</b>\n\n"
-        f"📊 Всего вопросов в базе: <b>{total_questions}</b>\n\n"
+        f"📊 Всего вопросов в базе: <b>{stats['total_questions']}</b>\n"
+        f"📚 Категорий: {stats['categories_count']}\n"
+        f"🟢 {by_difficulty.get('легкий', 0)} · 🟡 {by_difficulty.get('средний', 0)} · "
+        f"🔴 {by_difficulty.get('сложный', 0)} (в среднем: {stats['average_difficulty']})\n\n"
         f"Выберите действие:"
     )
 
@@ -143,7 +172,7 @@ async def admin_view_questions(callback: types.CallbackQuery):
         await callback.answer("❌ Нет прав доступа", show_alert=True)
         return
 
-    if not QUESTIONS:
+    if not len(question_bank):
         text = "📝 <b>Список вопросов</b>\n\n❌ В базе нет вопросов"
         await callback.message.edit_text(text, parse_mode="HTML")
         return
@@ -156,16 +185,18 @@ async def show_questions_page(callback: types.CallbackQuery, page: int):
     questions_per_page = 5
     start_idx = page * questions_per_page
     end_idx = start_idx + questions_per_page
-    page_questions = QUESTIONS[start_idx:end_idx]
+    questions = question_bank.all()
+    page_questions = questions[start_idx:end_idx]
 
     text = f"📝 <b>Список вопросов (стр. {page + 1})</b>\n\n"
 
-    for i, q in enumerate(page_questions, start_idx + 1):
-        text += f"<b>{i}. {q['question'][:50]}...</b>\n"
-        text += f"   Ответ: {q['answer']}\n"
-        text += f"   Варианты: {', '.join(q['options'][:2])}...\n\n"
+    for q in page_questions:
+        text += f"<b>#{q['question_id']}. {html.escape(q['question'][:50])}...</b>\n"
+        text += f"   {q['category']}, {q['difficulty']}\n"
+        text += f"   Ответ: {html.escape(q['answer'])}\n"
+        text += f"   Варианты: {html.escape(', '.join(q['options'][:2]))}...\n\n"
 
-    total_pages = (len(QUESTIONS) + questions_per_page - 1) // questions_per_page
+    total_pages = (len(questions) + questions_per_page - 1) // questions_per_page
 
     await callback.message.edit_text(
         text,
@@ -254,47 +285,68 @@ async def process_correct_answer(message: types.Message, state: FSMContext):
             await message.answer(f"❌ Номер должен быть от 1 до {len(data['options'])}")
             return
 
-        correct_answer = data['options'][correct_idx]
-
-        # Добавляем вопрос в базу
-        new_question = {
-            "question": data['question'],
-            "options": data['options'],
-            "answer": correct_answer
-        }
-
-        QUESTIONS.append(new_question)
-
-        # TODO: Сохранить вопросы в базу данных/файл
-        await save_questions_to_db()
-
-        text = (
-            f"✅ <b>Вопрос успешно добавлен!</b>\n\n"
-            f"<b>Вопрос:</b> {data['question']}\n"
-            f"<b>Правильный ответ:</b> {correct_answer}\n"
-            f"<b>Всего вопросов:</b> {len(QUESTIONS)}"
-        )
+        await state.update_data(answer_index=correct_idx)
+        await state.set_state(QuestionStates.waiting_for_category)
 
         await message.answer(
-            text,
-            reply_markup=admin_questions_keyboard(),
+            f"✅ Правильный ответ: <b>{html.escape(data['options'][correct_idx])}</b>\n\n"
+            f"Выберите категорию вопроса:",
+            reply_markup=admin_question_category_keyboard(question_bank.categories()),
             parse_mode="HTML"
         )
 
-        await state.clear()
-
     except ValueError:
         await message.answer("❌ Пожалуйста, введите число")
+
+
+@admin_router.callback_query(QuestionStates.waiting_for_category, F.data.startswith("admin_qcat:"))
+async def process_question_category(callback: types.CallbackQuery, state: FSMContext):
+    category_id = int(callback.data.split(":")[1])
+    category = next((name for name, cid in question_bank.categories().items() if cid == category_id), None)
+    if category is None:
+        await callback.answer("❌ Категория не найдена", show_alert=True)
+        return
+
+    await state.update_data(category=category)
+    await state.set_state(QuestionStates.waiting_for_difficulty)
+
+    await callback.message.edit_text(
+        f"📚 Категория: <b>{category}</b>\n\nВыберите сложность:",
+        reply_markup=admin_question_difficulty_keyboard(),
+        parse_mode="HTML"
+    )
+
+
+@admin_router.callback_query(QuestionStates.waiting_for_difficulty, F.data.startswith("admin_qdiff:"))
+async def process_question_difficulty(callback: types.CallbackQuery, state: FSMContext):
+    difficulty = callback.data.split(":", 1)[1]
+    data = await state.get_data()
+
+    try:
+        # Вопрос сохраняется в БД и сразу попадает в индекс банка
+        question = await question_bank.add(
+            data['category'], difficulty, data['question'], data['options'], data['answer_index']
+        )
     except Exception as e:
         logger.error(f"Error adding question: {e}")
-        await message.answer("❌ Ошибка при добавлении вопроса")
+        await callback.answer("❌ Ошибка при добавлении вопроса", show_alert=True)
+        return
 
+    await state.clear()
+
+    text = (
+        f"✅ <b>Вопрос #{question['question_id']} добавлен!</b>\n\n"
+        f"<b>Вопрос:</b> {html.escape(question['question'])}\n"
+        f"<b>Правильный ответ:</b> {html.escape(question['answer'])}\n"
+        f"<b>Категория:</b> {question['category']}, {difficulty}\n"
+        f"<b>Всего вопросов:</b> {len(question_bank)}"
+    )
 
-async def save_questions_to_db():
-    """Сохраняет вопросы в базу данных или файл"""
-    # TODO: Реализовать сохранение вопросов
-    # Например: await db.save_questions(QUESTIONS)
-    pass
+    await callback.message.edit_text(
+        text,
+        reply_markup=admin_questions_keyboard(),
+        parse_mode="HTML"
+    )
 
 
 # ------------------- Удаление вопроса -------------------
@@ -304,7 +356,7 @@ async def admin_delete_question_start(callback: types.CallbackQuery, state: FSMC
         await callback.answer("❌ Нет прав доступа", show_alert=True)
         return
 
-    if not QUESTIONS:
+    if not len(question_bank):
         await callback.answer("❌ В базе нет вопросов", show_alert=True)
         return
 
@@ -312,7 +364,7 @@ async def admin_delete_question_start(callback: types.CallbackQuery, state: FSMC
 
     text = (
         "🗑️ <b>Удаление вопроса</b>\n\n"
-        "Введите номер вопроса для удаления:"
+        "Введите номер вопроса для удаления (#номер из списка вопросов):"
     )
 
     await callback.message.edit_text(
@@ -325,20 +377,18 @@ async def admin_delete_question_start(callback: types.CallbackQuery, state: FSMC
 @admin_router.message(AdminStates.deleting_question)
 async def process_delete_question(message: types.Message, state: FSMContext):
     try:
-        question_num = int(message.text.strip())
+        question_id = int(message.text.strip().lstrip("#"))
 
-        if question_num < 1 or question_num > len(QUESTIONS):
-            await message.answer(f"❌ Номер должен быть от 1 до {len(QUESTIONS)}")
+        # Удаляем вопрос (в БД и из индекса банка)
+        deleted_question = await question_bank.delete(question_id)
+        if not deleted_question:
+            await message.answer(f"❌ Вопрос #{question_id} не найден")
             return
 
-        # Удаляем вопрос
-        deleted_question = QUESTIONS.pop(question_num - 1)
-        await save_questions_to_db()
-
         text = (
             f"✅ <b>Вопрос удален!</b>\n\n"
-            f"<b>Удаленный вопрос:</b> {deleted_question['question'][:100]}...\n"
-            f"<b>Осталось вопросов:</b> {len(QUESTIONS)}"
+            f"<b>Удаленный вопрос:</b> {html.escape(deleted_question['question'][:100])}...\n"
+            f"<b>Осталось вопросов:</b> {len(question_bank)}"
         )
 
         await message.answer(
@@ -364,29 +414,28 @@ async def admin_stats(callback: types.CallbackQuery):
         return
 
     try:
-        # Получаем статистику из базы данных
-        total_users = await db.get_total_users_count()
-        active_today = await db.get_active_users_count(1)  # Активные за сегодня
-        active_week = await db.get_active_users_count(7)  # Активные за неделю
-        total_questions = len(QUESTIONS)
-        top_users = await db.get_top_users(5)
+        # Готовый снимок статистики (пересчитывается в фоне)
+        stats = await system_stats.get()
+        total_questions = len(question_bank)
 
         text = (
             f"📊 <b>Статистика бота</b>\n\n"
             f"👥 <b>Пользователи:</b>\n"
-            f"• Всего: {total_users}\n"
-            f"• Активных за сегодня: {active_today}\n"
-            f"• Активных за неделю: {active_week}\n\n"
+            f"• Всего: {stats['total_users']}\n"
+            f"• Активных за сегодня: {stats['active_today']}\n"
+            f"• Активных за неделю: {stats['active_week']}\n\n"
             f"📝 <b>Вопросы:</b> {total_questions}\n\n"
             f"🏆 <b>Топ-5 игроков:</b>\n"
         )
 
-        for i, user in enumerate(top_users, 1):
+        for i, user in enumerate(stats['top_users'], 1):
             username = user.get('username', 'Аноним')
             level = user.get('level', 1)
             xp = user.get('xp', 0)
             text += f"{i}. {username} - Ур. {level} ({xp} XP)\n"
 
+        text += f"\n🕒 Обновлено {format_age(stats['age'])}"
+
         await callback.message.edit_text(
             text,
             reply_markup=admin_stats_keyboard(),
@@ -469,42 +518,68 @@ async def confirm_broadcast(callback: types.CallbackQuery, state: FSMContext):
         await callback.answer("❌ Текст рассылки не найден", show_alert=True)
         return
 
-    # Получаем всех пользователей
-    all_users = await db.get_all_users()
-    sent_count = 0
-    failed_count = 0
-
-    # Показываем уведомление о начале рассылки
+    # Рассылка идет в фоне: прогресс обновляется в этом сообщении
     await callback.message.edit_text("📤 <b>Начинаю рассылку...</b>", parse_mode="HTML")
 
-    # Отправляем сообщение каждому пользователю
-    for user in all_users:
-        try:
-            await callback.bot.send_message(
-                chat_id=user['user_id'],
-                text=broadcast_text
-            )
-            sent_count += 1
-        except Exception as e:
-            logger.error(f"Failed to send broadcast to {user['user_id']}: {e}")
-            failed_count += 1
-
-    text = (
-        f"✅ <b>Рассылка завершена!</b>\n\n"
-        f"• 📤 Отправлено: {sent_count}\n"
-        f"• ❌ Ошибок: {failed_count}\n"
-        f"• 👥 Всего: {len(all_users)}"
-    )
-
-    await callback.message.edit_text(
-        text,
-        reply_markup=admin_main_keyboard(),
-        parse_mode="HTML"
+    job_id = await broadcast_manager.start(
+        callback.bot,
+        broadcast_text,
+        admin_chat_id=callback.message.chat.id,
+        status_message_id=callback.message.message_id
     )
+    logger.info(f"Admin {callback.from_user.id} started broadcast #{job_id}")
 
     await state.clear()
 
 
+@admin_router.callback_query(F.data.startswith("bcast_pause:"))
+async def pause_broadcast(callback: types.CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ Нет прав доступа", show_alert=True)
+        return
+
+    job_id = int(callback.data.split(":")[1])
+    await callback.answer("⏸ Останавливаю рассылку...")
+    await broadcast_manager.pause(job_id)
+
+
+@admin_router.callback_query(F.data.startswith("bcast_resume:"))
+async def resume_broadcast(callback: types.CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ Нет прав доступа", show_alert=True)
+        return
+
+    job_id = int(callback.data.split(":")[1])
+    if await broadcast_manager.resume(callback.bot, job_id):
+        await callback.answer("▶️ Рассылка продолжена")
+    else:
+        await callback.answer("❌ Рассылку нельзя продолжить", show_alert=True)
+
+
+@admin_router.callback_query(F.data.startswith("bcast_cancel:"))
+async def cancel_running_broadcast(callback: types.CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ Нет прав доступа", show_alert=True)
+        return
+
+    job_id = int(callback.data.split(":")[1])
+    await callback.answer("⛔ Отменяю рассылку...")
+    was_running = broadcast_manager.is_running(job_id)
+    await broadcast_manager.cancel(job_id)
+
+    # Если рассылка не шла (была на паузе), сообщение обновляем сами
+    job = await db.get_broadcast_job(job_id)
+    if not was_running and job and job["status"] == "cancelled":
+        await callback.message.edit_text(
+            f"⛔ <b>Рассылка #{job_id} отменена</b>\n\n"
+            f"• 📤 Отправлено: {job['sent']}\n"
+            f"• ❌ Ошибок: {job['failed']}\n"
+            f"• 👥 Всего: {job['total']}",
+            reply_markup=admin_broadcast_keyboard(),
+            parse_mode="HTML"
+        )
+
+
 @admin_router.callback_query(F.data == "cancel_broadcast")
 async def cancel_broadcast(callback: types.CallbackQuery, state: FSMContext):
     await state.clear()
@@ -533,9 +608,10 @@ async def admin_export_questions(callback: types.CallbackQuery):
         return
 
     # Создаем текстовый файл с вопросами
+    questions = question_bank.all()
     questions_data = {
-        "total_questions": len(QUESTIONS),
-        "questions": QUESTIONS
+        "total_questions": len(questions),
+        "questions": questions
     }
 
     # Создаем файл в памяти
@@ -549,7 +625,7 @@ async def admin_export_questions(callback: types.CallbackQuery):
             file_buffer.read(),
             filename="quiz_questions_export.json"
         ),
-        caption=f"📊 Экспорт вопросов\nВсего вопросов: {len(QUESTIONS)}"
+        caption=f"📊 Экспорт вопросов\nВсего вопросов: {len(questions)}"
     )
 
     await callback.answer("✅ Файл экспортирован")
@@ -588,12 +664,12 @@ async def admin_find_user_start(callback: types.CallbackQuery, state: FSMContext
         "🔍 <b>Поиск пользователя</b>\n\n"
         "Введите данные для поиска:\n"
         "• ID пользователя\n"
-        "• Имя пользователя (username)\n"
-        "• Имя (first_name)\n\n"
+        "• @username - точное совпадение\n"
+        "• Часть имени пользователя\n\n"
         "<b>Примеры:</b>\n"
         "<code>812857335</code> - поиск по ID\n"
-        "<code>username</code> - поиск по юзернейму\n"
-        "<code>Иван</code> - поиск по имени"
+        "<code>@username</code> - поиск по юзернейму\n"
+        "<code>иван</code> - поиск по части имени"
     )
 
     await callback.message.edit_text(
@@ -609,31 +685,26 @@ async def admin_find_user_process(message: types.Message, state: FSMContext):
     search_query = message.text.strip()
 
     try:
-        # Если поиск по ID
-        if search_query.isdigit():
-            user_id = int(search_query)
-            user = await db.get_user(user_id)
-            users = [user] if user and user.get('user_id') else []
-        else:
-            # Поиск по username
-            users = await db.search_users(search_query)
+        # ID, @username или часть имени - см. db.search_users
+        result = await db.search_users(search_query)
 
-        if not users:
+        if not result['users']:
             await message.answer(
-                f"❌ Пользователи по запросу <code>{search_query}</code> не найдены",
+                f"❌ Пользователи по запросу <code>{html.escape(search_query)}</code> не найдены",
                 parse_mode="HTML",
                 reply_markup=get_back_to_admin_keyboard("admin_users")
             )
             return
 
         # Если найден один пользователь - показываем детальную информацию
-        if len(users) == 1:
-            await show_user_details(message, users[0])
+        if result['total'] == 1:
+            await show_user_details(message, result['users'][0])
         else:
-            # Если найдено несколько пользователей - показываем список
-            await show_users_list(message, users, search_query)
+            # Если найдено несколько пользователей - показываем список (запрос нужен для страниц)
+            await show_users_list(message, result, search_query)
 
-        await state.clear()
+        await state.set_state(None)
+        await state.update_data(search_query=search_query)
 
     except Exception as e:
         logger.error(f"Error searching user: {e}")
@@ -698,37 +769,70 @@ async def show_user_details(message: types.Message, user: dict):
     await message.answer(text, reply_markup=keyboard.as_markup(), parse_mode="HTML")
 
 
-async def show_users_list(message: types.Message, users: list, search_query: str):
-    """Показывает список найденных пользователей"""
-    text = f"🔍 <b>Результаты поиска: '{search_query}'</b>\n\n"
-    text += f"📋 Найдено пользователей: <b>{len(users)}</b>\n\n"
+async def show_users_list(message: types.Message, result: dict, search_query: str, offset: int = 0,
+                          edit: bool = False):
+    """Показывает страницу найденных пользователей (результат db.search_users)"""
+    users = result['users']
+    total = f"{result['total']}+" if result['capped'] else str(result['total'])
+    text = f"🔍 <b>Результаты поиска: '{html.escape(search_query)}'</b>\n\n"
+    text += f"📋 Найдено пользователей: <b>{total}</b>\n\n"
 
-    for i, user in enumerate(users[:10], 1):  # Ограничиваем 10 пользователями
+    for i, user in enumerate(users, offset + 1):
         user_id = user['user_id']
-        username = user.get('username', 'нет username')
+        username = html.escape(user.get('username', 'нет username'))
         level = user.get('level', 1)
         xp = user.get('xp', 0)
 
         text += f"<b>{i}. @{username}</b>\n"
         text += f"   🆔 <code>{user_id}</code> | 🎯 Ур. {level} | ⭐ {xp} XP\n\n"
 
-    if len(users) > 10:
-        text += f"<b>... и еще {len(users) - 10} пользователей</b>"
-
     keyboard = InlineKeyboardBuilder()
 
-    # Кнопки для первых 5 пользователей
-    for i, user in enumerate(users[:5]):
+    # Кнопки для первых 5 пользователей страницы
+    for user in users[:5]:
         username = user.get('username', f"User{user['user_id']}")
         keyboard.row(InlineKeyboardButton(
             text=f"👤 {username[:15]}",
             callback_data=f"admin_user_select:{user['user_id']}"
         ))
 
+    navigation = []
+    if offset > 0:
+        navigation.append(InlineKeyboardButton(
+            text="⬅️", callback_data=f"admin_search_page:{max(offset - SEARCH_PAGE_SIZE, 0)}"
+        ))
+    if offset + len(users) < result['total']:
+        navigation.append(InlineKeyboardButton(
+            text="➡️", callback_data=f"admin_search_page:{offset + SEARCH_PAGE_SIZE}"
+        ))
+    if navigation:
+        keyboard.row(*navigation)
+
     keyboard.row(InlineKeyboardButton(text="🔍 Новый поиск", callback_data="admin_find_user"))
     keyboard.row(InlineKeyboardButton(text="⬅️ Назад", callback_data="admin_users"))
 
-    await message.answer(text, reply_markup=keyboard.as_markup(), parse_mode="HTML")
+    if edit:
+        await message.edit_text(text, reply_markup=keyboard.as_markup(), parse_mode="HTML")
+    else:
+        await message.answer(text, reply_markup=keyboard.as_markup(), parse_mode="HTML")
+
+
+@admin_router.callback_query(F.data.startswith("admin_search_page:"))
+async def admin_search_page(callback: types.CallbackQuery, state: FSMContext):
+    """Листание результатов поиска пользователей"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ Нет прав доступа", show_alert=True)
+        return
+
+    search_query = (await state.get_data()).get('search_query')
+    if not search_query:
+        await callback.answer("❌ Поиск устарел, начните новый", show_alert=True)
+        return
+
+    offset = int(callback.data.split(":")[1])
+    result = await db.search_users(search_query, offset=offset)
+    await show_users_list(callback.message, result, search_query, offset, edit=True)
+    await callback.answer()
 
 
 @admin_router.callback_query(F.data.startswith("admin_user_select:"))
@@ -754,21 +858,104 @@ async def admin_top_users(callback: types.CallbackQuery):
         await callback.answer("❌ Нет прав доступа", show_alert=True)
         return
 
-    top_users = await db.get_top_users(20)
-
-    text = "🏆 <b>Топ 20 игроков</b>\n\n"
-
-    for i, user in enumerate(top_users, 1):
-        username = user.get('username', 'Аноним')
-        level = user.get('level', 1)
-        xp = user.get('xp', 0)
-        text += f"{i}. {username} - Ур. {level} ({xp} XP)\n"
+    await show_users_browser(callback, "xp")
+
+
+# ------------------- СПИСОК ПОЛЬЗОВАТЕЛЕЙ -------------------
+BROWSE_ORDER_TITLES = {
+    "xp": "⭐ XP",
+    "level": "🎯 Уровень",
+    "activity": "⚡ Активность",
+    "created": "📅 Регистрация",
+}
+
+
+def encode_browse_cursor(direction: str, position: tuple) -> str:
+    """Курсор страницы для callback_data: a/b (после/перед) + ключ~user_id.
+
+    Время вида "ГГГГ-ММ-ДД ЧЧ:ММ:СС" сжимается до 14 цифр - курсор
+    укладывается в лимит callback_data в 64 байта. Пустое время
+    (BROWSE_NULL_KEY) кодируется пустой строкой.
+    """
+    key, user_id = position
+    if key is None:
+        key = BROWSE_NULL_KEY
+    if isinstance(key, str) and len(key) == 19 and key[4] == "-" and key[10] == " ":
+        key = "".join(ch for ch in key if ch.isdigit())
+    return f"{direction}{key}~{user_id}"
+
+
+def decode_browse_cursor(order: str, token: str) -> tuple:
+    """Обратное к encode_browse_cursor: (направление, (ключ, user_id))"""
+    direction, rest = token[0], token[1:]
+    key, user_id = rest.rsplit("~", 1)
+    if order in ("xp", "level"):
+        key = int(key)
+    elif not key:
+        key = BROWSE_NULL_KEY
+    elif len(key) == 14 and key.isdigit():
+        key = f"{key[:4]}-{key[4:6]}-{key[6:8]} {key[8:10]}:{key[10:12]}:{key[12:]}"
+    return direction, (key, int(user_id))
+
+
+async def show_users_browser(callback: types.CallbackQuery, order: str, page: int = 0, token: str = ""):
+    """Страница списка пользователей: одна выборка по индексу через keyset-курсор"""
+    after = before = None
+    if token:
+        direction, position = decode_browse_cursor(order, token)
+        if direction == "a":
+            after = position
+        else:
+            before = position
+
+    result = await db.browse_users(order, after=after, before=before)
+    # Общее количество - из снимка статистики, без COUNT(*) на каждой странице
+    stats = await system_stats.get()
+    total_pages = max(1, -(-stats['total_users'] // SEARCH_PAGE_SIZE))
+
+    text = f"📋 <b>Пользователи</b> — сортировка: {BROWSE_ORDER_TITLES[order]}\n\n"
+    if not result['users']:
+        text += "Пользователей нет"
+    for i, user in enumerate(result['users'], page * SEARCH_PAGE_SIZE + 1):
+        text += f"<b>{i}. {html.escape(user['username'])}</b> — Ур. {user['level']} ({user['xp']} XP)\n"
+        details = f"🆔 <code>{user['user_id']}</code>"
+        if order == "activity":
+            details += f" | ⚡ {user['last_activity']}"
+        elif order == "created":
+            details += f" | 📅 {user['created_at']}"
+        text += f"   {details}\n"
+
+    sort_buttons = [
+        InlineKeyboardButton(text=title, callback_data=f"ub_{name}_page:0:")
+        for name, title in BROWSE_ORDER_TITLES.items() if name != order
+    ]
+    keyboard = admin_pagination_keyboard(
+        page, total_pages, prefix=f"ub_{order}",
+        additional_buttons=sort_buttons,
+        prev_cursor=encode_browse_cursor("b", result['first']) if result['has_prev'] else None,
+        next_cursor=encode_browse_cursor("a", result['last']) if result['has_next'] else None,
+        back_callback="admin_users"
+    )
+
+    await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
+
+
+@admin_router.callback_query(F.data.startswith("ub_"))
+async def admin_users_browser_page(callback: types.CallbackQuery):
+    """Листание списка пользователей: ub_{сортировка}_page:{страница}:{курсор}"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ Нет прав доступа", show_alert=True)
+        return
 
-    await callback.message.edit_text(
-        text,
-        reply_markup=admin_users_keyboard(),
-        parse_mode="HTML"
-    )
+    try:
+        head, page, token = callback.data.split(":", 2)
+        order = head[len("ub_"):-len("_page")]
+        if order not in BROWSE_ORDER_TITLES:
+            raise ValueError(order)
+        await show_users_browser(callback, order, max(int(page), 0), token)
+        await callback.answer()
+    except (ValueError, IndexError):
+        await callback.answer("❌ Ошибка пагинации", show_alert=True)
 
 
 # ------------------- ИЗМЕНЕНИЕ УРОВНЯ ПОЛЬЗОВАТЕЛЯ -------------------
@@ -933,6 +1120,7 @@ async def admin_user_reset_confirm(callback: types.CallbackQuery):
     try:
         # Сбрасываем прогресс пользователя
         success = await db.reset_user_progress(user_id)
+        await achievement_checker.clear_user_cache(user_id)
 
         if success:
             await callback.message.edit_text(
@@ -1131,37 +1319,270 @@ async def admin_create_backup(callback: types.CallbackQuery):
         await callback.answer("❌ Нет прав доступа", show_alert=True)
         return
 
-    try:
-        # Создаем бэкап данных
-        backup_data = {
-            "timestamp": datetime.datetime.now().isoformat(),
-            "questions": QUESTIONS,
-            "users": await db.get_all_users(),
-            "total_users": await db.get_total_users_count(),
-            "admin_ids": ADMIN_IDS
-        }
+    await callback.answer("⏳ Создаю бэкап...")
+
+    # Части архива пишутся во временную папку и отправляются с диска
+    with tempfile.TemporaryDirectory(prefix="quiz_backup_") as tmp_dir:
+        try:
+            manifest = await create_backup(tmp_dir, extra={
+                "questions_count": len(question_bank),
+                "admin_ids": ADMIN_IDS
+            })
+
+            parts = manifest["parts"]
+            for i, part in enumerate(parts, 1):
+                await callback.message.answer_document(
+                    types.FSInputFile(os.path.join(tmp_dir, part["name"]), filename=part["name"]),
+                    caption=f"💾 Часть {i}/{len(parts)}" if len(parts) > 1 else None
+                )
+
+            tables = manifest["tables"]
+            await callback.message.answer_document(
+                types.FSInputFile(os.path.join(tmp_dir, manifest["manifest_name"]),
+                                  filename=manifest["manifest_name"]),
+                caption=(
+                    f"💾 <b>Бэкап создан</b>\n"
+                    f"• 👥 Пользователей: {tables.get('users', 0)}\n"
+                    f"• ⚔️ Дуэлей: {tables.get('duels', 0)}\n"
+                    f"• 🏆 Достижений: {tables.get('achievements', 0)}\n"
+                    f"• 📦 Размер: {manifest['archive_size'] / 1024 / 1024:.1f} МБ "
+                    f"(база {manifest['db_size'] / 1024 / 1024:.1f} МБ), частей: {len(parts)}\n"
+                    f"• 🔐 SHA-256: <code>{manifest['archive_sha256'][:16]}…</code>"
+                ),
+                parse_mode="HTML"
+            )
+
+        except Exception as e:
+            logger.error(f"Backup error: {e}")
+            await callback.message.answer("❌ Ошибка создания бэкапа")
 
-        filename = f"backup_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
 
-        # Сохраняем во временный файл
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(backup_data, f, ensure_ascii=False, indent=2)
+@admin_router.callback_query(F.data == "admin_incremental_backup")
+async def admin_incremental_backup(callback: types.CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ Нет прав доступа", show_alert=True)
+        return
 
-        # Отправляем файл
-        with open(filename, 'rb') as f:
+    await callback.answer("⏳ Создаю инкрементальный бэкап...")
+
+    try:
+        chain = await create_incremental_backup()
+
+        if chain["kind"] == "full":
+            caption = (
+                f"💾 <b>Новая цепочка бэкапов</b> <code>{chain['chain']}</code>\n"
+                f"Полный бэкап (компактизация), дальше будут дельты."
+            )
+        else:
+            delta = chain["deltas"][-1]
+            caption = (
+                f"🧩 <b>Дельта #{len(chain['deltas'])}</b> цепочки <code>{chain['chain']}</code>\n"
+                f"• ✏️ Изменено строк: {delta['rows']}\n"
+                f"• 🗑 Удалено строк: {delta['deleted']}\n"
+                f"• 📦 Размер: {delta['size'] / 1024:.1f} КБ"
+            )
+
+        # Копия файлов цепочки уходит в чат - на случай потери диска
+        for i, name in enumerate(chain["files"], 1):
             await callback.message.answer_document(
-                types.BufferedInputFile(f.read(), filename=filename),
-                caption=f"💾 Бэкап создан\nПользователей: {backup_data['total_users']}\nВопросов: {len(QUESTIONS)}"
+                types.FSInputFile(os.path.join(chain["dir"], name), filename=name),
+                caption=caption if i == len(chain["files"]) else None,
+                parse_mode="HTML"
+            )
+
+    except Exception as e:
+        logger.error(f"Incremental backup error: {e}")
+        await callback.message.answer("❌ Ошибка создания инкрементального бэкапа")
+
+
+# ------------------- Восстановление из бэкапа -------------------
+# Файлы скачиваются во временную папку, база собирается в теневой файл рядом,
+# проверяется и только после подтверждения атомарно подменяет рабочую (db.restore_from).
+def format_restore_summary(info: dict) -> str:
+    tables = info["tables"]
+    return (
+        f"• 👥 Пользователей: {tables.get('users', 0)}\n"
+        f"• ⚔️ Дуэлей: {tables.get('duels', 0)}\n"
+        f"• 🏆 Достижений: {tables.get('achievements', 0)}\n"
+        f"• 🧬 Версия схемы: {info['schema_version']}\n"
+    )
+
+
+async def discard_restore(state: FSMContext):
+    """Удаляет временные файлы восстановления и выходит из режима"""
+    data = await state.get_data()
+    if data.get("restore_dir"):
+        shutil.rmtree(data["restore_dir"], ignore_errors=True)
+    await state.clear()
+
+
+async def ask_restore_confirmation(message: types.Message, title: str, info: dict):
+    await message.answer(
+        f"✅ <b>{title}</b>\n\n"
+        f"{format_restore_summary(info)}\n"
+        f"⚠️ Текущие данные будут <b>полностью заменены</b>. Продолжить?",
+        reply_markup=confirmation_keyboard(
+            confirm_data="admin_restore_confirm",
+            cancel_data="admin_restore_cancel"
+        ),
+        parse_mode="HTML"
+    )
+
+
+@admin_router.callback_query(F.data == "admin_restore_backup")
+async def admin_restore_backup(callback: types.CallbackQuery, state: FSMContext):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ Нет прав доступа", show_alert=True)
+        return
+
+    await discard_restore(state)
+    await state.set_state(AdminStates.restoring_backup)
+    await state.update_data(restore_dir=tempfile.mkdtemp(prefix="quiz_restore_"))
+
+    text = (
+        "🔄 <b>Восстановление из бэкапа</b>\n\n"
+        "Отправьте файл <code>*.manifest.json</code>, затем все части архива "
+        "(<code>*.db.gz</code> или <code>*.part001</code>, <code>*.part002</code>...).\n\n"
+        "Или выберите локальную цепочку инкрементальных бэкапов:"
+    )
+
+    await callback.message.edit_text(
+        text,
+        reply_markup=admin_restore_keyboard(list_chains()[:5]),
+        parse_mode="HTML"
+    )
+
+
+@admin_router.message(AdminStates.restoring_backup, F.document)
+async def admin_restore_upload(message: types.Message, state: FSMContext):
+    if not is_admin(message.from_user.id):
+        return
+
+    document = message.document
+    data = await state.get_data()
+    restore_dir = data["restore_dir"]
+    manifest = data.get("restore_manifest")
+
+    if document.file_size and document.file_size > TELEGRAM_DOWNLOAD_LIMIT:
+        await message.answer("❌ Файл больше 20 МБ - бот не может его скачать")
+        return
+
+    try:
+        if document.file_name and document.file_name.endswith(".manifest.json"):
+            path = os.path.join(restore_dir, "manifest.json")
+            await message.bot.download(document, destination=path)
+            manifest = load_manifest(path)
+            await state.update_data(restore_manifest=manifest, restore_received=[])
+            await message.answer(
+                f"📋 Манифест от {manifest['created_at']} принят.\n"
+                f"Отправьте части архива: {len(manifest['parts'])} шт."
             )
+            return
+
+        if not manifest:
+            await message.answer("❌ Сначала отправьте файл манифеста (*.manifest.json)")
+            return
+
+        parts = {part["name"]: part for part in manifest["parts"]}
+        part = parts.get(document.file_name)
+        if not part:
+            await message.answer(f"❌ Файл {document.file_name} не входит в этот бэкап")
+            return
+
+        # Части пишутся на диск потоком, в памяти не собираются
+        path = os.path.join(restore_dir, part["name"])
+        await message.bot.download(document, destination=path)
+        if os.path.getsize(path) != part["size"]:
+            await message.answer(f"❌ Размер {part['name']} не совпадает с манифестом")
+            return
+
+        received = sorted(set(data.get("restore_received", [])) | {part["name"]})
+        await state.update_data(restore_received=received)
+        if len(received) < len(parts):
+            await message.answer(f"📥 Получено частей: {len(received)}/{len(parts)}")
+            return
+
+        status = await message.answer("⏳ Распаковываю и проверяю бэкап...")
+        shadow_path = os.path.join(restore_dir, "shadow.db")
+        info = await asyncio.to_thread(prepare_shadow, restore_dir, manifest, shadow_path)
+        await state.update_data(restore_shadow=shadow_path)
+        await status.delete()
+        await ask_restore_confirmation(message, "Бэкап проверен: контрольные суммы и число строк совпадают", info)
+
+    except Exception as e:
+        logger.error(f"Restore upload error: {e}")
+        await discard_restore(state)
+        await message.answer(f"❌ Ошибка восстановления: {e}", reply_markup=admin_backup_keyboard())
+
+
+@admin_router.callback_query(F.data.startswith("admin_restore_chain:"))
+async def admin_restore_chain(callback: types.CallbackQuery, state: FSMContext):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ Нет прав доступа", show_alert=True)
+        return
+
+    name = callback.data.split(":", 1)[1]
+    if name not in {chain["chain"] for chain in list_chains()}:
+        await callback.answer("❌ Цепочка не найдена", show_alert=True)
+        return
+
+    data = await state.get_data()
+    if not data.get("restore_dir"):
+        await callback.answer("❌ Начните восстановление заново", show_alert=True)
+        return
+
+    await callback.answer("⏳ Собираю базу из цепочки...")
+    try:
+        shadow_path = os.path.join(data["restore_dir"], "shadow.db")
+        info = await asyncio.to_thread(prepare_shadow_from_chain, os.path.join(BACKUP_DIR, name), shadow_path)
+        await state.update_data(restore_shadow=shadow_path)
+        await ask_restore_confirmation(
+            callback.message, f"Цепочка {name} собрана: {info['deltas']} дельт применено", info
+        )
+    except Exception as e:
+        logger.error(f"Restore chain error: {e}")
+        await discard_restore(state)
+        await callback.message.answer(f"❌ Ошибка восстановления: {e}", reply_markup=admin_backup_keyboard())
 
-        # Удаляем временный файл
-        Path(filename).unlink()
 
-        await callback.answer("✅ Бэкап успешно создан")
+@admin_router.callback_query(F.data == "admin_restore_confirm")
+async def admin_restore_confirm(callback: types.CallbackQuery, state: FSMContext):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ Нет прав доступа", show_alert=True)
+        return
+
+    data = await state.get_data()
+    shadow_path = data.get("restore_shadow")
+    if not shadow_path or not os.path.exists(shadow_path):
+        await callback.answer("❌ Нет подготовленной копии", show_alert=True)
+        return
 
+    await callback.message.edit_text("⏳ <b>Подменяю базу...</b>", parse_mode="HTML")
+    try:
+        version = await db.restore_from(shadow_path)
+        achievement_checker.clear_all_caches()
+        await question_bank.load()
+        await system_stats.refresh()  # Снимок статистики посчитан по старой базе
+        logger.warning(f"Admin {callback.from_user.id} restored database from backup")
+        await callback.message.edit_text(
+            f"✅ <b>База восстановлена</b>\n\nВерсия схемы: {version}",
+            reply_markup=admin_backup_keyboard(),
+            parse_mode="HTML"
+        )
     except Exception as e:
-        logger.error(f"Backup error: {e}")
-        await callback.answer("❌ Ошибка создания бэкапа", show_alert=True)
+        logger.error(f"Restore swap error: {e}")
+        await callback.message.edit_text(
+            f"❌ Не удалось подменить базу: {e}",
+            reply_markup=admin_backup_keyboard()
+        )
+    finally:
+        await discard_restore(state)
+
+
+@admin_router.callback_query(F.data == "admin_restore_cancel")
+async def admin_restore_cancel(callback: types.CallbackQuery, state: FSMContext):
+    await discard_restore(state)
+    await admin_backup(callback)
 
 
 # ------------------- СИСТЕМА ЛОГОВ -------------------
@@ -1249,47 +1670,112 @@ async def admin_bulk_xp_start(callback: types.CallbackQuery, state: FSMContext):
     await callback.message.edit_text(text, reply_markup=keyboard.as_markup(), parse_mode="HTML")
 
 
+def bulk_progress_reporter(status_message: types.Message, title: str, interval: float = 2.0):
+    """Колбэк прогресса массовой операции: редактирует сообщение не чаще раза в interval секунд"""
+    last_edit = 0.0
+
+    async def report(done: int, total: int):
+        nonlocal last_edit
+        now = time.monotonic()
+        if done < total and now - last_edit < interval:
+            return
+        last_edit = now
+        percent = done * 100 // total if total else 100
+        try:
+            await status_message.edit_text(
+                f"⏳ <b>{title}</b>\n\nОбработано: {done} из {total} ({percent}%)",
+                parse_mode="HTML"
+            )
+        except exceptions.TelegramBadRequest:
+            pass  # Текст не изменился
+
+    return report
+
+
 @admin_router.message(AdminStates.bulk_xp)
 async def admin_bulk_xp_process(message: types.Message, state: FSMContext):
     try:
         xp_amount = int(message.text.strip())
+    except ValueError:
+        await message.answer("❌ Пожалуйста, введите число")
+        return
 
-        if xp_amount <= 0:
-            await message.answer("❌ Количество XP должно быть положительным")
-            return
+    if xp_amount <= 0:
+        await message.answer("❌ Количество XP должно быть положительным")
+        return
 
-        # Получаем всех пользователей
-        all_users = await db.get_all_users()
-        updated_count = 0
-        failed_count = 0
-
-        for user in all_users:
-            try:
-                current_xp = user.get('xp', 0)
-                success = await db.update_user_xp(user['user_id'], current_xp + xp_amount)
-                if success:
-                    updated_count += 1
-                else:
-                    failed_count += 1
-                    logger.warning(f"Failed to update XP for user {user['user_id']}")
-            except (ValueError, TypeError, KeyError) as e:
-                # Ошибки данных пользователя
-                failed_count += 1
-                logger.debug(f"Data error updating XP for user {user.get('user_id', 'unknown')}: {e}")
-            except Exception as e:
-                # Другие ошибки базы данных
-                failed_count += 1
-                logger.error(f"Database error updating XP for user {user.get('user_id', 'unknown')}: {e}")
-
-        response_text = f"✅ Начислено {xp_amount} XP для {updated_count} пользователей"
-        if failed_count > 0:
-            response_text += f"\n❌ Не удалось обновить: {failed_count} пользователей"
-
-        await message.answer(response_text, parse_mode="HTML")
-        await state.clear()
+    await state.clear()
+    status = await message.answer("⏳ <b>Начисление XP</b>\n\nПодготовка...", parse_mode="HTML")
+
+    try:
+        updated_count = await db.bulk_grant_xp(
+            xp_amount, progress=bulk_progress_reporter(status, "Начисление XP")
+        )
+        await status.edit_text(
+            f"✅ Начислено {xp_amount} XP для {updated_count} пользователей",
+            reply_markup=admin_bulk_operations_keyboard(),
+            parse_mode="HTML"
+        )
+    except Exception as e:
+        logger.error(f"Bulk XP error: {e}")
+        await status.edit_text(
+            "❌ Ошибка массового начисления XP. Часть пользователей могла получить XP - см. логи.",
+            reply_markup=admin_bulk_operations_keyboard()
+        )
+
+
+@admin_router.callback_query(F.data == "admin_bulk_reset")
+async def admin_bulk_reset_start(callback: types.CallbackQuery, state: FSMContext):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ Нет прав доступа", show_alert=True)
+        return
+
+    await state.set_state(AdminStates.bulk_reset)
 
+    text = (
+        "🔄 <b>Сброс прогресса неактивным</b>\n\n"
+        "Введите количество дней без активности.\n"
+        "Прогресс будет сброшен всем, кто не играл дольше этого срока:"
+    )
+
+    keyboard = InlineKeyboardBuilder()
+    keyboard.row(InlineKeyboardButton(text="⬅️ Назад", callback_data="admin_bulk_operations"))
+
+    await callback.message.edit_text(text, reply_markup=keyboard.as_markup(), parse_mode="HTML")
+
+
+@admin_router.message(AdminStates.bulk_reset)
+async def admin_bulk_reset_process(message: types.Message, state: FSMContext):
+    try:
+        days = int(message.text.strip())
     except ValueError:
         await message.answer("❌ Пожалуйста, введите число")
+        return
+
+    if days <= 0:
+        await message.answer("❌ Количество дней должно быть положительным")
+        return
+
+    await state.clear()
+    status = await message.answer("⏳ <b>Сброс прогресса</b>\n\nПодготовка...", parse_mode="HTML")
+
+    try:
+        reset_count = await db.bulk_reset_progress(
+            {"inactive_days": days}, progress=bulk_progress_reporter(status, "Сброс прогресса")
+        )
+        achievement_checker.clear_all_caches()
+        await status.edit_text(
+            f"✅ Прогресс сброшен {reset_count} пользователям без активности {days}+ дней",
+            reply_markup=admin_bulk_operations_keyboard(),
+            parse_mode="HTML"
+        )
+    except Exception as e:
+        logger.error(f"Bulk reset error: {e}")
+        achievement_checker.clear_all_caches()
+        await status.edit_text(
+            "❌ Ошибка массового сброса. Часть пользователей могла быть сброшена - см. логи.",
+            reply_markup=admin_bulk_operations_keyboard()
+        )
 
 
 # ------------------- МОНИТОРИНГ СИСТЕМЫ -------------------
@@ -1324,6 +1810,14 @@ async def admin_monitoring(callback: types.CallbackQuery):
         await callback.answer("❌ Нет прав доступа", show_alert=True)
         return
 
+    # Метрики группового коммита БД
+    writer = db.get_writer_metrics()
+    writer_text = (
+        f"🗄 Коммитов БД: {writer['batches']} (≈{writer['avg_batch']} операций на коммит, "
+        f"макс. {writer['max_batch']})\n"
+        f"📥 Очередь записи: {writer['queue_depth']} (пик {writer['max_queue_depth']})\n"
+    )
+
     # Получаем системную информацию
     try:
         system_info = get_system_info()
@@ -1333,7 +1827,8 @@ async def admin_monitoring(callback: types.CallbackQuery):
                 "📊 <b>Мониторинг системы</b>\n\n"
                 f"💾 Память: {system_info['memory_usage']:.1f} MB\n"
                 f"👥 Пользователей: {await db.get_total_users_count()}\n"
-                f"📝 Вопросов: {len(QUESTIONS)}\n"
+                f"📝 Вопросов: {len(question_bank)}\n"
+                f"{writer_text}"
                 f"🔄 Активных сессий: в разработке\n"
                 f"⏰ Аптайм: в разработке\n\n"
                 "⚙️ <b>Статус сервисов:</b>\n"
@@ -1345,7 +1840,8 @@ async def admin_monitoring(callback: types.CallbackQuery):
             text = (
                 "📊 <b>Мониторинг системы</b>\n\n"
                 f"👥 Пользователей: {await db.get_total_users_count()}\n"
-                f"📝 Вопросов: {len(QUESTIONS)}\n\n"
+                f"📝 Вопросов: {len(question_bank)}\n"
+                f"{writer_text}\n"
                 "⚙️ <b>Статус сервисов:</b>\n"
                 "• База данных: ✅\n"
                 "• Бот: ✅\n"
@@ -1358,7 +1854,7 @@ async def admin_monitoring(callback: types.CallbackQuery):
         text = (
             "📊 <b>Мониторинг системы</b>\n\n"
             f"👥 Пользователей: {await db.get_total_users_count()}\n"
-            f"📝 Вопросов: {len(QUESTIONS)}\n\n"
+            f"📝 Вопросов: {len(question_bank)}\n\n"
             "⚙️ <b>Статус сервисов:</b>\n"
             "• База данных: ✅\n"
             "• Бот: ✅\n"
@@ -1373,60 +1869,52 @@ async def admin_monitoring(callback: types.CallbackQuery):
     )
 
 # ------------------- АНАЛИТИКА -------------------
+def format_question_difficulty(question: Optional[dict]) -> str:
+    """Строка "вопрос (точность, ответов)" для экрана аналитики"""
+    if not question:
+        return "мало данных"
+    data = question_bank.get(question['question_id'])
+    title = html.escape(data['question']) if data else f"#{question['question_id']}"
+    return f"{title} ({question['accuracy']}%, ответов: {question['answers']})"
+
+
 @admin_router.callback_query(F.data == "admin_analytics")
 async def admin_analytics(callback: types.CallbackQuery):
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ Нет прав доступа", show_alert=True)
         return
 
-    # Получаем аналитику
+    # Аналитика читается из дневных агрегатов (daily_rollups) - несколько десятков строк
     try:
-        # Безопасный вызов методов, которые могут не существовать
-        try:
-            user_growth = await db.get_user_growth(30)  # За 30 дней
-        except (AttributeError, TypeError):
-            user_growth = {'today': 0, 'week': 0, 'month': 0}
-
-        try:
-            activity_stats = await db.get_activity_stats()
-        except (AttributeError, TypeError):
-            activity_stats = {'avg_session': 'N/A', 'messages_per_day': 'N/A', 'conversion': 'N/A'}
+        user_growth = await db.get_user_growth(30)
+        activity_stats = await db.get_activity_stats(7)
+        difficulty = await db.get_question_difficulty(30)
 
+        avg_session = activity_stats['avg_session']
         text = (
             "📈 <b>Аналитика бота</b>\n\n"
             "📊 <b>Рост пользователей:</b>\n"
-            f"• Новых за сегодня: {user_growth.get('today', 0)}\n"
-            f"• Новых за неделю: {user_growth.get('week', 0)}\n"
-            f"• Новых за месяц: {user_growth.get('month', 0)}\n\n"
-
-            "📈 <b>Активность:</b>\n"
-            f"• Среднее время сессии: {activity_stats.get('avg_session', 'N/A')}\n"
-            f"• Сообщений в день: {activity_stats.get('messages_per_day', 'N/A')}\n"
-            f"• Конверсия: {activity_stats.get('conversion', 'N/A')}%\n\n"
-
-            "🎯 <b>Эффективность вопросов:</b>\n"
-            "• Самый сложный вопрос: в разработке\n"
-            "• Самый легкий вопрос: в разработке\n"
-            "• Средняя точность: в разработке"
+            f"• Новых за сегодня: {user_growth['today']}\n"
+            f"• Новых за неделю: {user_growth['week']}\n"
+            f"• Новых за месяц: {user_growth['month']}\n\n"
+
+            "📈 <b>Активность (в среднем за 7 дней):</b>\n"
+            f"• Активных в день (DAU): {activity_stats['dau']}\n"
+            f"• Среднее время сессии: {avg_session // 60} мин {avg_session % 60} сек\n"
+            f"• Ответов в день: {activity_stats['answers_per_day']}\n"
+            f"• Дуэлей в день: {activity_stats['duels_per_day']}\n"
+            f"• Наград сегодня: {activity_stats['rewards_today']}\n\n"
+
+            "🎯 <b>Эффективность вопросов (30 дней):</b>\n"
+            f"• Самый сложный вопрос: {format_question_difficulty(difficulty['hardest'])}\n"
+            f"• Самый легкий вопрос: {format_question_difficulty(difficulty['easiest'])}\n"
+            f"• Средняя точность: {activity_stats['accuracy']}%"
         )
     except Exception as e:
         logger.error(f"Analytics error: {e}")
         text = (
             "📈 <b>Аналитика бота</b>\n\n"
-            "📊 <b>Рост пользователей:</b>\n"
-            "• Новых за сегодня: в разработке\n"
-            "• Новых за неделю: в разработке\n"
-            "• Новых за месяц: в разработке\n\n"
-
-            "📈 <b>Активность:</b>\n"
-            "• Среднее время сессии: в разработке\n"
-            "• Сообщений в день: в разработке\n"
-            "• Конверсия: в разработке\n\n"
-
-            "🎯 <b>Эффективность вопросов:</b>\n"
-            "• Самый сложный вопрос: в разработке\n"
-            "• Самый легкий вопрос: в разработке\n"
-            "• Средняя точность: в разработке"
+            "❌ Не удалось получить аналитику, попробуйте позже"
         )
 
     await callback.message.edit_text(
@@ -1436,6 +1924,54 @@ async def admin_analytics(callback: types.CallbackQuery):
     )
 
 
+@admin_router.callback_query(F.data == "admin_analytics_daily")
+async def admin_analytics_daily(callback: types.CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ Нет прав доступа", show_alert=True)
+        return
+
+    rows = await db.get_daily_rollups(14)
+
+    text = "📅 <b>Аналитика по дням</b>\n\n"
+    if not rows:
+        text += "Данных пока нет"
+    for row in reversed(rows):
+        accuracy = row['correct'] / row['answers'] * 100 if row['answers'] else 0
+        text += (
+            f"<b>{row['day'][5:]}</b>: 👥 +{row['new_users']} · ⚡ {row['dau']} · "
+            f"🎯 {row['answers']} ({accuracy:.0f}%) · ⚔️ {row['duels']} · 🎁 {row['rewards']}\n"
+        )
+    text += "\n<i>👥 новые · ⚡ активные · 🎯 ответы (точность) · ⚔️ дуэли · 🎁 награды</i>"
+
+    await callback.message.edit_text(
+        text,
+        reply_markup=admin_analytics_keyboard(),
+        parse_mode="HTML"
+    )
+
+
+@admin_router.callback_query(F.data == "admin_analytics_charts")
+async def admin_analytics_charts(callback: types.CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ Нет прав доступа", show_alert=True)
+        return
+
+    heatmap = await db.get_activity_heatmap(14)
+
+    text = "📊 <b>Активные пользователи по дням</b>\n\n"
+    if not heatmap:
+        text += "Данных пока нет"
+    peak = max(heatmap.values(), default=0) or 1
+    for day, dau in heatmap.items():
+        text += f"<code>{day[5:]} {'█' * round(dau / peak * 12):<12}</code> {dau}\n"
+
+    await callback.message.edit_text(
+        text,
+        reply_markup=admin_analytics_keyboard(),
+        parse_mode="HTML"
+    )
+
+
 # ------------------- НАСТРОЙКИ -------------------
 @admin_router.callback_query(F.data == "admin_settings")
 async def admin_settings(callback: types.CallbackQuery):
@@ -1496,21 +2032,34 @@ async def admin_detailed_stats(callback: types.CallbackQuery):
         return
 
     # Получаем расширенную статистику
-    total_users = await db.get_total_users_count()
-    active_today = await db.get_active_users_count(1)
-    active_week = await db.get_active_users_count(7)
-    total_questions = len(QUESTIONS)
+    try:
+        stats = await system_stats.get()
+    except Exception as e:
+        logger.error(f"Error getting stats: {e}")
+        await callback.answer("❌ Ошибка получения статистики", show_alert=True)
+        return
+    total_questions = len(question_bank)
+    accuracy = stats['total_correct_answers'] / stats['total_answers'] * 100 if stats['total_answers'] else 0
 
     text = (
         f"📈 <b>Детальная статистика</b>\n\n"
         f"👥 <b>Пользователи:</b>\n"
-        f"• Всего: {total_users}\n"
-        f"• Активных за сегодня: {active_today}\n"
-        f"• Активных за неделю: {active_week}\n\n"
+        f"• Всего: {stats['total_users']}\n"
+        f"• Новых сегодня: {stats['new_users_today']}\n"
+        f"• Активных за сегодня: {stats['active_today']}\n"
+        f"• Активных за неделю: {stats['active_week']}\n"
+        f"• Активных за месяц: {stats['active_month']}\n\n"
+        f"🎯 <b>Ответы:</b>\n"
+        f"• Всего: {stats['total_answers']}\n"
+        f"• Правильных: {stats['total_correct_answers']} ({accuracy:.1f}%)\n\n"
+        f"🏅 <b>Достижений получено:</b> {stats['total_achievements_unlocked']}\n"
+        f"🎁 <b>Ежедневных наград сегодня:</b> {stats['daily_rewards_today']}\n"
+        f"⚔️ <b>Дуэлей сыграно:</b> {stats['total_duels_played']}\n\n"
         f"📝 <b>Вопросы:</b> {total_questions}\n\n"
         f"⚙️ <b>Система:</b>\n"
         f"• Версия бота: 1.0\n"
-        f"• Админов: {len(ADMIN_IDS)}\n"
+        f"• Админов: {len(ADMIN_IDS)}\n\n"
+        f"🕒 Обновлено {format_age(stats['age'])}"
     )
 
     await callback.message.edit_text(
@@ -1527,14 +2076,37 @@ async def admin_broadcast_stats(callback: types.CallbackQuery):
         await callback.answer("❌ Нет прав доступа", show_alert=True)
         return
 
+    audience = await db.get_delivery_stats()
+    totals = await db.get_broadcast_totals()
+    recent_jobs = await db.get_broadcast_jobs(limit=5)
+
+    reachable_percent = audience['active'] / audience['total'] * 100 if audience['total'] else 0
+    attempted = totals['sent'] + totals['failed']
+    delivery_percent = totals['sent'] / attempted * 100 if attempted else 0
+
     text = (
         "📊 <b>Статистика рассылок</b>\n\n"
-        "📈 В разработке...\n\n"
-        "Здесь будет отображаться статистика по всем рассылкам:\n"
-        "• Количество отправленных сообщений\n"
-        "• Процент доставки\n"
-        "• Активность пользователей"
-    )
+        "👥 <b>Аудитория:</b>\n"
+        f"• Всего пользователей: {audience['total']}\n"
+        f"• ✅ Доступны: {audience['active']} ({reachable_percent:.1f}%)\n"
+        f"• 🚫 Заблокировали бота: {audience['blocked']}\n"
+        f"• ❓ Чат не найден: {audience['not_found']}\n\n"
+        "📢 <b>Рассылки:</b>\n"
+        f"• Всего рассылок: {totals['jobs']}\n"
+        f"• 📤 Доставлено сообщений: {totals['sent']}\n"
+        f"• ❌ Ошибок: {totals['failed']} (недоступны: {totals['unreachable']})\n"
+        f"• 📈 Процент доставки: {delivery_percent:.1f}%\n"
+    )
+
+    if recent_jobs:
+        status_icons = {"running": "📤", "paused": "⏸", "done": "✅", "cancelled": "⛔"}
+        text += "\n🕒 <b>Последние рассылки:</b>\n"
+        for job in recent_jobs:
+            text += (
+                f"{status_icons.get(job['status'], '•')} #{job['job_id']} "
+                f"({str(job['created_at'])[:16]}): {job['sent']}/{job['total']}, "
+                f"ошибок {job['failed']}\n"
+            )
 
     await callback.message.edit_text(
         text,
@@ -1550,18 +2122,7 @@ async def admin_active_users(callback: types.CallbackQuery):
         await callback.answer("❌ Нет прав доступа", show_alert=True)
         return
 
-    text = (
-        "⚡ <b>Активные пользователи</b>\n\n"
-        "📊 В разработке...\n\n"
-        "Здесь будет отображаться список самых активных пользователей\n"
-        "за различные периоды времени."
-    )
-
-    await callback.message.edit_text(
-        text,
-        reply_markup=admin_users_keyboard(),
-        parse_mode="HTML"
-    )
+    await show_users_browser(callback, "activity")
 
 
 # ------------------- Статистика пользователей -------------------
@@ -1571,19 +2132,23 @@ async def admin_users_stats(callback: types.CallbackQuery):
         await callback.answer("❌ Нет прав доступа", show_alert=True)
         return
 
-    total_users = await db.get_total_users_count()
-    active_today = await db.get_active_users_count(1)
-    active_week = await db.get_active_users_count(7)
+    try:
+        stats = await system_stats.get()
+    except Exception as e:
+        logger.error(f"Error getting stats: {e}")
+        await callback.answer("❌ Ошибка получения статистики", show_alert=True)
+        return
 
     text = (
         f"📊 <b>Статистика пользователей</b>\n\n"
         f"👥 <b>Общая статистика:</b>\n"
-        f"• Всего пользователей: {total_users}\n"
-        f"• Активных за сегодня: {active_today}\n"
-        f"• Активных за неделю: {active_week}\n\n"
+        f"• Всего пользователей: {stats['total_users']}\n"
+        f"• Активных за сегодня: {stats['active_today']}\n"
+        f"• Активных за неделю: {stats['active_week']}\n\n"
         f"📈 <b>Активность:</b>\n"
         f"• Онлайн сейчас: в разработке\n"
-        f"• Новых сегодня: в разработке"
+        f"• Новых сегодня: {stats['new_users_today']}\n\n"
+        f"🕒 Обновлено {format_age(stats['age'])}"
     )
 
     await callback.message.edit_text(
@@ -1625,7 +2190,7 @@ async def admin_full_reset(callback: types.CallbackQuery):
         "🔄 <b>Полный сброс системы</b>\n\n"
         f"📊 <b>Текущая статистика:</b>\n"
         f"• Пользователей в системе: {total_users}\n"
-        f"• Вопросов в базе: {len(QUESTIONS)}\n\n"
+        f"• Вопросов в базе: {len(question_bank)}\n\n"
         "⚠️ <b>ВНИМАНИЕ!</b> Это действие:\n"
         "• Обнулит ВСЕХ пользователей\n"
         "• Сбросит весь прогресс (уровни, XP)\n"
@@ -1669,7 +2234,7 @@ async def admin_full_reset_confirm(callback: types.CallbackQuery):
             f"✅ <b>Система полностью сброшена!</b>\n\n"
             f"📊 <b>Результаты:</b>\n"
             f"• 🔄 Сброшено пользователей: {reset_count}\n"
-            f"• 📝 Вопросы сохранены: {len(QUESTIONS)}\n"
+            f"• 📝 Вопросы сохранены: {len(question_bank)}\n"
             f"• 👑 Админы сохранены: {len(ADMIN_IDS)}\n"
             f"• ⚔️ Дуэли очищены\n\n"
             f"🎯 <b>Все пользователи теперь начинают с:</b>\n"
@@ -0,0 +1,455 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import zlib
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from db import db, table_row_counts
+from migrations import latest_version
+
+logger = logging.getLogger(__name__)
+
+# Telegram Bot API принимает документы до 50 МБ, а скачать бот может только до 20 МБ.
+# Части режем под второй лимит, чтобы бэкап можно было восстановить через админку.
+TELEGRAM_DOCUMENT_LIMIT = 50 * 1024 * 1024
+TELEGRAM_DOWNLOAD_LIMIT = 20 * 1024 * 1024
+BACKUP_PART_SIZE = min(int(os.getenv("BACKUP_PART_SIZE", str(19 * 1024 * 1024))), TELEGRAM_DOCUMENT_LIMIT)
+# Размер блока чтения/сжатия: память не зависит от размера базы
+BACKUP_CHUNK_SIZE = 1024 * 1024
+BACKUP_FORMAT = "quiz-bot-backup"
+BACKUP_FORMAT_VERSION = 1
+
+# Инкрементальные бэкапы: цепочки "полный бэкап + дельты" в BACKUP_DIR
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+# Как часто (сек) делать инкрементальный бэкап в фоне; 0 - только вручную из админки
+BACKUP_INTERVAL = float(os.getenv("BACKUP_INTERVAL", "0"))
+# Компактизация: новый полный бэкап после N дельт или когда дельты весят больше доли полного
+BACKUP_COMPACT_EVERY = int(os.getenv("BACKUP_COMPACT_EVERY", "24"))
+BACKUP_COMPACT_RATIO = float(os.getenv("BACKUP_COMPACT_RATIO", "0.5"))
+# Сколько последних цепочек хранить на диске
+BACKUP_KEEP_CHAINS = int(os.getenv("BACKUP_KEEP_CHAINS", "2"))
+# Запас окна дельты (сек): транзакция могла проставить updated_at до метки, а закоммититься после
+BACKUP_DELTA_OVERLAP = 60
+CHAIN_FILE = "chain.json"
+
+# Один инкрементальный бэкап за раз (ручной из админки и фоновый)
+_backup_lock = asyncio.Lock()
+
+
+def _compress_to_parts(src: str, out_dir: str, base_name: str, part_size: int) -> Dict[str, Any]:
+    """Потоково сжимает файл базы в gzip и режет поток на части не больше part_size.
+
+    Части - это куски одного gzip-потока: для восстановления их нужно склеить
+    по порядку. Возвращает контрольные суммы исходника, всего архива и частей.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 - формат gzip
+    db_hash = hashlib.sha256()
+    archive_hash = hashlib.sha256()
+    parts: List[Dict[str, Any]] = []
+    db_size = archive_size = 0
+    part_file = None
+    part_hash = None
+
+    def close_part():
+        nonlocal part_file
+        if part_file:
+            part_file.close()
+            parts[-1]["sha256"] = part_hash.hexdigest()
+            part_file = None
+
+    def write(data: bytes):
+        nonlocal part_file, part_hash, archive_size
+        while data:
+            if part_file is None or parts[-1]["size"] >= part_size:
+                close_part()
+                name = f"{base_name}.db.gz.part{len(parts) + 1:03d}"
+                part_file = open(os.path.join(out_dir, name), "wb")
+                part_hash = hashlib.sha256()
+                parts.append({"name": name, "size": 0})
+            piece = data[:part_size - parts[-1]["size"]]
+            data = data[len(piece):]
+            part_file.write(piece)
+            part_hash.update(piece)
+            archive_hash.update(piece)
+            parts[-1]["size"] += len(piece)
+            archive_size += len(piece)
+
+    try:
+        with open(src, "rb") as f_in:
+            while True:
+                chunk = f_in.read(BACKUP_CHUNK_SIZE)
+                if not chunk:
+                    break
+                db_size += len(chunk)
+                db_hash.update(chunk)
+                write(compressor.compress(chunk))
+        write(compressor.flush())
+    finally:
+        close_part()
+
+    # Одна часть - обычный .db.gz, который открывается любым архиватором
+    if len(parts) == 1:
+        single = f"{base_name}.db.gz"
+        os.replace(os.path.join(out_dir, parts[0]["name"]), os.path.join(out_dir, single))
+        parts[0]["name"] = single
+
+    return {
+        "db_size": db_size,
+        "db_sha256": db_hash.hexdigest(),
+        "archive_size": archive_size,
+        "archive_sha256": archive_hash.hexdigest(),
+        "parts": parts,
+    }
+
+
+async def create_backup(out_dir: str, extra: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Создает бэкап базы в out_dir: сжатые части и manifest.json.
+
+    Копия снимается через backup API SQLite (db.backup_to), сжатие и подсчет
+    контрольных сумм идут в отдельном потоке. Возвращает манифест;
+    пути к файлам: os.path.join(out_dir, part["name"]) и manifest["manifest_name"].
+    """
+    created_at = datetime.now()
+    base_name = f"backup_{created_at.strftime('%Y%m%d_%H%M%S')}"
+    tmp_db = os.path.join(out_dir, f"{base_name}.db")
+
+    try:
+        copy_info = await db.backup_to(tmp_db)
+        archive = await asyncio.to_thread(_compress_to_parts, tmp_db, out_dir, base_name, BACKUP_PART_SIZE)
+    finally:
+        if os.path.exists(tmp_db):
+            os.remove(tmp_db)
+
+    manifest = {
+        "format": BACKUP_FORMAT,
+        "format_version": BACKUP_FORMAT_VERSION,
+        "created_at": created_at.isoformat(timespec="seconds"),
+        "compression": "gzip",
+        "schema_version": copy_info["schema_version"],
+        "tables": copy_info["tables"],
+        "watermark": copy_info["watermark"],
+        **archive,
+        **(extra or {}),
+    }
+    manifest["manifest_name"] = f"{base_name}.manifest.json"
+    with open(os.path.join(out_dir, manifest["manifest_name"]), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    logger.info("💾 Бэкап %s: база %d байт -> %d байт в %d частях",
+                base_name, archive["db_size"], archive["archive_size"], len(archive["parts"]))
+    return manifest
+
+
+# ---------------- Инкрементальные бэкапы ----------------
+
+def _shift_timestamp(timestamp: str, seconds: int) -> str:
+    """Сдвигает метку вида CURRENT_TIMESTAMP ('YYYY-MM-DD HH:MM:SS') на seconds."""
+    moment = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S") + timedelta(seconds=seconds)
+    return moment.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(BACKUP_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _read_json(path: str) -> Dict[str, Any]:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_json_atomic(path: str, data: Dict[str, Any]):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def _list_chains(backup_dir: str) -> List[str]:
+    """Каталоги цепочек по возрастанию времени создания."""
+    if not os.path.isdir(backup_dir):
+        return []
+    return sorted(
+        os.path.join(backup_dir, name) for name in os.listdir(backup_dir)
+        if name.startswith("chain_") and os.path.exists(os.path.join(backup_dir, name, CHAIN_FILE))
+    )
+
+
+def _needs_compaction(chain: Dict[str, Any], schema_version: int) -> bool:
+    deltas_size = sum(delta["size"] for delta in chain["deltas"])
+    return (
+        len(chain["deltas"]) >= BACKUP_COMPACT_EVERY
+        or deltas_size > chain["base_archive_size"] * BACKUP_COMPACT_RATIO
+        or chain["schema_version"] != schema_version  # Дельты пишутся в схеме полного бэкапа
+    )
+
+
+async def _start_chain(backup_dir: str) -> Dict[str, Any]:
+    """Полный бэкап - начало новой цепочки; старые цепочки сверх BACKUP_KEEP_CHAINS удаляются."""
+    chain_dir = os.path.join(backup_dir, f"chain_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+    os.makedirs(chain_dir, exist_ok=True)
+    manifest = await create_backup(chain_dir)
+
+    chain = {
+        "chain": os.path.basename(chain_dir),
+        "base": manifest["manifest_name"],
+        "base_archive_size": manifest["archive_size"],
+        "schema_version": manifest["schema_version"],
+        "watermark": manifest["watermark"],
+        "deltas": [],
+    }
+    _write_json_atomic(os.path.join(chain_dir, CHAIN_FILE), chain)
+
+    chains = _list_chains(backup_dir)
+    for old_dir in chains[:-BACKUP_KEEP_CHAINS]:
+        shutil.rmtree(old_dir, ignore_errors=True)
+        logger.info("🗑 Удалена старая цепочка бэкапов %s", old_dir)
+
+    # Удаления до начала самой старой хранимой цепочки больше не нужны
+    oldest = _read_json(os.path.join(chains[-BACKUP_KEEP_CHAINS:][0], CHAIN_FILE))
+    await db.purge_tombstones(_shift_timestamp(oldest["watermark"], -BACKUP_DELTA_OVERLAP))
+
+    chain["files"] = [part["name"] for part in manifest["parts"]] + [manifest["manifest_name"]]
+    return chain
+
+
+async def create_incremental_backup(backup_dir: str = BACKUP_DIR) -> Dict[str, Any]:
+    """Дельта к последней цепочке или, если пора компактизировать, новый полный бэкап.
+
+    Дельта - gzip NDJSON со строками, измененными после предыдущей метки
+    (см. db.export_changes). Возвращает описание цепочки; chain["files"] -
+    файлы, созданные этим вызовом (относительно каталога цепочки chain["dir"]).
+    """
+    async with _backup_lock:
+        return await _create_incremental_backup(backup_dir)
+
+
+async def _create_incremental_backup(backup_dir: str) -> Dict[str, Any]:
+    chains = _list_chains(backup_dir)
+    schema_version = await db.get_schema_version()
+    chain = _read_json(os.path.join(chains[-1], CHAIN_FILE)) if chains else None
+
+    if chain is None or _needs_compaction(chain, schema_version):
+        chain = await _start_chain(backup_dir)
+        chain["dir"] = os.path.join(backup_dir, chain["chain"])
+        chain["kind"] = "full"
+        return chain
+
+    chain_dir = chains[-1]
+    since = _shift_timestamp(chain["watermark"], -BACKUP_DELTA_OVERLAP)
+    name = f"delta_{len(chain['deltas']) + 1:04d}.ndjson.gz"
+    path = os.path.join(chain_dir, name)
+
+    with gzip.open(f"{path}.tmp", "wt", encoding="utf-8", compresslevel=6) as f:
+        def sink(record):
+            f.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+            f.write("\n")
+
+        sink({"format": "quiz-bot-delta", "chain": chain["chain"], "since": since})
+        result = await db.export_changes(since, sink)
+    os.replace(f"{path}.tmp", path)
+
+    chain["deltas"].append({
+        "name": name,
+        "since": since,
+        "watermark": result["watermark"],
+        "rows": result["rows"],
+        "deleted": result["deleted"],
+        "size": os.path.getsize(path),
+        "sha256": await asyncio.to_thread(_file_sha256, path),
+    })
+    chain["watermark"] = result["watermark"]
+    _write_json_atomic(os.path.join(chain_dir, CHAIN_FILE), chain)
+
+    logger.info("💾 Инкрементальный бэкап %s/%s: %d строк, %d удалений, %d байт",
+                chain["chain"], name, result["rows"], result["deleted"], chain["deltas"][-1]["size"])
+    chain["dir"] = chain_dir
+    chain["kind"] = "delta"
+    chain["files"] = [name, CHAIN_FILE]
+    return chain
+
+
+def _restore_base(chain_dir: str, manifest: Dict[str, Any], target_path: str):
+    """Склеивает части полного бэкапа, распаковывает потоком и сверяет контрольные суммы."""
+    decompressor = zlib.decompressobj(31)
+    archive_hash = hashlib.sha256()
+    db_hash = hashlib.sha256()
+
+    with open(target_path, "wb") as f_out:
+        for part in manifest["parts"]:
+            part_hash = hashlib.sha256()
+            with open(os.path.join(chain_dir, part["name"]), "rb") as f_in:
+                for chunk in iter(lambda: f_in.read(BACKUP_CHUNK_SIZE), b""):
+                    part_hash.update(chunk)
+                    archive_hash.update(chunk)
+                    data = decompressor.decompress(chunk)
+                    db_hash.update(data)
+                    f_out.write(data)
+            if part_hash.hexdigest() != part["sha256"]:
+                raise ValueError(f"Контрольная сумма части {part['name']} не совпадает")
+        data = decompressor.flush()
+        db_hash.update(data)
+        f_out.write(data)
+
+    if archive_hash.hexdigest() != manifest["archive_sha256"] or db_hash.hexdigest() != manifest["db_sha256"]:
+        raise ValueError("Контрольная сумма бэкапа не совпадает")
+
+
+def _apply_delta(conn: sqlite3.Connection, path: str) -> Dict[str, int]:
+    """Применяет дельту одной транзакцией: удаления и upsert строк по таблицам."""
+    applied = {"rows": 0, "deleted": 0}
+    statement = None
+    counter = None  # "rows"/"deleted" - к чему относятся строки текущего раздела
+    batch: List[List[Any]] = []
+
+    def flush():
+        if batch:
+            conn.executemany(statement, batch)
+            batch.clear()
+
+    conn.execute("BEGIN")
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                if isinstance(record, list):
+                    if counter is None:
+                        raise ValueError(f"Дельта {path}: строка данных до заголовка таблицы")
+                    batch.append(record)
+                    applied[counter] += 1
+                    if len(batch) >= 1000:
+                        flush()
+                    continue
+
+                flush()
+                if "columns" in record:
+                    columns = ", ".join(record["columns"])
+                    placeholders = ", ".join("?" * len(record["columns"]))
+                    statement = f"INSERT OR REPLACE INTO {record['table']} ({columns}) VALUES ({placeholders})"
+                    counter = "rows"
+                elif "deleted" in record:
+                    condition = " AND ".join(f"{column} = ?" for column in record["deleted"])
+                    statement = f"DELETE FROM {record['table']} WHERE {condition}"
+                    counter = "deleted"
+        flush()
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return applied
+
+
+def restore_chain(chain_dir: str, target_path: str, upto: Optional[int] = None) -> Dict[str, Any]:
+    """Восстанавливает базу в target_path: полный бэкап цепочки и дельты по порядку.
+
+    upto - сколько дельт применить (None - все). Синхронная функция
+    (вызывать через asyncio.to_thread); target_path перезаписывается.
+    Возвращает {"watermark", "deltas", "rows", "deleted"}.
+    """
+    chain = _read_json(os.path.join(chain_dir, CHAIN_FILE))
+    manifest = _read_json(os.path.join(chain_dir, chain["base"]))
+    deltas = chain["deltas"][:upto] if upto is not None else chain["deltas"]
+
+    for delta in deltas:
+        if _file_sha256(os.path.join(chain_dir, delta["name"])) != delta["sha256"]:
+            raise ValueError(f"Контрольная сумма дельты {delta['name']} не совпадает")
+
+    _restore_base(chain_dir, manifest, target_path)
+
+    result = {"watermark": manifest["watermark"], "deltas": 0, "rows": 0, "deleted": 0}
+    conn = sqlite3.connect(target_path, isolation_level=None)
+    try:
+        # Порядок строк в дельте не учитывает внешние ключи; REPLACE не должен каскадно удалять детей
+        conn.execute("PRAGMA foreign_keys = OFF")
+        for delta in deltas:
+            applied = _apply_delta(conn, os.path.join(chain_dir, delta["name"]))
+            result["deltas"] += 1
+            result["rows"] += applied["rows"]
+            result["deleted"] += applied["deleted"]
+            result["watermark"] = delta["watermark"]
+        integrity = conn.execute("PRAGMA integrity_check").fetchone()[0]
+        if integrity != "ok":
+            raise ValueError(f"Восстановленная база повреждена: {integrity}")
+    finally:
+        conn.close()
+
+    logger.info("✅ База восстановлена из %s: %d дельт, %d строк, %d удалений",
+                chain_dir, result["deltas"], result["rows"], result["deleted"])
+    return result
+
+
+# ---------------- Восстановление ----------------
+
+def load_manifest(path: str) -> Dict[str, Any]:
+    """Читает и проверяет манифест полного бэкапа"""
+    manifest = _read_json(path)
+    if manifest.get("format") != BACKUP_FORMAT:
+        raise ValueError("Это не манифест бэкапа")
+    if manifest.get("format_version", 0) > BACKUP_FORMAT_VERSION:
+        raise ValueError("Бэкап создан более новой версией бота")
+    for part in manifest.get("parts", []):
+        if os.path.basename(part["name"]) != part["name"]:
+            raise ValueError(f"Недопустимое имя части: {part['name']}")
+    return manifest
+
+
+def validate_shadow(shadow_path: str, expected_tables: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+    """Проверяет теневую базу перед подменой: целостность, версию схемы, число строк.
+
+    Возвращает {"schema_version", "tables"}; при расхождении - ValueError.
+    """
+    conn = sqlite3.connect(shadow_path)
+    try:
+        check = conn.execute("PRAGMA quick_check").fetchone()[0]
+    finally:
+        conn.close()
+    if check != "ok":
+        raise ValueError(f"Копия базы повреждена: {check}")
+
+    version, tables = table_row_counts(shadow_path)
+    if version > latest_version():
+        raise ValueError(f"Схема бэкапа ({version}) новее схемы бота ({latest_version()})")
+    if expected_tables is not None:
+        mismatched = [table for table, count in expected_tables.items() if tables.get(table) != count]
+        if mismatched:
+            raise ValueError(f"Число строк не совпадает с манифестом: {', '.join(mismatched)}")
+    return {"schema_version": version, "tables": tables}
+
+
+def prepare_shadow(backup_dir: str, manifest: Dict[str, Any], shadow_path: str) -> Dict[str, Any]:
+    """Собирает теневую базу из скачанных частей полного бэкапа и проверяет ее.
+
+    Синхронная функция (вызывать через asyncio.to_thread).
+    """
+    _restore_base(backup_dir, manifest, shadow_path)
+    return validate_shadow(shadow_path, manifest["tables"])
+
+
+def prepare_shadow_from_chain(chain_dir: str, shadow_path: str) -> Dict[str, Any]:
+    """Собирает теневую базу из локальной цепочки (полный бэкап + дельты) и проверяет ее."""
+    result = restore_chain(chain_dir, shadow_path)
+    return {**validate_shadow(shadow_path), **result}
+
+
+def list_chains(backup_dir: str = BACKUP_DIR) -> List[Dict[str, Any]]:
+    """Локальные цепочки бэкапов, новые первыми"""
+    return [_read_json(os.path.join(chain_dir, CHAIN_FILE)) for chain_dir in reversed(_list_chains(backup_dir))]
+
+
+async def incremental_backup_loop():
+    """Фоновые инкрементальные бэкапы раз в BACKUP_INTERVAL секунд"""
+    while True:
+        await asyncio.sleep(BACKUP_INTERVAL)
+        try:
+            await create_incremental_backup()
+        except Exception as e:
+            logger.error("❌ Ошибка инкрементального бэкапа: %s", e)
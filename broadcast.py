@@ -0,0 +1,346 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+from db import db, REACHABLE_SQL
+from keyboards import broadcast_control_keyboard
+
+logger = logging.getLogger(__name__)
+
+# Глобальный лимит Telegram ~30 сообщений/сек - держим запас
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+# Не чаще одного сообщения в секунду в один чат
+BROADCAST_PER_CHAT_INTERVAL = 1.0
+# Сколько отправок выполняется одновременно
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "8"))
+# Как часто (сек) сохранять курсор и обновлять сообщение с прогрессом
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "3"))
+# Сколько раз повторять отправку после RetryAfter
+BROADCAST_MAX_RETRIES = 3
+
+
+class TokenBucket:
+    """Ограничитель скорости "ведро токенов": rate токенов в секунду, запас до capacity.
+
+    block() останавливает выдачу токенов всем отправителям (ответ 429 RetryAfter).
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()  # Очередь ожидающих - по порядку прихода
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def block(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+
+class ChatRateLimiter:
+    """Минимальный интервал между сообщениями в один чат."""
+
+    def __init__(self, interval: float = BROADCAST_PER_CHAT_INTERVAL, max_tracked: int = 10000):
+        self.interval = interval
+        self.max_tracked = max_tracked
+        self._next_slot: Dict[int, float] = {}
+
+    async def acquire(self, chat_id: int):
+        now = time.monotonic()
+        if len(self._next_slot) > self.max_tracked:
+            # Забываем чаты, в которые уже можно писать без ожидания
+            self._next_slot = {c: t for c, t in self._next_slot.items() if t > now}
+        slot = max(now, self._next_slot.get(chat_id, 0.0))
+        self._next_slot[chat_id] = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+def delivery_status_for_error(error: Exception) -> Optional[str]:
+    """Статус доставки по ошибке Telegram: blocked / not_found или None (временная ошибка)"""
+    if isinstance(error, TelegramForbiddenError):
+        return "blocked"  # Бот заблокирован или аккаунт удален
+    if isinstance(error, TelegramAPIError) and "chat not found" in str(error).lower():
+        return "not_found"
+    return None
+
+
+async def record_delivery_failure(user_id: int, error: Exception) -> bool:
+    """Запоминает недоступность пользователя, если ошибка окончательная. True - помечен"""
+    status = delivery_status_for_error(error)
+    if not status:
+        return False
+    try:
+        await db.mark_undeliverable(user_id, status)
+    except Exception as e:
+        logger.error("Не удалось сохранить статус доставки %s: %s", user_id, e)
+    return True
+
+
+def format_eta(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600} ч {seconds % 3600 // 60} мин"
+    if seconds >= 60:
+        return f"{seconds // 60} мин {seconds % 60} сек"
+    return f"{seconds} сек"
+
+
+class BroadcastManager:
+    """Рассылки как задания в БД: ограничение скорости, параллельная отправка, продолжение после сбоя.
+
+    Получатели (только с delivery_status = 'active') перебираются по
+    возрастанию user_id. Курсор задания - наибольший
+    user_id, до которого включительно все отправки завершены; он сохраняется
+    каждые BROADCAST_PROGRESS_INTERVAL секунд. После перезапуска или паузы
+    рассылка продолжается с курсора: повторно могут уйти только сообщения,
+    которые были в полете в момент сбоя.
+    """
+
+    def __init__(self):
+        self.bucket = TokenBucket(BROADCAST_RATE)
+        self.chat_limiter = ChatRateLimiter()
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._stop_requests: Dict[int, str] = {}  # job_id -> "paused" / "cancelled"
+
+    # ---------------- Отправка ----------------
+
+    async def send(self, bot: Bot, chat_id: int, text: str) -> str:
+        """Отправляет одно сообщение с учетом лимитов.
+
+        Возвращает "sent", статус недоступности ("blocked" / "not_found") или "failed".
+        """
+        for _ in range(BROADCAST_MAX_RETRIES + 1):
+            await self.bucket.acquire()
+            await self.chat_limiter.acquire(chat_id)
+            try:
+                await bot.send_message(chat_id=chat_id, text=text)
+                return "sent"
+            except TelegramRetryAfter as e:
+                # Telegram просит подождать - останавливаем всех отправителей
+                logger.warning("⏳ RetryAfter %s сек при рассылке", e.retry_after)
+                self.bucket.block(e.retry_after)
+            except TelegramAPIError as e:
+                logger.debug("Рассылка: не доставлено %s: %s", chat_id, e)
+                return delivery_status_for_error(e) or "failed"
+        return "failed"
+
+    # ---------------- Управление заданиями ----------------
+
+    def is_running(self, job_id: int) -> bool:
+        return job_id in self._tasks
+
+    async def start(self, bot: Bot, text: str, admin_chat_id: int, status_message_id: int) -> int:
+        """Создает задание рассылки всем доступным пользователям и запускает его"""
+        total = await db.get_reachable_users_count()
+        job_id = await db.create_broadcast_job(text, total, admin_chat_id, status_message_id)
+        self._launch(bot, job_id)
+        logger.info("📢 Рассылка #%d запущена: %d получателей", job_id, total)
+        return job_id
+
+    async def pause(self, job_id: int):
+        await self._stop(job_id, "paused")
+
+    async def cancel(self, job_id: int):
+        await self._stop(job_id, "cancelled")
+
+    async def resume(self, bot: Bot, job_id: int) -> bool:
+        job = await db.get_broadcast_job(job_id)
+        if not job or job["status"] != "paused" or self.is_running(job_id):
+            return False
+        await db.update_broadcast_job(job_id, status="running")
+        self._launch(bot, job_id)
+        return True
+
+    async def resume_unfinished(self, bot: Bot):
+        """Продолжает рассылки, прерванные перезапуском бота"""
+        for job in await db.get_broadcast_jobs(("running",), limit=100):
+            if not self.is_running(job["job_id"]):
+                logger.info("🔄 Продолжаем рассылку #%d с user_id > %d", job["job_id"], job["cursor_user_id"])
+                self._launch(bot, job["job_id"])
+
+    async def shutdown(self):
+        """Останавливает рассылки при выключении (они останутся running и продолжатся при старте)"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _stop(self, job_id: int, status: str):
+        task = self._tasks.get(job_id)
+        if task:
+            self._stop_requests[job_id] = status
+            await asyncio.gather(task, return_exceptions=True)
+        else:
+            job = await db.get_broadcast_job(job_id)
+            if job and job["status"] in ("running", "paused"):
+                await db.update_broadcast_job(job_id, status=status)
+
+    def _launch(self, bot: Bot, job_id: int):
+        task = asyncio.create_task(self._run(bot, job_id), name=f"broadcast-{job_id}")
+        self._tasks[job_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job_id, None))
+
+    # ---------------- Выполнение ----------------
+
+    async def _run(self, bot: Bot, job_id: int):
+        job = await db.get_broadcast_job(job_id)
+        if not job:
+            return
+
+        cursor = job["cursor_user_id"]
+        counts = {"sent": job["sent"], "failed": job["failed"], "unreachable": job["unreachable"] or 0}
+        # Окно отправок по порядку user_id: [user_id, завершена]
+        window: Deque[List] = deque()
+        in_flight: Dict[int, List] = {}
+        queue: asyncio.Queue = asyncio.Queue(maxsize=BROADCAST_CONCURRENCY * 2)
+        started = time.monotonic()
+        processed_at_start = counts["sent"] + counts["failed"]
+
+        def advance_cursor() -> int:
+            nonlocal cursor
+            while window and window[0][1]:
+                cursor = window.popleft()[0]
+            return cursor
+
+        async def save(status: str = "running"):
+            await db.update_broadcast_job(job_id, status=status, cursor_user_id=advance_cursor(),
+                                          sent=counts["sent"], failed=counts["failed"],
+                                          unreachable=counts["unreachable"])
+
+        async def worker():
+            while True:
+                user_id = await queue.get()
+                if user_id is None:
+                    return
+                try:
+                    result = await self.send(bot, user_id, job["text"])
+                    if result in ("blocked", "not_found"):
+                        # Следующие рассылки пропустят пользователя до его /start
+                        await db.mark_undeliverable(user_id, result)
+                        counts["unreachable"] += 1
+                except Exception as e:
+                    logger.error("Рассылка #%d: ошибка отправки %s: %s", job_id, user_id, e)
+                    result = "failed"
+                counts["sent" if result == "sent" else "failed"] += 1
+                in_flight.pop(user_id)[1] = True
+
+        async def report_loop():
+            while True:
+                await asyncio.sleep(BROADCAST_PROGRESS_INTERVAL)
+                await save()
+                await self._report(bot, job, counts, "running", started, processed_at_start)
+
+        workers = [asyncio.create_task(worker()) for _ in range(BROADCAST_CONCURRENCY)]
+        reporter = asyncio.create_task(report_loop())
+        status = "done"
+        try:
+            async for (user_id,) in db.iter_users(where=f"user_id > ? AND {REACHABLE_SQL}", params=(cursor,)):
+                if job_id in self._stop_requests:
+                    status = self._stop_requests.pop(job_id)
+                    break
+                entry = [user_id, False]
+                window.append(entry)
+                in_flight[user_id] = entry
+                await queue.put(user_id)
+
+            # Поставленные, но не начатые отправки при паузе не выполняем - курсор остановится перед ними
+            if status != "done":
+                while not queue.empty():
+                    queue.get_nowait()
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        except asyncio.CancelledError:
+            # Выключение бота: задание остается running и продолжится при следующем старте
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            status = "running"
+            raise
+        except Exception as e:
+            logger.error("❌ Рассылка #%d прервана: %s", job_id, e)
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            status = "paused"
+        finally:
+            self._stop_requests.pop(job_id, None)
+            reporter.cancel()
+            await asyncio.gather(reporter, return_exceptions=True)
+            try:
+                await save(status)
+                if status != "running":
+                    await self._report(bot, job, counts, status, started, processed_at_start)
+            except Exception as e:
+                logger.error("❌ Не удалось сохранить прогресс рассылки #%d: %s", job_id, e)
+
+        logger.info("📢 Рассылка #%d: %s (отправлено %d, ошибок %d)",
+                    job_id, status, counts["sent"], counts["failed"])
+
+    async def _report(self, bot: Bot, job: Dict, counts: Dict[str, int], status: str,
+                      started: float, processed_at_start: int):
+        """Обновляет сообщение администратора с прогрессом рассылки"""
+        if not job["admin_chat_id"] or not job["status_message_id"]:
+            return
+
+        total = max(job["total"], 1)
+        processed = counts["sent"] + counts["failed"]
+        percent = min(100, processed * 100 // total)
+        elapsed = time.monotonic() - started
+        rate = (processed - processed_at_start) / elapsed if elapsed > 0 else 0
+
+        titles = {
+            "running": "📤 <b>Рассылка #{job_id} идет</b>",
+            "paused": "⏸ <b>Рассылка #{job_id} на паузе</b>",
+            "cancelled": "⛔ <b>Рассылка #{job_id} отменена</b>",
+            "done": "✅ <b>Рассылка #{job_id} завершена!</b>",
+        }
+        text = (
+            f"{titles[status].format(job_id=job['job_id'])}\n\n"
+            f"• 📤 Отправлено: {counts['sent']}\n"
+            f"• ❌ Ошибок: {counts['failed']} (недоступны: {counts['unreachable']})\n"
+            f"• 👥 Всего: {job['total']}\n"
+            f"• 📊 Прогресс: {percent}%\n"
+        )
+        if status == "running" and rate > 0:
+            eta = max(0, job["total"] - processed) / rate
+            text += f"• ⚡ Скорость: {rate:.1f} сообщ./сек\n• ⏱ Осталось: ~{format_eta(eta)}\n"
+
+        try:
+            await bot.edit_message_text(
+                text=text,
+                chat_id=job["admin_chat_id"],
+                message_id=job["status_message_id"],
+                reply_markup=broadcast_control_keyboard(job["job_id"], status),
+                parse_mode="HTML"
+            )
+        except TelegramBadRequest:
+            pass  # Сообщение не изменилось или удалено
+        except TelegramAPIError as e:
+            logger.debug("Не удалось обновить прогресс рассылки: %s", e)
+
+
+# Глобальный менеджер рассылок
+broadcast_manager = BroadcastManager()
@@ -0,0 +1,105 @@
+import time
+from typing import Dict, List, Tuple
+
+
+class StatsCounters:
+    """Агрегирует счетчики ответов в памяти до периодического сброса в БД.
+
+    Ключи: (user_id, category) для category_stats и user_id для user_stats.
+    Значение счетчика - [всего_ответов, правильных, время_последнего_ответа].
+    """
+
+    def __init__(self):
+        self._categories: Dict[int, Dict[str, List]] = {}  # user_id -> category -> счетчик
+        self._totals: Dict[int, List] = {}  # user_id -> счетчик
+        # Данные, которые сейчас записываются в БД (видны при чтении до конца записи)
+        self._inflight_categories: Dict[int, Dict[str, List]] = {}
+        self._inflight_totals: Dict[int, List] = {}
+
+    def __len__(self) -> int:
+        return len(self._totals) + sum(len(c) for c in self._categories.values())
+
+    @staticmethod
+    def _bump(counter: List, is_correct: bool, ts: float):
+        counter[0] += 1
+        counter[1] += 1 if is_correct else 0
+        counter[2] = max(counter[2], ts)
+
+    def add_answer(self, user_id: int, category: str, is_correct: bool):
+        """Учитывает ответ пользователя (O(1), без обращения к БД)."""
+        ts = time.time()
+        user_categories = self._categories.setdefault(user_id, {})
+        self._bump(user_categories.setdefault(category, [0, 0, 0.0]), is_correct, ts)
+        self._bump(self._totals.setdefault(user_id, [0, 0, 0.0]), is_correct, ts)
+
+    def drain(self) -> Tuple[List[Tuple], List[Tuple]]:
+        """Переносит накопленные дельты в "записываемые" и возвращает строки для executemany.
+
+        Категории: (user_id, category, total, correct, ts), итоги: (user_id, total, correct, ts).
+        """
+        self._inflight_categories, self._categories = self._categories, {}
+        self._inflight_totals, self._totals = self._totals, {}
+
+        category_rows = [
+            (user_id, category, c[0], c[1], c[2])
+            for user_id, categories in self._inflight_categories.items()
+            for category, c in categories.items()
+        ]
+        total_rows = [(user_id, c[0], c[1], c[2]) for user_id, c in self._inflight_totals.items()]
+        return category_rows, total_rows
+
+    def categories_written(self):
+        """Дельты категорий записаны в БД - больше не добавляем их при чтении."""
+        self._inflight_categories = {}
+
+    def totals_written(self):
+        """Дельты итогов записаны в БД - больше не добавляем их при чтении."""
+        self._inflight_totals = {}
+
+    def restore(self, category_rows: List[Tuple], total_rows: List[Tuple]):
+        """Возвращает дельты обратно после неудачной записи."""
+        self._inflight_categories = {}
+        self._inflight_totals = {}
+        for user_id, category, total, correct, ts in category_rows:
+            c = self._categories.setdefault(user_id, {}).setdefault(category, [0, 0, 0.0])
+            c[0] += total
+            c[1] += correct
+            c[2] = max(c[2], ts)
+        for user_id, total, correct, ts in total_rows:
+            c = self._totals.setdefault(user_id, [0, 0, 0.0])
+            c[0] += total
+            c[1] += correct
+            c[2] = max(c[2], ts)
+
+    def pending_categories(self, user_id: int) -> Dict[str, List]:
+        """Незаписанные дельты пользователя по категориям: category -> [total, correct, ts]."""
+        merged: Dict[str, List] = {}
+        for source in (self._inflight_categories, self._categories):
+            for category, c in source.get(user_id, {}).items():
+                m = merged.setdefault(category, [0, 0, 0.0])
+                m[0] += c[0]
+                m[1] += c[1]
+                m[2] = max(m[2], c[2])
+        return merged
+
+    def pending_totals(self, user_id: int) -> Tuple[int, int]:
+        """Незаписанные дельты пользователя: (total, correct)."""
+        total = correct = 0
+        for source in (self._inflight_totals, self._totals):
+            c = source.get(user_id)
+            if c:
+                total += c[0]
+                correct += c[1]
+        return total, correct
+
+    def discard(self, user_id: int):
+        """Забывает дельты пользователя (сброс прогресса/удаление)."""
+        for source in (self._categories, self._totals, self._inflight_categories, self._inflight_totals):
+            source.pop(user_id, None)
+
+    def clear(self):
+        """Забывает все дельты (полный сброс)."""
+        self._categories.clear()
+        self._totals.clear()
+        self._inflight_categories = {}
+        self._inflight_totals = {}
@@ -1,10 +1,26 @@
 import aiosqlite
+import asyncio
+import gzip
 import json
 import os
-from typing import List, Dict, Any, Optional
-from datetime import datetime, timedelta
+import shutil
+import sqlite3
+import time
+from contextlib import asynccontextmanager
+from contextvars import Context, ContextVar
+from functools import partial
+from pathlib import Path
+from typing import List, Dict, Any, Optional, AsyncIterator, Awaitable, Callable, Iterable, Sequence, Tuple
+from datetime import date, datetime, timedelta, timezone
 import logging
 
+from counters import StatsCounters
+from events import (ANSWER_EVENT_COLUMNS, AnswerEventBuffer, group_by_partition, now_ts, partition_ddl,
+                    partition_name, view_sql)
+from leaderboard import Leaderboard, XPHistogram, rank_info
+from question_history import AskedQuestions, blob_to_bits
+from migrations import apply_migrations, get_schema_version
+
 logger = logging.getLogger(__name__)
 
 # КРИТИЧЕСКИ ВАЖНО ДЛЯ RENDER!
@@ -13,30 +29,660 @@ if os.getenv("RENDER"):
 else:
     DB_PATH = "quiz.db"
 
+# Профили прагм SQLite (выбираются переменной DB_PROFILE)
+PRAGMA_PROFILES: Dict[str, Dict[str, Any]] = {
+    # Максимальная надежность: fsync на каждый коммит
+    "durable": {"synchronous": "FULL", "cache_size": -8000, "mmap_size": 0, "busy_timeout": 5000},
+    # По умолчанию: в WAL режиме NORMAL не теряет целостность при сбое
+    "balanced": {"synchronous": "NORMAL", "cache_size": -16000, "mmap_size": 64 * 1024 * 1024, "busy_timeout": 5000},
+    # Для Render/тестов, где важнее задержка, чем fsync
+    "fast": {"synchronous": "OFF", "cache_size": -64000, "mmap_size": 256 * 1024 * 1024, "busy_timeout": 10000},
+}
+DB_PROFILE = os.getenv("DB_PROFILE", "balanced")
+# Количество read-only соединений в пуле (0 - пул выключен)
+DB_READERS = int(os.getenv("DB_READERS", "2"))
+# Групповой коммит: коммитим каждые N операций или каждые M мс - что наступит раньше
+DB_COMMIT_BATCH = int(os.getenv("DB_COMMIT_BATCH", "64"))
+DB_COMMIT_INTERVAL_MS = float(os.getenv("DB_COMMIT_INTERVAL_MS", "5"))
+# Размер очереди записи: при переполнении пишущие корутины ждут (backpressure)
+DB_WRITE_QUEUE = int(os.getenv("DB_WRITE_QUEUE", "1000"))
+# Как часто (сек) сбрасывать накопленные в памяти счетчики ответов в БД
+STATS_FLUSH_INTERVAL = float(os.getenv("STATS_FLUSH_INTERVAL", "5"))
+# Журнал ответов answer_events: размер кольцевого буфера в памяти, размер пачки
+# для внеочередной записи, длина раздела (сутки) и срок хранения (сутки, 0 - вечно)
+ANSWER_EVENTS_BUFFER = int(os.getenv("ANSWER_EVENTS_BUFFER", "50000"))
+ANSWER_EVENTS_FLUSH_SIZE = int(os.getenv("ANSWER_EVENTS_FLUSH_SIZE", "2000"))
+ANSWER_EVENTS_PARTITION_DAYS = int(os.getenv("ANSWER_EVENTS_PARTITION_DAYS", "7"))
+ANSWER_EVENTS_RETENTION_DAYS = int(os.getenv("ANSWER_EVENTS_RETENTION_DAYS", "180"))
+# Сколько масок заданных вопросов держать в памяти (остальные - в user_question_history)
+ASKED_HISTORY_CACHE = int(os.getenv("ASKED_HISTORY_CACHE", "100000"))
+# Дневные агрегаты для аналитики: как часто (сек) досчитывать, сколько дней истории
+# заполнить при первом запуске и пауза (сек), после которой ответы считаются новой сессией
+ROLLUP_INTERVAL = float(os.getenv("ROLLUP_INTERVAL", "300"))
+ROLLUP_BACKFILL_DAYS = int(os.getenv("ROLLUP_BACKFILL_DAYS", "30"))
+ROLLUP_SESSION_GAP = int(os.getenv("ROLLUP_SESSION_GAP", "1800"))
+# Поиск пользователей в админ-панели: результатов на странице и сколько совпадений рассматривать
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", "10"))
+SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", "1000"))
+# Снимки :memory: базы (Render): сжатая копия на диске, восстанавливается при старте
+DB_SNAPSHOT_PATH = os.getenv("DB_SNAPSHOT_PATH", "quiz_snapshot.db.gz")
+DB_SNAPSHOT_INTERVAL = float(os.getenv("DB_SNAPSHOT_INTERVAL", "300"))
+# Как часто (сек) сверять таблицу лидеров в памяти с таблицей users
+LEADERBOARD_RECONCILE_INTERVAL = float(os.getenv("LEADERBOARD_RECONCILE_INTERVAL", "600"))
+# Массовые операции над пользователями: сколько строк обрабатывать за одну запись
+DB_BULK_BATCH = int(os.getenv("DB_BULK_BATCH", "5000"))
+
+# Кривая уровней: каждые XP_PER_LEVEL опыта = +1 уровень (считается прямо в SQL)
+XP_PER_LEVEL = 100
+
+# Атомарное начисление XP: создает пользователя или прибавляет опыт одним запросом.
+# В DO UPDATE SET колонки ссылаются на старые значения строки, поэтому level
+# вычисляется от (старый xp + дельта), а не от уже обновленного xp.
+ADD_XP_SQL = f"""
+    INSERT INTO users (user_id, username, level, xp, max_combo, created_at, last_active)
+    VALUES (:user_id, '', :delta / {XP_PER_LEVEL} + 1, :delta, 0, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+    ON CONFLICT(user_id) DO UPDATE SET
+        xp = xp + excluded.xp,
+        level = (xp + excluded.xp) / {XP_PER_LEVEL} + 1
+"""
+
+# Итог дуэли для игрока: (user_id, win, loss, win, loss)
+UPDATE_DUEL_STATS_SQL = """
+    INSERT INTO duel_stats (user_id, total_duels, wins, losses, last_duel)
+    VALUES (?, 1, ?, ?, CURRENT_TIMESTAMP)
+    ON CONFLICT(user_id)
+    DO UPDATE SET
+        total_duels = total_duels + 1,
+        wins = wins + ?,
+        losses = losses + ?,
+        last_duel = CURRENT_TIMESTAMP
+"""
+
+# Колонки broadcast_jobs в порядке выборки (для словарей заданий рассылки)
+_BROADCAST_JOB_COLUMNS = ("job_id", "text", "status", "cursor_user_id", "total", "sent", "failed",
+                          "unreachable", "admin_chat_id", "status_message_id", "created_at", "updated_at",
+                          "finished_at")
+
+# Таблицы с отслеживанием изменений (updated_at + row_tombstones, миграция 8) и их ключи
+CHANGE_TRACKED_TABLES = {
+    "users": ("user_id",),
+    "user_stats": ("user_id",),
+    "category_stats": ("user_id", "category"),
+    "daily_rewards": ("user_id",),
+    "achievements": ("user_id", "achievement_id"),
+    "duel_stats": ("user_id",),
+    "duels": ("duel_id",),
+    "duel_participants": ("duel_id", "user_id"),
+    "question_categories": ("category_id",),
+    "questions": ("question_id",),
+    "user_question_history": ("user_id",),
+}
+
+# Сортировки списка пользователей в админ-панели: имя -> (ключ, источник строк).
+# Каждой соответствует индекс (ключ, user_id), см. миграции 9 и 13
+# Ключ сортировки - выражение ровно как в индексе (миграция 13). Время может быть NULL
+# (пользователи до миграций): сравнение с NULL не истинно, поэтому NULL заменяется на
+# BROWSE_NULL_KEY - такие строки идут в конце списка
+BROWSE_NULL_KEY = ""
+USER_BROWSE_ORDERS = {
+    "xp": ("u.xp", "users u LEFT JOIN user_stats s ON s.user_id = u.user_id"),
+    "level": ("u.level", "users u LEFT JOIN user_stats s ON s.user_id = u.user_id"),
+    "created": ("COALESCE(u.created_at, '')", "users u LEFT JOIN user_stats s ON s.user_id = u.user_id"),
+    "activity": ("COALESCE(s.last_activity, '')", "user_stats s JOIN users u ON u.user_id = s.user_id"),
+}
+
+# Статусы доставки users.delivery_status (см. миграцию 7)
+DELIVERY_STATUSES = ("active", "blocked", "not_found")
+# Условие "сообщения доходят" - дословно как в частичном индексе idx_users_reachable
+REACHABLE_SQL = "delivery_status = 'active'"
+
+# Колбэк прогресса массовых операций: (обработано, всего)
+ProgressCallback = Callable[[int, int], Awaitable[None]]
+
+# Последняя активность пользователя для фильтров по времени
+_USER_ACTIVITY_SQL = """
+    COALESCE((SELECT s.last_activity FROM user_stats s WHERE s.user_id = users.user_id), users.last_active)
+"""
+
+
+def _cohort_filter(cohort: Optional[Dict[str, Any]]) -> Tuple[str, List[Any]]:
+    """Строит WHERE для выборки пользователей.
+
+    Ключи cohort (все необязательные, условия объединяются через AND):
+        min_level / max_level - границы уровня включительно,
+        inactive_days - не было активности N дней (или не было вовсе),
+        active_days - была активность за последние N дней,
+        user_ids - явный список user_id.
+    """
+    cohort = cohort or {}
+    unknown = set(cohort) - {"min_level", "max_level", "inactive_days", "active_days", "user_ids"}
+    if unknown:
+        raise ValueError(f"Неизвестные условия выборки: {', '.join(sorted(unknown))}")
+
+    conditions: List[str] = []
+    params: List[Any] = []
+    if cohort.get("min_level") is not None:
+        conditions.append("users.level >= ?")
+        params.append(int(cohort["min_level"]))
+    if cohort.get("max_level") is not None:
+        conditions.append("users.level <= ?")
+        params.append(int(cohort["max_level"]))
+    if cohort.get("inactive_days") is not None:
+        conditions.append(f"({_USER_ACTIVITY_SQL} IS NULL OR {_USER_ACTIVITY_SQL} < datetime('now', ?))")
+        params.append(f"-{int(cohort['inactive_days'])} days")
+    if cohort.get("active_days") is not None:
+        conditions.append(f"{_USER_ACTIVITY_SQL} >= datetime('now', ?)")
+        params.append(f"-{int(cohort['active_days'])} days")
+    if cohort.get("user_ids") is not None:
+        conditions.append("users.user_id IN (SELECT value FROM json_each(?))")
+        params.append(json.dumps([int(user_id) for user_id in cohort["user_ids"]]))
+
+    return " AND ".join(conditions) or "1", params
+
+
+# Флаг "мы внутри db.transaction()" для текущей задачи: вложенные методы не коммитят сами
+_in_transaction: ContextVar[bool] = ContextVar("db_in_transaction", default=False)
+# Действия, которые нужно выполнить после коммита внешней транзакции (кэши в памяти)
+_commit_callbacks: ContextVar[Optional[List[Callable[[], None]]]] = ContextVar("db_commit_callbacks", default=None)
+
 print(f"📁 Используется база данных: {DB_PATH}")
 print(f"🌐 Render окружение: {os.getenv('RENDER', 'Нет')}")
 print(f"🤖 Токен бота: {'Установлен' if os.getenv('BOT_TOKEN') else 'НЕ УСТАНОВЛЕН!'}")
 
 
+def _gzip_file(src: str, dst: str):
+    """Потоково сжимает файл; dst заменяется атомарно."""
+    tmp = f"{dst}.tmp"
+    with open(src, "rb") as f_in, gzip.open(tmp, "wb", compresslevel=6) as f_out:
+        shutil.copyfileobj(f_in, f_out, 1024 * 1024)
+    os.replace(tmp, dst)
+
+
+def _gunzip_file(src: str, dst: str):
+    """Потоково распаковывает gzip-файл."""
+    with gzip.open(src, "rb") as f_in, open(dst, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out, 1024 * 1024)
+
+
+def table_row_counts(path: str) -> Tuple[int, Dict[str, int]]:
+    """Версия схемы и количество строк в каждой таблице файла базы."""
+    conn = sqlite3.connect(path)
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        tables = [row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+        )]
+        return version, {table: conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0] for table in tables}
+    finally:
+        conn.close()
+
+
+class _WriteTicket:
+    """Заявка на запись в очереди актора."""
+    __slots__ = ("turn", "done", "durable", "exclusive")
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, exclusive: bool = False):
+        self.turn = loop.create_future()  # актор -> клиент: "твоя очередь писать"
+        self.done = loop.create_future()  # клиент -> актор: "закончил" (None или исключение)
+        self.durable = loop.create_future()  # актор -> клиент: "батч закоммичен"
+        self.exclusive = exclusive  # выполнить вне транзакции (backup, VACUUM и т.п.)
+
+
+_STOP = object()  # Сигнал остановки актора в очереди
+
+
+class GroupCommitWriter:
+    """Актор группового коммита для единственного пишущего соединения.
+
+    Корутины ставят заявки в ограниченную очередь. Актор по очереди дает каждой
+    заявке выполнить свои запросы внутри SAVEPOINT (ошибка одной операции
+    откатывает только ее), а коммитит весь батч раз в max_batch операций или
+    раз в interval секунд. Клиент ждет durable, чтобы знать, что данные на диске.
+    Эксклюзивные заявки выполняются между батчами, без открытой транзакции.
+    """
+
+    def __init__(self, conn: aiosqlite.Connection, metrics: Dict[str, float],
+                 max_batch: int = DB_COMMIT_BATCH, interval_ms: float = DB_COMMIT_INTERVAL_MS,
+                 queue_size: int = DB_WRITE_QUEUE):
+        self.conn = conn
+        self.metrics = metrics
+        self.max_batch = max(1, max_batch)
+        self.interval = max(0.0, interval_ms) / 1000
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if not self._task:
+            self._task = asyncio.create_task(self._run(), name="db-group-commit")
+
+    async def stop(self):
+        """Дожидается обработки уже поставленных заявок и останавливает актор."""
+        if self._task:
+            await self.queue.put(_STOP)
+            await self._task
+            self._task = None
+
+    async def submit(self, exclusive: bool = False) -> _WriteTicket:
+        """Ставит заявку в очередь (ждет, если очередь заполнена)."""
+        ticket = _WriteTicket(asyncio.get_running_loop(), exclusive)
+        await self.queue.put(ticket)
+        depth = self.queue.qsize()
+        self.metrics["queue_depth"] = depth
+        self.metrics["max_queue_depth"] = max(self.metrics["max_queue_depth"], depth)
+        return ticket
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        carry = None  # Заявка, прервавшая предыдущий батч
+        while True:
+            ticket = carry if carry is not None else await self.queue.get()
+            carry = None
+            if ticket is _STOP:
+                break
+            if ticket.exclusive:
+                await self._apply_exclusive(ticket)
+                continue
+
+            batch: List[_WriteTicket] = []
+            deadline = loop.time() + self.interval
+            try:
+                if not self.conn.in_transaction:
+                    await self.conn.execute("BEGIN")
+                while True:
+                    if await self._apply(ticket):
+                        batch.append(ticket)
+                    if len(batch) >= self.max_batch:
+                        break
+                    timeout = deadline - loop.time()
+                    try:
+                        ticket = (self.queue.get_nowait() if timeout <= 0
+                                  else await asyncio.wait_for(self.queue.get(), timeout))
+                    except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                        break
+                    if ticket is _STOP or ticket.exclusive:
+                        # Сначала коммитим батч, потом остановка/эксклюзивная операция
+                        carry = ticket
+                        break
+
+                await self.conn.commit()
+                error: Optional[BaseException] = None
+            except Exception as e:
+                logger.error("❌ Ошибка группового коммита (%d операций): %s", len(batch), e)
+                error = e
+                try:
+                    await self.conn.rollback()
+                except Exception:
+                    pass
+
+            self._record_batch(len(batch))
+            for done_ticket in batch:
+                if not done_ticket.durable.done():
+                    if error:
+                        done_ticket.durable.set_exception(error)
+                    else:
+                        done_ticket.durable.set_result(None)
+
+    async def _apply(self, ticket: _WriteTicket) -> bool:
+        """Выполняет одну заявку внутри SAVEPOINT. False - заявка отменена или откатилась."""
+        if ticket.turn.done():
+            # Клиента отменили, пока он стоял в очереди
+            return False
+
+        await self.conn.execute("SAVEPOINT write_op")
+        if ticket.turn.done():
+            # Отменили, пока открывался SAVEPOINT
+            await self.conn.execute("RELEASE write_op")
+            return False
+        ticket.turn.set_result(None)
+        try:
+            error = await ticket.done
+        except asyncio.CancelledError:
+            error = asyncio.CancelledError()
+
+        if error is None:
+            await self.conn.execute("RELEASE write_op")
+            return True
+
+        await self.conn.execute("ROLLBACK TO write_op")
+        await self.conn.execute("RELEASE write_op")
+        return False
+
+    async def _apply_exclusive(self, ticket: _WriteTicket):
+        """Выполняет эксклюзивную заявку вне транзакции и сразу коммитит ее изменения."""
+        if ticket.turn.done():
+            return
+        ticket.turn.set_result(None)
+        try:
+            error = await ticket.done
+        except asyncio.CancelledError:
+            error = asyncio.CancelledError()
+
+        try:
+            if self.conn.in_transaction:
+                if error is None:
+                    await self.conn.commit()
+                else:
+                    await self.conn.rollback()
+            if not ticket.durable.done():
+                ticket.durable.set_result(None)
+        except Exception as e:
+            logger.error("❌ Ошибка завершения эксклюзивной операции: %s", e)
+            if not ticket.durable.done():
+                ticket.durable.set_exception(e)
+
+    def _record_batch(self, size: int):
+        self.metrics["batches"] += 1
+        self.metrics["ops"] += size
+        self.metrics["last_batch"] = size
+        self.metrics["max_batch"] = max(self.metrics["max_batch"], size)
+        self.metrics["queue_depth"] = self.queue.qsize()
+
+
 class Database:  # ← ТОЛЬКО ОДИН РАЗ!
-    def __init__(self, db_path: str = DB_PATH):
+    def __init__(self, db_path: str = DB_PATH, readers: int = DB_READERS, profile: str = DB_PROFILE):
         self.db_path = db_path
-        self.conn: Optional[aiosqlite.Connection] = None
+        self.conn: Optional[aiosqlite.Connection] = None  # Единственное соединение для записи
+        self.readers_count = readers
+        self.pragmas = PRAGMA_PROFILES.get(profile, PRAGMA_PROFILES["balanced"])
+        self._readers: List[aiosqlite.Connection] = []
+        self._reader_load: List[int] = []  # Количество запросов в работе на каждом читателе
+        self._writer: Optional[GroupCommitWriter] = None  # Актор группового коммита
+        self.write_metrics: Dict[str, float] = {
+            "batches": 0, "ops": 0, "last_batch": 0, "max_batch": 0,
+            "queue_depth": 0, "max_queue_depth": 0,
+        }
+        self.counters = StatsCounters()  # Несброшенные счетчики ответов
+        self._flush_task: Optional[asyncio.Task] = None
+        self.answer_events = AnswerEventBuffer(ANSWER_EVENTS_BUFFER)  # Незаписанные события ответов
+        self._events_flush_task: Optional[asyncio.Task] = None
+        self.asked_questions = AskedQuestions(ASKED_HISTORY_CACHE)  # Заданные вопросы (битовые маски)
+        self._rollup_task: Optional[asyncio.Task] = None
+        self.snapshot_path = DB_SNAPSHOT_PATH
+        self._snapshot_task: Optional[asyncio.Task] = None
+        self.leaderboard = Leaderboard()  # Топ и места игроков в памяти
+        self._leaderboard_task: Optional[asyncio.Task] = None
+        self._leaderboard_stale: Optional[asyncio.Event] = None
         print(f"🔄 Инициализация Database с путем: {db_path}")
 
     # ДАЛЕЕ ВЕСЬ ОСТАЛЬНОЙ КОД КЛАССА...
     # ---------------- Подключение и инициализация ----------------
+    @property
+    def pooled(self) -> bool:
+        """Пул читателей возможен только для файловой БД (WAL не работает с :memory:)."""
+        return self.db_path != ":memory:" and self.readers_count > 0
+
+    @property
+    def snapshots_enabled(self) -> bool:
+        """Снимки нужны только для :memory: базы, которая теряется при рестарте."""
+        return self.db_path == ":memory:" and bool(self.snapshot_path)
+
+    async def _apply_pragmas(self, conn: aiosqlite.Connection):
+        """Применяет прагмы выбранного профиля к соединению."""
+        await conn.execute(f"PRAGMA busy_timeout = {int(self.pragmas['busy_timeout'])}")
+        await conn.execute(f"PRAGMA cache_size = {int(self.pragmas['cache_size'])}")
+        await conn.execute(f"PRAGMA mmap_size = {int(self.pragmas['mmap_size'])}")
+
     async def connect(self):
         """Устанавливает соединение с БД и инициализирует таблицы."""
         if not self.conn:
             self.conn = await aiosqlite.connect(self.db_path)
+            await self._apply_pragmas(self.conn)
+            if self.pooled:
+                await self.conn.execute("PRAGMA journal_mode = WAL")
+            await self.conn.execute(f"PRAGMA synchronous = {self.pragmas['synchronous']}")
             await self.conn.execute("PRAGMA foreign_keys = ON;")
+            if self.snapshots_enabled:
+                await self._restore_snapshot()
             await self.init_db()
+            await self._open_readers()
+            self._writer = GroupCommitWriter(self.conn, self.write_metrics)
+            self._writer.start()
+            self._flush_task = asyncio.create_task(self._counters_flush_loop(), name="db-counters-flush")
+            self._rollup_task = asyncio.create_task(self._rollup_loop(), name="db-rollups")
+            if self.snapshots_enabled:
+                self._snapshot_task = asyncio.create_task(self._snapshot_loop(), name="db-snapshot")
+            await self.rebuild_leaderboard()
+            self._leaderboard_stale = asyncio.Event()
+            self._leaderboard_task = asyncio.create_task(self._leaderboard_loop(), name="db-leaderboard")
+
+    # ---------------- Снимки :memory: базы ----------------
+    async def save_snapshot(self) -> bool:
+        """Сохраняет сжатый снимок базы через online backup API.
+
+        Копия памяти делается между батчами записи (быстро), сжатие - в отдельном потоке.
+        """
+        tmp_db = f"{self.snapshot_path}.tmp-db"
+        try:
+            async with self._exclusive() as conn:
+                target = sqlite3.connect(tmp_db, check_same_thread=False)
+                try:
+                    await conn.backup(target)
+                finally:
+                    target.close()
+
+            await asyncio.to_thread(_gzip_file, tmp_db, self.snapshot_path)
+            logger.info("💾 Снимок базы сохранен: %s (%d байт)",
+                        self.snapshot_path, os.path.getsize(self.snapshot_path))
+            return True
+        except Exception as e:
+            logger.error("❌ Ошибка сохранения снимка базы: %s", e)
+            return False
+        finally:
+            if os.path.exists(tmp_db):
+                os.remove(tmp_db)
+
+    async def _restore_snapshot(self):
+        """Загружает последний снимок в :memory: базу (до init_db)."""
+        if not os.path.exists(self.snapshot_path):
+            logger.info("ℹ️ Снимок базы не найден, начинаем с пустой базы")
+            return
+
+        tmp_db = f"{self.snapshot_path}.restore-db"
+        try:
+            await asyncio.to_thread(_gunzip_file, self.snapshot_path, tmp_db)
+            source = await aiosqlite.connect(tmp_db)
+            try:
+                await source.backup(self.conn)
+            finally:
+                await source.close()
+            logger.info("✅ База восстановлена из снимка %s", self.snapshot_path)
+        except Exception as e:
+            logger.error("❌ Не удалось восстановить снимок %s: %s", self.snapshot_path, e)
+        finally:
+            if os.path.exists(tmp_db):
+                os.remove(tmp_db)
+
+    async def backup_to(self, path: str) -> Dict[str, Any]:
+        """Сохраняет согласованную копию базы в файл path через online backup API.
+
+        Файловая база копируется из отдельного read-only соединения: копия соответствует
+        одному снимку WAL и не блокирует запись. :memory: база копируется между
+        батчами записи. Возвращает {"schema_version", "tables": {таблица: строк}} по копии
+        и watermark - время БД перед копированием (начало окна для export_changes).
+        """
+        # В копию попадают и накопленные в памяти ответы
+        await self.flush_counters()
+        await self.flush_answer_events()
+        await self.flush_asked_questions()
+
+        target = sqlite3.connect(path, check_same_thread=False)
+        try:
+            async with self._snapshot_connection() as conn:
+                # Метка времени до начала копии: все изменения позже нее попадут в дельты
+                watermark = await self._db_now(conn)
+                await conn.backup(target)
+        finally:
+            target.close()
+
+        version, tables = await asyncio.to_thread(table_row_counts, path)
+        return {"schema_version": version, "tables": tables, "watermark": watermark}
+
+    async def restore_from(self, path: str) -> int:
+        """Атомарно подменяет содержимое базы файлом path (подготовленная теневая копия).
+
+        Копирование идет через backup API в соединение записи между батчами:
+        читатели до конца копирования видят старые данные, пишущие корутины
+        ждут в очереди. Затем схема догоняется миграциями, несброшенные счетчики,
+        события ответов и маски заданных вопросов отбрасываются, таблица лидеров перестраивается.
+        Возвращает версию схемы.
+        """
+        async with self._exclusive() as conn:
+            self.counters.clear()  # Дельты относятся к старым данным
+            self.answer_events.clear()
+            self.asked_questions.clear()
+            source = await aiosqlite.connect(path)
+            try:
+                await source.backup(conn)
+            finally:
+                await source.close()
+            version = await apply_migrations(conn)
+            self.leaderboard.invalidate()  # До перестроения рейтинг считается SQL
+
+        await self.rebuild_leaderboard()
+        logger.info("✅ База заменена копией %s (схема %d)", path, version)
+        return version
+
+    @asynccontextmanager
+    async def _snapshot_connection(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Соединение для долгого согласованного чтения всей базы.
+
+        Файловая база - отдельное read-only соединение на время чтения:
+        запись не блокируется, а долгая транзакция не занимает соединение
+        пула у обычных запросов. :memory: - соединение записи между батчами.
+        """
+        if self.pooled:
+            await self._ensure_connected()
+            conn = await self._connect_reader()
+            try:
+                yield conn
+            finally:
+                await conn.close()
+        else:
+            async with self._exclusive() as conn:
+                yield conn
+
+    @staticmethod
+    async def _db_now(conn: aiosqlite.Connection) -> str:
+        async with conn.execute("SELECT CURRENT_TIMESTAMP") as cursor:
+            return (await cursor.fetchone())[0]
+
+    async def export_changes(self, since: str, sink: Callable[[Any], None],
+                             batch_size: int = 1000) -> Dict[str, Any]:
+        """Выгружает строки, измененные или удаленные с момента since (UTC, как CURRENT_TIMESTAMP).
+
+        Все таблицы читаются в одной транзакции чтения. sink получает записи по
+        порядку: {"table", "columns"} и затем строки-списки со значениями колонок;
+        {"table", "deleted": колонки ключа} и затем списки значений ключа.
+        Удаления каждой таблицы идут раньше ее строк.
+        Возвращает {"watermark", "rows", "deleted"}; watermark - время начала
+        выгрузки, с него (минус запас) начинается следующая дельта.
+        """
+        await self.flush_counters()
+        await self.flush_asked_questions()
+
+        rows_count = deleted_count = 0
+        async with self._snapshot_connection() as conn:
+            await conn.execute("BEGIN")
+            try:
+                watermark = await self._db_now(conn)
+
+                tombstones: Dict[str, List[List[Any]]] = {}
+                async with conn.execute(
+                        "SELECT table_name, row_key FROM row_tombstones WHERE deleted_at >= ? ORDER BY rowid",
+                        (since,)
+                ) as cursor:
+                    async for table, row_key in cursor:
+                        tombstones.setdefault(table, []).append(json.loads(row_key))
+
+                for table, key in CHANGE_TRACKED_TABLES.items():
+                    if tombstones.get(table):
+                        sink({"table": table, "deleted": list(key)})
+                        for row_key in tombstones[table]:
+                            sink(row_key)
+                        deleted_count += len(tombstones[table])
+
+                    async with conn.execute(
+                            f"SELECT * FROM {table} WHERE updated_at >= ? ORDER BY updated_at", (since,)
+                    ) as cursor:
+                        columns = [description[0] for description in cursor.description]
+                        header_sent = False
+                        while True:
+                            rows = await cursor.fetchmany(batch_size)
+                            if not rows:
+                                break
+                            if not header_sent:
+                                sink({"table": table, "columns": columns})
+                                header_sent = True
+                            for row in rows:
+                                sink(list(row))
+                            rows_count += len(rows)
+            finally:
+                await conn.execute("COMMIT")
+
+        return {"watermark": watermark, "rows": rows_count, "deleted": deleted_count}
+
+    async def get_schema_version(self) -> int:
+        async with self._reading() as conn:
+            return await get_schema_version(conn)
+
+    async def purge_tombstones(self, before: str) -> int:
+        """Удаляет записи журнала удалений старше before (их уже покрывает полный бэкап)"""
+        async with self._writing() as conn:
+            cursor = await conn.execute("DELETE FROM row_tombstones WHERE deleted_at < ?", (before,))
+            return cursor.rowcount
+
+    async def _snapshot_loop(self):
+        """Периодически сохраняет снимок :memory: базы."""
+        while True:
+            await asyncio.sleep(DB_SNAPSHOT_INTERVAL)
+            await self.save_snapshot()
+
+    async def _connect_reader(self) -> aiosqlite.Connection:
+        """Открывает read-only соединение с файлом базы."""
+        uri = f"{Path(self.db_path).resolve().as_uri()}?mode=ro"
+        reader = await aiosqlite.connect(uri, uri=True)
+        try:
+            await self._apply_pragmas(reader)
+            await reader.execute("PRAGMA query_only = ON")
+        except BaseException:
+            # Отмена (например, фоновой сверки при close) не должна оставлять поток соединения
+            await reader.close()
+            raise
+        return reader
 
-    # ... и весь остальной код без изменений
+    async def _open_readers(self):
+        """Открывает read-only соединения пула."""
+        if not self.pooled:
+            return
+        for _ in range(self.readers_count):
+            self._readers.append(await self._connect_reader())
+            self._reader_load.append(0)
+        logger.info("✅ Пул БД: 1 writer + %d reader(s), WAL", len(self._readers))
 
     async def close(self):
         """Закрывает соединение с БД."""
+        background = [task for task in (self._flush_task, self._events_flush_task, self._rollup_task,
+                                        self._snapshot_task, self._leaderboard_task) if task]
+        for task in background:
+            task.cancel()
+        # Дожидаемся отмены, чтобы задачи не обращались к уже закрытым соединениям
+        await asyncio.gather(*background, return_exceptions=True)
+        self._flush_task = self._events_flush_task = self._rollup_task = None
+        self._snapshot_task = self._leaderboard_task = None
+        if self._writer:
+            # Последний сброс счетчиков, журнала и истории вопросов перед остановкой актора записи
+            await self.flush_counters()
+            await self.flush_answer_events()
+            await self.flush_asked_questions()
+            if self.snapshots_enabled:
+                # Иначе :memory: база пропадет вместе с соединением
+                await self.save_snapshot()
+            await self._writer.stop()
+            self._writer = None
+        for reader in self._readers:
+            await reader.close()
+        self._readers.clear()
+        self._reader_load.clear()
         if self.conn:
             await self.conn.close()
             self.conn = None
@@ -46,109 +692,146 @@ class Database:  # ← ТОЛЬКО ОДИН РАЗ!
         if not self.conn:
             await self.connect()
 
-    async def _migrate_database(self):
-        """Миграция базы данных - добавляет отсутствующие колонки"""
-        try:
-            migrations = [
-                ('users', 'created_at', 'DATETIME DEFAULT CURRENT_TIMESTAMP'),
-                ('users', 'last_active', 'DATETIME DEFAULT CURRENT_TIMESTAMP'),
-                ('duel_stats', 'average_score', 'REAL DEFAULT 0'),
-            ]
+    @asynccontextmanager
+    async def _reading(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Выдает наименее загруженное read-only соединение.
+
+        Без пула (например, :memory: на Render) запросы идут в основное соединение.
+        """
+        await self._ensure_connected()
+        if not self._readers or _in_transaction.get():
+            # Внутри транзакции читаем из writer, чтобы видеть свои незакоммиченные изменения
+            yield self.conn
+            return
 
-            for table, column, definition in migrations:
-                async with self.conn.execute(f"PRAGMA table_info({table})") as cursor:
-                    columns = [row[1] for row in await cursor.fetchall()]
+        index = min(range(len(self._readers)), key=self._reader_load.__getitem__)
+        self._reader_load[index] += 1
+        try:
+            yield self._readers[index]
+        finally:
+            if index < len(self._reader_load):
+                self._reader_load[index] -= 1
+
+    @property
+    def commits_count(self) -> int:
+        """Количество выполненных групповых коммитов."""
+        return int(self.write_metrics["batches"])
+
+    def get_writer_metrics(self) -> Dict[str, float]:
+        """Метрики актора записи: размеры батчей и глубина очереди."""
+        metrics = dict(self.write_metrics)
+        metrics["avg_batch"] = round(metrics["ops"] / metrics["batches"], 2) if metrics["batches"] else 0
+        if self._writer:
+            metrics["queue_depth"] = self._writer.queue.qsize()
+        return metrics
+
+    @asynccontextmanager
+    async def _writing(self, wait_durable: bool = True) -> AsyncIterator[aiosqlite.Connection]:
+        """Выдает соединение для записи в свою очередь у актора группового коммита.
+
+        Изменения блока применяются атомарно (SAVEPOINT) и коммитятся вместе
+        с операциями других корутин. При wait_durable=True выход из блока
+        дожидается коммита. Внутри transaction() просто присоединяется к ней.
+        """
+        await self._ensure_connected()
+        if _in_transaction.get():
+            yield self.conn
+            return
+
+        ticket = await self._writer.submit()
+        token = _in_transaction.set(True)
+        callbacks: List[Callable[[], None]] = []
+        callbacks_token = _commit_callbacks.set(callbacks)
+        try:
+            # Отмена уже после выдачи очереди тоже должна дойти до актора через done,
+            # иначе он ждет ее вечно и останавливает всю запись
+            await ticket.turn
+            yield self.conn
+        except BaseException as e:
+            ticket.done.set_result(e)
+            raise
+        else:
+            ticket.done.set_result(None)
+        finally:
+            _commit_callbacks.reset(callbacks_token)
+            _in_transaction.reset(token)
+
+        if not wait_durable:
+            # Коммит не ждем: колбэки выполнятся, когда он случится
+            if callbacks:
+                ticket.durable.add_done_callback(partial(self._run_committed, callbacks))
+            return
+        await ticket.durable
+        for callback in callbacks:
+            callback()
+
+    @staticmethod
+    def _run_committed(callbacks: List[Callable[[], None]], durable: asyncio.Future):
+        """Выполняет отложенные колбэки, если батч закоммичен без ошибки."""
+        if not durable.cancelled() and durable.exception() is None:
+            for callback in callbacks:
+                callback()
+
+    @staticmethod
+    def _on_commit(callback: Callable[[], None]):
+        """Выполняет callback после коммита текущей транзакции (сразу, если ее нет).
+
+        Так кэши в памяти (таблица лидеров) не видят изменений, которые потом откатятся.
+        """
+        pending = _commit_callbacks.get()
+        if pending is None:
+            callback()
+        else:
+            pending.append(callback)
 
-                if column not in columns:
-                    await self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
-                    logger.info(f"✅ Добавлена колонка {column} в таблицу {table}")
+    @asynccontextmanager
+    async def _exclusive(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Выдает соединение записи между батчами, без открытой транзакции.
 
-            await self.conn.commit()
+        Нужно для операций, которые нельзя выполнять внутри транзакции:
+        backup, VACUUM INTO, подмена базы.
+        """
+        if _in_transaction.get():
+            # Очередь не дойдет до заявки, пока открыта наша же транзакция - это взаимоблокировка
+            raise RuntimeError("_exclusive() нельзя вызывать внутри транзакции записи")
+        await self._ensure_connected()
+        ticket = await self._writer.submit(exclusive=True)
+        token = _in_transaction.set(True)
+        try:
+            await ticket.turn  # См. _writing: отмена после выдачи очереди освобождает актор
+            yield self.conn
+        except BaseException as e:
+            ticket.done.set_result(e)
+            raise
+        else:
+            ticket.done.set_result(None)
+        finally:
+            _in_transaction.reset(token)
 
-        except Exception as e:
-            logger.error("❌ Ошибка миграции базы данных: %s", e)
-            # Не прерываем выполнение при ошибке миграции
+        await ticket.durable
 
-    async def init_db(self):
-        """Создаёт таблицы, если их нет."""
-        assert self.conn, "Database connection is not established"
+    @asynccontextmanager
+    async def transaction(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Единица работы: все записи внутри блока применяются атомарно и одним коммитом.
 
-        # Таблица пользователей
-        await self.conn.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                level INTEGER DEFAULT 1,
-                xp INTEGER DEFAULT 0,
-                max_combo INTEGER DEFAULT 0,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                last_active DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-
-        # Таблица достижений
-        await self.conn.execute("""
-            CREATE TABLE IF NOT EXISTS achievements (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                achievement_id TEXT,
-                unlocked_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (user_id),
-                UNIQUE(user_id, achievement_id)
-            )
-        """)
-
-        # Таблица статистики пользователей
-        await self.conn.execute("""
-            CREATE TABLE IF NOT EXISTS user_stats (
-                user_id INTEGER PRIMARY KEY,
-                total_answers INTEGER DEFAULT 0,
-                correct_answers INTEGER DEFAULT 0,
-                total_combo INTEGER DEFAULT 0,
-                perfect_quizzes INTEGER DEFAULT 0,
-                categories_completed INTEGER DEFAULT 0,
-                last_activity DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-        """)
-
-        # Новая таблица для ежедневных наград
-        await self.conn.execute("""
-            CREATE TABLE IF NOT EXISTS daily_rewards (
-                user_id INTEGER PRIMARY KEY,
-                last_reward_date DATE,
-                streak_count INTEGER DEFAULT 0,
-                total_rewards INTEGER DEFAULT 0,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-        """)
-
-        # Таблица статистики по категориям
-        await self.conn.execute("""
-            CREATE TABLE IF NOT EXISTS category_stats (
-                user_id INTEGER,
-                category TEXT,
-                total_answers INTEGER DEFAULT 0,
-                correct_answers INTEGER DEFAULT 0,
-                last_played DATETIME DEFAULT CURRENT_TIMESTAMP,
-                PRIMARY KEY (user_id, category),
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-        """)
+        Пример:
+            async with db.transaction():
+                await db.add_xp(user_id, 20)
+                await db.update_user_category_stats(user_id, "наука", True)
 
-        # Таблицы для дуэлей
-        await self.create_duels_table()
+        Вложенные transaction() присоединяются к внешней. При исключении
+        откатываются только изменения этого блока.
+        """
+        async with self._writing() as conn:
+            yield conn
 
-        # Выполняем миграцию
-        await self._migrate_database()
+    async def init_db(self):
+        """Приводит схему к последней версии (см. migrations.py).
 
-        # Создаем индексы
-        await self.conn.execute("CREATE INDEX IF NOT EXISTS idx_users_xp ON users (xp DESC)")
-        await self.conn.execute("CREATE INDEX IF NOT EXISTS idx_achievements_user ON achievements (user_id)")
-        await self.conn.execute("CREATE INDEX IF NOT EXISTS idx_daily_rewards_date ON daily_rewards (last_reward_date)")
-        await self.conn.execute("CREATE INDEX IF NOT EXISTS idx_category_stats_user ON category_stats (user_id)")
-        await self.conn.execute("CREATE INDEX IF NOT EXISTS idx_duels_created ON duels (created_at DESC)")
-        await self.conn.commit()
+        Актуальная база проверяется одним чтением PRAGMA user_version.
+        """
+        assert self.conn, "Database connection is not established"
+        await apply_migrations(self.conn)
 
     # ---------------- Пользователь ----------------
     async def get_user(self, user_id: int, username: str = "") -> Dict[str, Any]:
@@ -163,11 +846,7 @@ class Database:  # ← ТОЛЬКО ОДИН РАЗ!
 
         if row:
             if username and username != row[1]:
-                await self.conn.execute(
-                    "UPDATE users SET username = ? WHERE user_id = ?",
-                    (username, user_id)
-                )
-                await self.conn.commit()
+                await self.update_username(user_id, username)
 
             # Гарантируем, что статистика существует
             await self.get_user_stats(user_id)
@@ -180,252 +859,705 @@ class Database:  # ← ТОЛЬКО ОДИН РАЗ!
                 "max_combo": row[4],
             }
 
-        # Создаем нового пользователя
-        await self.conn.execute(
-            "INSERT INTO users (user_id, username, level, xp, max_combo) VALUES (?, ?, ?, ?, ?)",
-            (user_id, username, 1, 0, 0)
-        )
-
-        # Создаем запись статистики
-        await self.conn.execute(
-            "INSERT INTO user_stats (user_id) VALUES (?)",
-            (user_id,)
-        )
+        async with self._writing() as conn:
+            # Создаем нового пользователя
+            await conn.execute(
+                "INSERT INTO users (user_id, username, level, xp, max_combo, created_at, last_active) "
+                "VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)",
+                (user_id, username, 1, 0, 0)
+            )
 
-        await self.conn.commit()
+            # Создаем запись статистики
+            await conn.execute(
+                "INSERT INTO user_stats (user_id) VALUES (?)",
+                (user_id,)
+            )
 
+        self._on_commit(partial(self.leaderboard.add_user, user_id, username=username))
         return {"user_id": user_id, "username": username, "level": 1, "xp": 0, "max_combo": 0}
 
     # ---------------- Обновление имени пользователя ----------------
     async def update_username(self, user_id: int, username: str) -> None:
         """Обновляет имя пользователя в базе данных."""
-        await self._ensure_connected()
-
-        await self.conn.execute(
-            "UPDATE users SET username = ? WHERE user_id = ?",
-            (username, user_id)
-        )
-        await self.conn.commit()
+        async with self._writing() as conn:
+            await conn.execute(
+                "UPDATE users SET username = ? WHERE user_id = ?",
+                (username, user_id)
+            )
+        self._on_commit(partial(self.leaderboard.update_details, user_id, username=username))
 
     # ---------------- Добавление XP ----------------
     async def add_xp(self, user_id: int, xp: int) -> tuple[int, int]:
-        """Добавляет XP пользователю и возвращает (новый_xp, новый_уровень)."""
-        await self._ensure_connected()
+        """Добавляет XP пользователю и возвращает (новый_xp, новый_уровень).
 
-        async with self.conn.execute("SELECT xp FROM users WHERE user_id = ?", (user_id,)) as cursor:
-            row = await cursor.fetchone()
+        Один атомарный UPSERT ... RETURNING: параллельные начисления не теряются.
+        Прежний XP (None - пользователя не было) читается в той же очереди записи:
+        по строке после UPSERT нельзя надежно отличить нового игрока от игрока с 0 XP.
+        """
+        async with self._writing() as conn:
+            old_xp = await self._current_xp(conn, user_id)
+            async with conn.execute(
+                    ADD_XP_SQL + " RETURNING xp, level",
+                    {"user_id": user_id, "delta": xp}
+            ) as cursor:
+                new_xp, level = await cursor.fetchone()
+
+        self._on_commit(partial(self.leaderboard.set_xp, user_id, old_xp, new_xp, level))
+        return new_xp, level
+
+    async def add_xp_bulk(self, deltas: Iterable[Tuple[int, int]]) -> int:
+        """Начисляет XP сразу многим пользователям: пары (user_id, дельта).
+
+        Все строки уходят одним executemany и одним коммитом.
+        Возвращает количество обработанных пар.
+        """
+        params = [{"user_id": user_id, "delta": delta} for user_id, delta in deltas]
+        if not params:
+            return 0
 
-        if row:
-            new_xp = row[0] + xp
-            new_level = new_xp // 100 + 1
-            await self.conn.execute(
-                "UPDATE users SET xp = ?, level = ? WHERE user_id = ?",
-                (new_xp, new_level, user_id)
-            )
-            await self.conn.commit()
-            return new_xp, new_level
+        async with self._writing() as conn:
+            await conn.executemany(ADD_XP_SQL, params)
 
-        new_level = xp // 100 + 1
-        await self.conn.execute(
-            "INSERT INTO users (user_id, username, level, xp, max_combo) VALUES (?, ?, ?, ?, ?)",
-            (user_id, "", new_level, xp, 0)
-        )
-        await self.conn.commit()
-        return xp, new_level
+        self._on_commit(self.invalidate_leaderboard)
+        return len(params)
+
+    @staticmethod
+    async def _current_xp(conn: aiosqlite.Connection, user_id: int) -> Optional[int]:
+        """XP пользователя внутри своей очереди записи (None - пользователя нет)."""
+        async with conn.execute("SELECT xp FROM users WHERE user_id = ?", (user_id,)) as cursor:
+            row = await cursor.fetchone()
+        return row[0] if row else None
 
     # ---------------- Получение XP пользователя ----------------
     async def get_user_xp(self, user_id: int) -> int:
         """Получает текущий XP пользователя."""
-        await self._ensure_connected()
-
-        async with self.conn.execute("SELECT xp FROM users WHERE user_id = ?", (user_id,)) as cursor:
-            row = await cursor.fetchone()
+        async with self._reading() as conn:
+            async with conn.execute("SELECT xp FROM users WHERE user_id = ?", (user_id,)) as cursor:
+                row = await cursor.fetchone()
 
-        return row[0] if row else 0
+            return row[0] if row else 0
 
     # ---------------- Обновление max_combo ----------------
     async def update_max_combo(self, user_id: int, combo: int):
-        """Обновляет max_combo, если новое значение больше текущего."""
-        await self._ensure_connected()
+        """Обновляет max_combo, если новое значение больше текущего.
 
-        async with self.conn.execute(
-                "SELECT max_combo FROM users WHERE user_id = ?",
-                (user_id,)
-        ) as cursor:
-            row = await cursor.fetchone()
+        Возвращает True, если рекорд обновился.
+        """
+        async with self._writing() as conn:
+            async with conn.execute(
+                    "UPDATE users SET max_combo = ? WHERE user_id = ? AND max_combo < ? RETURNING max_combo",
+                    (combo, user_id, combo)
+            ) as cursor:
+                row = await cursor.fetchone()
 
-        if row and combo > row[0]:
-            await self.conn.execute(
-                "UPDATE users SET max_combo = ? WHERE user_id = ?",
-                (combo, user_id)
-            )
-            await self.conn.commit()
+        if row is not None:
+            self._on_commit(partial(self.leaderboard.update_details, user_id, max_combo=combo))
+        return row is not None
 
     async def update_last_activity(self, user_id: int):
         """Обновляет время последней активности пользователя"""
-        await self._ensure_connected()
-
         try:
-            await self.conn.execute(
-                "UPDATE user_stats SET last_activity = CURRENT_TIMESTAMP WHERE user_id = ?",
-                (user_id,)
-            )
-            # Убираем обновление last_active, если колонки нет
-            # await self.conn.execute(
-            #     "UPDATE users SET last_active = CURRENT_TIMESTAMP WHERE user_id = ?",
-            #     (user_id,)
-            # )
-            await self.conn.commit()
+            async with self._writing() as conn:
+                await conn.execute(
+                    "UPDATE user_stats SET last_activity = CURRENT_TIMESTAMP WHERE user_id = ?",
+                    (user_id,)
+                )
+                # Убираем обновление last_active, если колонки нет
+                # await conn.execute(
+                #     "UPDATE users SET last_active = CURRENT_TIMESTAMP WHERE user_id = ?",
+                #     (user_id,)
+                # )
         except Exception as e:
             logger.debug(f"Не удалось обновить активность для {user_id}: {e}")
 
     # ---------------- Топ пользователей ----------------
     async def get_top_users(self, limit: int = 10) -> List[Dict[str, Any]]:
-        """Возвращает топ пользователей по XP."""
-        await self._ensure_connected()
+        """Возвращает топ пользователей по XP (из памяти, при необходимости - из БД)."""
+        top = self.leaderboard.top(limit)
+        if top is None:
+            # Кэш топа устарел: читаем K лучших по индексу и заодно обновляем кэш
+            async with self._reading() as conn:
+                async with conn.execute(
+                        "SELECT user_id, username, level, xp, max_combo FROM users ORDER BY xp DESC LIMIT ?",
+                        (max(limit, self.leaderboard.top_k),)
+                ) as cursor:
+                    rows = await cursor.fetchall()
+            if limit <= self.leaderboard.top_k:
+                self.leaderboard.set_top(rows)
+            top = [
+                {"user_id": r[0], "username": r[1], "level": r[2], "xp": r[3], "max_combo": r[4]}
+                for r in rows[:limit]
+            ]
+        else:
+            # Новички топа попали туда из add_xp без имени - дочитываем по первичному ключу
+            missing = [u["user_id"] for u in top if u["username"] is None or u["max_combo"] is None]
+            if missing:
+                placeholders = ",".join("?" * len(missing))
+                async with self._reading() as conn:
+                    async with conn.execute(
+                            f"SELECT user_id, username, max_combo FROM users WHERE user_id IN ({placeholders})",
+                            missing
+                    ) as cursor:
+                        details = {r[0]: (r[1], r[2]) for r in await cursor.fetchall()}
+                for u in top:
+                    if u["user_id"] in details:
+                        u["username"], u["max_combo"] = details[u["user_id"]]
+                        self.leaderboard.update_details(u["user_id"], username=u["username"],
+                                                        max_combo=u["max_combo"])
+
+        for u in top:
+            u["username"] = u["username"] or "Аноним"
+        return top
+
+    async def get_user_rank(self, user_id: int) -> Dict[str, Any]:
+        """Место пользователя по XP: {"rank", "total", "top_percent", "xp"}.
+
+        O(log n) по гистограмме в памяти; пока она перестраивается - два COUNT по индексу.
+        """
+        xp = await self.get_user_xp(user_id)
+        rank = self.leaderboard.rank(xp)
+        if rank is None:
+            async with self._reading() as conn:
+                async with conn.execute(
+                        "SELECT (SELECT COUNT(*) FROM users WHERE xp > ?), (SELECT COUNT(*) FROM users)",
+                        (xp,)
+                ) as cursor:
+                    above, total = await cursor.fetchone()
+            rank = rank_info(above, total)
+        rank["xp"] = xp
+        return rank
+
+    async def rebuild_leaderboard(self):
+        """Перестраивает таблицу лидеров по users (сверка с БД).
+
+        Снимок фиксируется между батчами записи: изменения, закоммиченные
+        после него, таблица запоминает и применяет поверх перестроенных данных.
+        """
+        async with self._snapshot_connection() as conn:
+            await conn.execute("BEGIN")
+            try:
+                if self.pooled:
+                    async with self._exclusive():
+                        # Первое чтение фиксирует снимок WAL; колбэки прошлых батчей уже выполнены
+                        async with conn.execute("SELECT 1 FROM users LIMIT 1") as cursor:
+                            await cursor.fetchone()
+                        self.leaderboard.begin_rebuild()
+                else:
+                    # :memory: - соединение записи, запись стоит до конца чтения
+                    self.leaderboard.begin_rebuild()
+
+                xp_values: List[int] = []
+                async with conn.execute("SELECT xp FROM users") as cursor:
+                    while True:
+                        rows = await cursor.fetchmany(10000)
+                        if not rows:
+                            break
+                        xp_values.extend(row[0] for row in rows)
+                async with conn.execute(
+                        "SELECT user_id, username, level, xp, max_combo FROM users ORDER BY xp DESC LIMIT ?",
+                        (self.leaderboard.top_k,)
+                ) as cursor:
+                    top_rows = await cursor.fetchall()
+            except BaseException:
+                self.leaderboard.cancel_rebuild()
+                raise
+            finally:
+                await conn.execute("COMMIT")
 
-        async with self.conn.execute(
-                "SELECT user_id, username, level, xp, max_combo FROM users ORDER BY xp DESC LIMIT ?",
-                (limit,)
-        ) as cursor:
-            rows = await cursor.fetchall()
+        try:
+            # Построение гистограммы по всем пользователям - в потоке, чтобы не держать цикл событий
+            histogram = await asyncio.to_thread(XPHistogram.from_values, xp_values)
+        except BaseException:
+            self.leaderboard.cancel_rebuild()
+            raise
+        drift = self.leaderboard.rebuild(histogram, top_rows)
+        if drift:
+            logger.warning("⚠️ Таблица лидеров разошлась с БД на %d пользователей - исправлено", drift)
+        logger.debug("🏆 Таблица лидеров перестроена: %d пользователей", len(xp_values))
+
+    def invalidate_leaderboard(self):
+        """Помечает таблицу лидеров устаревшей и будит фоновую сверку."""
+        self.leaderboard.invalidate()
+        if self._leaderboard_stale:
+            self._leaderboard_stale.set()
+
+    async def _leaderboard_loop(self):
+        """Периодически (или сразу после invalidate) сверяет таблицу лидеров с БД."""
+        while True:
+            try:
+                await asyncio.wait_for(self._leaderboard_stale.wait(), LEADERBOARD_RECONCILE_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._leaderboard_stale.clear()
+            try:
+                await self.rebuild_leaderboard()
+            except Exception as e:
+                logger.error("❌ Ошибка перестроения таблицы лидеров: %s", e)
+
+    # ---------------- Массовые операции ----------------
+    async def _run_bulk(self, cohort: Optional[Dict[str, Any]],
+                        apply: Callable[[aiosqlite.Connection, str, List[int]], Awaitable[None]],
+                        batch_size: int, progress: Optional[ProgressCallback]) -> int:
+        """Применяет apply к выборке пользователей пачками по user_id.
+
+        Каждая пачка - одна запись у актора (и коммит), между пачками цикл событий
+        свободен. apply получает JSON-массив id пачки для "IN (SELECT value FROM json_each(?))".
+        Возвращает количество обработанных пользователей.
+        """
+        where, params = _cohort_filter(cohort)
+        async with self._reading() as conn:
+            async with conn.execute(f"SELECT COUNT(*) FROM users WHERE {where}", params) as cursor:
+                total = (await cursor.fetchone())[0]
 
-        return [
-            {"user_id": r[0], "username": r[1] or "Аноним", "level": r[2], "xp": r[3], "max_combo": r[4]}
-            for r in rows
-        ]
+        done = 0
+        last_id = -(2 ** 63)
+        try:
+            while True:
+                async with self._writing() as conn:
+                    # Выборка пачки и изменение - в одной очереди записи, фильтр не устареет
+                    async with conn.execute(
+                            f"SELECT user_id FROM users WHERE user_id > ? AND ({where}) ORDER BY user_id LIMIT ?",
+                            (last_id, *params, batch_size)
+                    ) as cursor:
+                        user_ids = [row[0] for row in await cursor.fetchall()]
+                    if user_ids:
+                        await apply(conn, json.dumps(user_ids), user_ids)
+
+                if not user_ids:
+                    break
+                done += len(user_ids)
+                last_id = user_ids[-1]
+                if progress:
+                    await progress(done, max(total, done))
+                if len(user_ids) < batch_size:
+                    break
+        finally:
+            if done:
+                self._on_commit(self.invalidate_leaderboard)
+
+        return done
+
+    async def bulk_grant_xp(self, delta: int, cohort: Optional[Dict[str, Any]] = None,
+                            batch_size: int = DB_BULK_BATCH,
+                            progress: Optional[ProgressCallback] = None) -> int:
+        """Начисляет XP выборке пользователей (см. _cohort_filter), уровень пересчитывается."""
+
+        async def apply(conn: aiosqlite.Connection, ids_json: str, user_ids: List[int]):
+            await conn.execute(
+                f"UPDATE users SET xp = xp + ?, level = (xp + ?) / {XP_PER_LEVEL} + 1 "
+                "WHERE user_id IN (SELECT value FROM json_each(?))",
+                (delta, delta, ids_json)
+            )
+
+        updated = await self._run_bulk(cohort, apply, batch_size, progress)
+        logger.info("✅ Начислено %d XP пользователям: %d", delta, updated)
+        return updated
+
+    async def bulk_set_level(self, level: int, cohort: Optional[Dict[str, Any]] = None,
+                             batch_size: int = DB_BULK_BATCH,
+                             progress: Optional[ProgressCallback] = None) -> int:
+        """Устанавливает уровень выборке пользователей."""
+
+        async def apply(conn: aiosqlite.Connection, ids_json: str, user_ids: List[int]):
+            await conn.execute(
+                "UPDATE users SET level = ? WHERE user_id IN (SELECT value FROM json_each(?))",
+                (level, ids_json)
+            )
+
+        updated = await self._run_bulk(cohort, apply, batch_size, progress)
+        logger.info("✅ Уровень %d установлен пользователям: %d", level, updated)
+        return updated
+
+    async def bulk_reset_progress(self, cohort: Optional[Dict[str, Any]] = None,
+                                  batch_size: int = DB_BULK_BATCH,
+                                  progress: Optional[ProgressCallback] = None) -> int:
+        """Сбрасывает прогресс выборке пользователей (как reset_progress, но пачками)."""
+
+        async def apply(conn: aiosqlite.Connection, ids_json: str, user_ids: List[int]):
+            for user_id in user_ids:
+                self.counters.discard(user_id)
+                self.asked_questions.discard(user_id)
+            for table in ("achievements", "user_stats", "daily_rewards", "category_stats", "duel_stats",
+                          "user_question_history"):
+                await conn.execute(
+                    f"DELETE FROM {table} WHERE user_id IN (SELECT value FROM json_each(?))",
+                    (ids_json,)
+                )
+            await conn.execute(
+                "UPDATE users SET xp = 0, level = 1, max_combo = 0 "
+                "WHERE user_id IN (SELECT value FROM json_each(?))",
+                (ids_json,)
+            )
+
+        updated = await self._run_bulk(cohort, apply, batch_size, progress)
+        logger.info("✅ Прогресс сброшен пользователям: %d", updated)
+        return updated
+
+    async def reset_user_progress(self, user_id: int) -> bool:
+        """Сбрасывает прогресс пользователя (админская функция)"""
+        try:
+            return await self.bulk_reset_progress({"user_ids": [user_id]}) > 0
+        except Exception as e:
+            logger.error(f"❌ Ошибка сброса прогресса пользователя {user_id}: {e}")
+            return False
 
     # ---------------- Сброс прогресса ----------------
     async def reset_progress(self, user_id: int):
         """Сбрасывает прогресс пользователя (XP, уровень, max_combo)."""
-        await self._ensure_connected()
-        await self.conn.execute(
-            "UPDATE users SET xp = 0, level = 1, max_combo = 0 WHERE user_id = ?",
-            (user_id,)
-        )
-        # Также удаляем достижения пользователя
-        await self.conn.execute(
-            "DELETE FROM achievements WHERE user_id = ?",
-            (user_id,)
-        )
-        # Сбрасываем статистику
-        await self.conn.execute(
-            "DELETE FROM user_stats WHERE user_id = ?",
-            (user_id,)
-        )
-        # Сбрасываем награды
-        await self.conn.execute(
-            "DELETE FROM daily_rewards WHERE user_id = ?",
-            (user_id,)
-        )
-        # Сбрасываем статистику по категориям
-        await self.conn.execute(
-            "DELETE FROM category_stats WHERE user_id = ?",
-            (user_id,)
-        )
-        # Сбрасываем статистику дуэлей
-        await self.conn.execute(
-            "DELETE FROM duel_stats WHERE user_id = ?",
-            (user_id,)
-        )
-        await self.conn.commit()
+        async with self._writing() as conn:
+            self.counters.discard(user_id)
+            old_xp = await self._current_xp(conn, user_id)
+            await conn.execute(
+                "UPDATE users SET xp = 0, level = 1, max_combo = 0 WHERE user_id = ?",
+                (user_id,)
+            )
+            # Также удаляем достижения пользователя
+            await conn.execute(
+                "DELETE FROM achievements WHERE user_id = ?",
+                (user_id,)
+            )
+            # Сбрасываем статистику
+            await conn.execute(
+                "DELETE FROM user_stats WHERE user_id = ?",
+                (user_id,)
+            )
+            # Сбрасываем награды
+            await conn.execute(
+                "DELETE FROM daily_rewards WHERE user_id = ?",
+                (user_id,)
+            )
+            # Сбрасываем статистику по категориям
+            await conn.execute(
+                "DELETE FROM category_stats WHERE user_id = ?",
+                (user_id,)
+            )
+            # Сбрасываем статистику дуэлей
+            await conn.execute(
+                "DELETE FROM duel_stats WHERE user_id = ?",
+                (user_id,)
+            )
+            # Сбрасываем историю заданных вопросов
+            self.asked_questions.discard(user_id)
+            await conn.execute(
+                "DELETE FROM user_question_history WHERE user_id = ?",
+                (user_id,)
+            )
+
+        if old_xp is not None:
+            self._on_commit(partial(self.leaderboard.set_xp, user_id, old_xp, 0, 1))
+            self._on_commit(partial(self.leaderboard.update_details, user_id, max_combo=0))
 
     # ---------------- СИСТЕМА ДОСТИЖЕНИЙ ----------------
 
     async def add_achievement(self, user_id: int, achievement_id: str) -> bool:
         """Добавляет достижение пользователю, если его еще нет."""
-        await self._ensure_connected()
-
-        # Проверяем, есть ли уже такое достижение
-        async with self.conn.execute(
-                "SELECT 1 FROM achievements WHERE user_id = ? AND achievement_id = ?",
-                (user_id, achievement_id)
-        ) as cursor:
-            exists = await cursor.fetchone()
-
-        if not exists:
-            await self.conn.execute(
-                "INSERT INTO achievements (user_id, achievement_id) VALUES (?, ?)",
-                (user_id, achievement_id)
-            )
-            await self.conn.commit()
-            return True
-        return False
+        async with self._writing() as conn:
+            # Проверяем, есть ли уже такое достижение
+            async with conn.execute(
+                    "SELECT 1 FROM achievements WHERE user_id = ? AND achievement_id = ?",
+                    (user_id, achievement_id)
+            ) as cursor:
+                exists = await cursor.fetchone()
+
+            if not exists:
+                await conn.execute(
+                    "INSERT INTO achievements (user_id, achievement_id) VALUES (?, ?)",
+                    (user_id, achievement_id)
+                )
+                return True
+            return False
 
     async def get_user_achievements(self, user_id: int) -> List[Dict[str, Any]]:
         """Получает все достижения пользователя."""
-        await self._ensure_connected()
-
-        async with self.conn.execute('''
-            SELECT achievement_id, unlocked_at 
-            FROM achievements 
-            WHERE user_id = ? 
-            ORDER BY unlocked_at DESC
-        ''', (user_id,)) as cursor:
-            rows = await cursor.fetchall()
+        async with self._reading() as conn:
+            async with conn.execute('''
+                SELECT achievement_id, unlocked_at 
+                FROM achievements 
+                WHERE user_id = ? 
+                ORDER BY unlocked_at DESC
+            ''', (user_id,)) as cursor:
+                rows = await cursor.fetchall()
 
-        achievements = []
-        for row in rows:
-            achievements.append({
-                "achievement_id": row[0],
-                "unlocked_at": row[1]
-            })
-        return achievements
+            achievements = []
+            for row in rows:
+                achievements.append({
+                    "achievement_id": row[0],
+                    "unlocked_at": row[1]
+                })
+            return achievements
 
     async def get_achievements_count(self, user_id: int) -> int:
         """Получает количество достижений пользователя."""
-        await self._ensure_connected()
-
-        async with self.conn.execute(
-                "SELECT COUNT(*) FROM achievements WHERE user_id = ?",
-                (user_id,)
-        ) as cursor:
-            result = await cursor.fetchone()
-            return result[0] if result else 0
+        async with self._reading() as conn:
+            async with conn.execute(
+                    "SELECT COUNT(*) FROM achievements WHERE user_id = ?",
+                    (user_id,)
+            ) as cursor:
+                result = await cursor.fetchone()
+                return result[0] if result else 0
 
     # ---------------- СТАТИСТИКА ПО КАТЕГОРИЯМ ----------------
 
     async def update_user_category_stats(self, user_id: int, category: str, is_correct: bool):
         """Обновляет статистику по категориям"""
-        await self._ensure_connected()
+        async with self._writing() as conn:
+            if is_correct:
+                await conn.execute('''
+                    INSERT INTO category_stats (user_id, category, total_answers, correct_answers)
+                    VALUES (?, ?, 1, 1)
+                    ON CONFLICT(user_id, category) 
+                    DO UPDATE SET 
+                        total_answers = total_answers + 1,
+                        correct_answers = correct_answers + 1,
+                        last_played = CURRENT_TIMESTAMP
+                ''', (user_id, category))
+            else:
+                await conn.execute('''
+                    INSERT INTO category_stats (user_id, category, total_answers, correct_answers)
+                    VALUES (?, ?, 1, 0)
+                    ON CONFLICT(user_id, category) 
+                    DO UPDATE SET 
+                        total_answers = total_answers + 1,
+                        last_played = CURRENT_TIMESTAMP
+                ''', (user_id, category))
+
+    def record_answer(self, user_id: int, category: str, is_correct: bool):
+        """Учитывает ответ в счетчиках категории и общей статистики.
+
+        Без обращения к БД: счетчики копятся в памяти и сбрасываются flush_counters().
+        """
+        self.counters.add_answer(user_id, category, is_correct)
 
-        if is_correct:
-            await self.conn.execute('''
-                INSERT INTO category_stats (user_id, category, total_answers, correct_answers)
-                VALUES (?, ?, 1, 1)
-                ON CONFLICT(user_id, category) 
-                DO UPDATE SET 
-                    total_answers = total_answers + 1,
-                    correct_answers = correct_answers + 1,
-                    last_played = CURRENT_TIMESTAMP
-            ''', (user_id, category))
-        else:
-            await self.conn.execute('''
-                INSERT INTO category_stats (user_id, category, total_answers, correct_answers)
-                VALUES (?, ?, 1, 0)
-                ON CONFLICT(user_id, category) 
-                DO UPDATE SET 
-                    total_answers = total_answers + 1,
-                    last_played = CURRENT_TIMESTAMP
-            ''', (user_id, category))
+    async def flush_counters(self) -> int:
+        """Сбрасывает накопленные счетчики ответов в БД двумя executemany.
+
+        Возвращает количество записанных строк.
+        """
+        if not len(self.counters):
+            return 0
+
+        category_rows: List[Tuple] = []
+        total_rows: List[Tuple] = []
+        written = False
+        try:
+            async with self._writing() as conn:
+                # Забираем дельты уже в своей очереди записи
+                category_rows, total_rows = self.counters.drain()
+                await conn.executemany('''
+                    INSERT INTO category_stats (user_id, category, total_answers, correct_answers, last_played)
+                    VALUES (?, ?, ?, ?, datetime(?, 'unixepoch'))
+                    ON CONFLICT(user_id, category) DO UPDATE SET
+                        total_answers = total_answers + excluded.total_answers,
+                        correct_answers = correct_answers + excluded.correct_answers,
+                        last_played = excluded.last_played
+                ''', category_rows)
+                self.counters.categories_written()
+
+                await conn.executemany('''
+                    INSERT INTO user_stats (user_id, total_answers, correct_answers, last_activity)
+                    VALUES (?, ?, ?, datetime(?, 'unixepoch'))
+                    ON CONFLICT(user_id) DO UPDATE SET
+                        total_answers = total_answers + excluded.total_answers,
+                        correct_answers = correct_answers + excluded.correct_answers,
+                        last_activity = excluded.last_activity
+                ''', total_rows)
+                self.counters.totals_written()
+                written = True
+        except asyncio.CancelledError:
+            # Отмена до конца записи - дельты не должны потеряться
+            if not written:
+                self.counters.restore(category_rows, total_rows)
+            raise
+        except Exception as e:
+            logger.error("❌ Ошибка сброса счетчиков статистики: %s", e)
+            self.counters.restore(category_rows, total_rows)
+            return 0
+
+        logger.debug("💾 Сброшено счетчиков: %d категорий, %d пользователей", len(category_rows), len(total_rows))
+        return len(category_rows) + len(total_rows)
+
+    async def _counters_flush_loop(self):
+        """Периодически сбрасывает счетчики ответов и журнал ответов в БД."""
+        next_retention = 0.0
+        while True:
+            await asyncio.sleep(STATS_FLUSH_INTERVAL)
+            await self.flush_counters()
+            await self.flush_answer_events()
+            await self.flush_asked_questions()
+            # Старые разделы журнала проверяем раз в час
+            if ANSWER_EVENTS_RETENTION_DAYS > 0 and time.monotonic() >= next_retention:
+                next_retention = time.monotonic() + 3600
+                try:
+                    await self.drop_answer_event_partitions(now_ts() - ANSWER_EVENTS_RETENTION_DAYS * 86400)
+                except Exception as e:
+                    logger.error("❌ Ошибка удаления старых разделов журнала ответов: %s", e)
+
+    # ---------------- ИСТОРИЯ ЗАДАННЫХ ВОПРОСОВ ----------------
+
+    async def load_asked_questions(self, user_id: int):
+        """Загружает маску заданных вопросов пользователя в память (если ее там нет)"""
+        if user_id in self.asked_questions:
+            return
+        async with self._reading() as conn:
+            async with conn.execute(
+                    "SELECT asked FROM user_question_history WHERE user_id = ?", (user_id,)
+            ) as cursor:
+                row = await cursor.fetchone()
+        self.asked_questions.put(user_id, blob_to_bits(row[0] if row else None))
+
+    async def flush_asked_questions(self) -> int:
+        """Пишет измененные маски заданных вопросов одним executemany.
+
+        Возвращает количество записанных масок.
+        """
+        rows: List[Tuple[int, bytes]] = []
+        written = False
+        try:
+            async with self._writing() as conn:
+                rows = self.asked_questions.drain()
+                if not rows:
+                    return 0
+                await conn.executemany('''
+                    INSERT INTO user_question_history (user_id, asked) VALUES (?, ?)
+                    ON CONFLICT(user_id) DO UPDATE SET asked = excluded.asked
+                ''', rows)
+                # Вытеснять записанные маски можно только после коммита
+                self._on_commit(self.asked_questions.written)
+                written = True
+        except asyncio.CancelledError:
+            if not written:
+                self.asked_questions.restore(rows)
+            raise
+        except Exception as e:
+            logger.error("❌ Ошибка записи истории вопросов: %s", e)
+            self.asked_questions.restore(rows)
+            return 0
+
+        logger.debug("💾 Записано историй вопросов: %d", len(rows))
+        return len(rows)
+
+    # ---------------- ЖУРНАЛ ОТВЕТОВ ----------------
+
+    def record_answer_event(self, user_id: int, question_id: int, category_id: int, chosen: int,
+                            is_correct: bool, latency_ms: Optional[int], source: int):
+        """Добавляет событие ответа в журнал answer_events.
+
+        Без обращения к БД: события копятся в кольцевом буфере и пишутся пачкой
+        flush_answer_events() - по таймеру или сразу, когда накопилось
+        ANSWER_EVENTS_FLUSH_SIZE событий.
+        """
+        self.answer_events.append(
+            (user_id, question_id, category_id, chosen, int(is_correct), latency_ms, source, now_ts())
+        )
+        if (len(self.answer_events) >= ANSWER_EVENTS_FLUSH_SIZE and self._writer
+                and (self._events_flush_task is None or self._events_flush_task.done())):
+            # Чистый контекст: внутри transaction() сброс иначе унаследует _in_transaction
+            # и запишет события в чужую транзакцию в обход очереди актора
+            self._events_flush_task = asyncio.create_task(self.flush_answer_events(), context=Context())
+
+    @staticmethod
+    async def _answer_event_partitions(conn: aiosqlite.Connection) -> Dict[str, Tuple[int, int]]:
+        """Разделы журнала: имя таблицы -> (начало, конец) в unix-времени"""
+        async with conn.execute("SELECT name, starts_at, ends_at FROM answer_event_partitions") as cursor:
+            return {name: (starts_at, ends_at) for name, starts_at, ends_at in await cursor.fetchall()}
+
+    @staticmethod
+    async def _rebuild_answer_events_view(conn: aiosqlite.Connection, names: Iterable[str]):
+        await conn.execute("DROP VIEW IF EXISTS answer_events")
+        await conn.execute(view_sql(names))
+
+    async def flush_answer_events(self) -> int:
+        """Пишет накопленные события ответов в таблицы-разделы.
+
+        События раскладываются по разделам answer_events_ГГГГММДД длиной
+        ANSWER_EVENTS_PARTITION_DAYS суток; недостающие разделы создаются в той же
+        транзакции, представление answer_events перестраивается. Возвращает
+        количество записанных событий.
+        """
+        if not len(self.answer_events):
+            return 0
+
+        events: List[Tuple] = []
+        written = False
+        columns = ", ".join(ANSWER_EVENT_COLUMNS)
+        placeholders = ", ".join("?" for _ in ANSWER_EVENT_COLUMNS)
+        try:
+            async with self._writing() as conn:
+                events = self.answer_events.drain()
+                partitions = await self._answer_event_partitions(conn)
+                created = False
+                for start, group in group_by_partition(events, ANSWER_EVENTS_PARTITION_DAYS).items():
+                    name = partition_name(start)
+                    if name not in partitions:
+                        for statement in partition_ddl(name):
+                            await conn.execute(statement)
+                        end = start + ANSWER_EVENTS_PARTITION_DAYS * 86400
+                        await conn.execute(
+                            "INSERT INTO answer_event_partitions (name, starts_at, ends_at) VALUES (?, ?, ?)",
+                            (name, start, end)
+                        )
+                        partitions[name] = (start, end)
+                        created = True
+                    await conn.executemany(f"INSERT INTO {name} ({columns}) VALUES ({placeholders})", group)
+                if created:
+                    await self._rebuild_answer_events_view(conn, partitions)
+                written = True
+        except asyncio.CancelledError:
+            if not written:
+                self.answer_events.restore(events)
+            raise
+        except Exception as e:
+            logger.error("❌ Ошибка записи журнала ответов: %s", e)
+            self.answer_events.restore(events)
+            return 0
 
-        await self.conn.commit()
+        logger.debug("💾 Записано событий ответов: %d", len(events))
+        return len(events)
+
+    async def drop_answer_event_partitions(self, before: int) -> List[str]:
+        """Удаляет разделы журнала, целиком закончившиеся до before (unix-время).
+
+        Старые данные уходят через DROP TABLE, без построчного DELETE.
+        Возвращает имена удаленных разделов.
+        """
+        async with self._writing() as conn:
+            partitions = await self._answer_event_partitions(conn)
+            expired = sorted(name for name, (_, end) in partitions.items() if end <= before)
+            if not expired:
+                return []
+            for name in expired:
+                await conn.execute(f"DROP TABLE IF EXISTS {name}")
+                await conn.execute("DELETE FROM answer_event_partitions WHERE name = ?", (name,))
+                del partitions[name]
+            await self._rebuild_answer_events_view(conn, partitions)
+
+        logger.info("🧹 Удалены разделы журнала ответов: %s", ", ".join(expired))
+        return expired
 
     async def get_user_category_stats(self, user_id: int) -> Dict[str, Dict]:
-        """Получает статистику пользователя по категориям"""
+        """Получает статистику пользователя по категориям (с учетом несброшенных счетчиков).
+
+        Читаем через соединение записи, а не пул: так запись дельт в БД и их
+        удаление из памяти видны согласованно и ответы не считаются дважды.
+        """
         await self._ensure_connected()
 
         async with self.conn.execute('''
             SELECT category, total_answers, correct_answers, last_played
             FROM category_stats 
             WHERE user_id = ?
-            ORDER BY total_answers DESC
         ''', (user_id,)) as cursor:
             rows = await cursor.fetchall()
 
+        merged = {row[0]: [row[1], row[2], row[3]] for row in rows}
+        for category, (total, correct, ts) in self.counters.pending_categories(user_id).items():
+            current = merged.setdefault(category, [0, 0, None])
+            current[0] += total
+            current[1] += correct
+            current[2] = datetime.utcfromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+
         stats = {}
-        for row in rows:
-            category, total, correct, last_played = row
+        for category, (total, correct, last_played) in sorted(merged.items(), key=lambda x: -x[1][0]):
             accuracy = round((correct / total * 100), 1) if total > 0 else 0
             stats[category] = {
                 "total_answers": total,
@@ -464,11 +1596,14 @@ class Database:  # ← ТОЛЬКО ОДИН РАЗ!
         ) as cursor:
             row = await cursor.fetchone()
 
+        # Добавляем еще не сброшенные в БД ответы
+        pending_total, pending_correct = self.counters.pending_totals(user_id)
+
         if row:
             return {
                 "user_id": row[0],
-                "total_answers": row[1],
-                "correct_answers": row[2],
+                "total_answers": row[1] + pending_total,
+                "correct_answers": row[2] + pending_correct,
                 "total_combo": row[3],
                 "perfect_quizzes": row[4],
                 "categories_completed": row[5],
@@ -476,15 +1611,15 @@ class Database:  # ← ТОЛЬКО ОДИН РАЗ!
             }
         else:
             # Создаем запись, если не существует
-            await self.conn.execute(
-                "INSERT INTO user_stats (user_id) VALUES (?)",
-                (user_id,)
-            )
-            await self.conn.commit()
+            async with self._writing() as conn:
+                await conn.execute(
+                    "INSERT INTO user_stats (user_id) VALUES (?)",
+                    (user_id,)
+                )
             return {
                 "user_id": user_id,
-                "total_answers": 0,
-                "correct_answers": 0,
+                "total_answers": pending_total,
+                "correct_answers": pending_correct,
                 "total_combo": 0,
                 "perfect_quizzes": 0,
                 "categories_completed": 0,
@@ -493,33 +1628,29 @@ class Database:  # ← ТОЛЬКО ОДИН РАЗ!
 
     async def update_user_stats(self, user_id: int, updates: Dict[str, Any]):
         """Обновляет статистику пользователя."""
-        await self._ensure_connected()
-
-        # Сначала убедимся, что запись существует
-        await self.get_user_stats(user_id)
+        async with self._writing() as conn:
+            # Сначала убедимся, что запись существует
+            await self.get_user_stats(user_id)
 
-        set_clause = ', '.join([f"{key} = ?" for key in updates.keys()])
-        values = list(updates.values())
-        values.append(user_id)
+            set_clause = ', '.join([f"{key} = ?" for key in updates.keys()])
+            values = list(updates.values())
+            values.append(user_id)
 
-        await self.conn.execute(
-            f"UPDATE user_stats SET {set_clause} WHERE user_id = ?",
-            values
-        )
-        await self.conn.commit()
+            await conn.execute(
+                f"UPDATE user_stats SET {set_clause} WHERE user_id = ?",
+                values
+            )
 
     async def increment_user_stats(self, user_id: int, field: str, value: int = 1):
         """Увеличивает значение поля статистики на указанное число."""
-        await self._ensure_connected()
-
-        # Сначала убедимся, что запись существует
-        await self.get_user_stats(user_id)
+        async with self._writing() as conn:
+            # Сначала убедимся, что запись существует
+            await self.get_user_stats(user_id)
 
-        await self.conn.execute(
-            f"UPDATE user_stats SET {field} = {field} + ? WHERE user_id = ?",
-            (value, user_id)
-        )
-        await self.conn.commit()
+            await conn.execute(
+                f"UPDATE user_stats SET {field} = {field} + ? WHERE user_id = ?",
+                (value, user_id)
+            )
 
     # ---------------- ЕЖЕДНЕВНЫЕ НАГРАДЫ ----------------
 
@@ -541,11 +1672,11 @@ class Database:  # ← ТОЛЬКО ОДИН РАЗ!
             }
 
         # Создаем запись, если не существует
-        await self.conn.execute(
-            "INSERT INTO daily_rewards (user_id) VALUES (?)",
-            (user_id,)
-        )
-        await self.conn.commit()
+        async with self._writing() as conn:
+            await conn.execute(
+                "INSERT INTO daily_rewards (user_id) VALUES (?)",
+                (user_id,)
+            )
 
         return {
             "last_reward_date": None,
@@ -554,592 +1685,1040 @@ class Database:  # ← ТОЛЬКО ОДИН РАЗ!
         }
 
     async def claim_daily_reward(self, user_id: int, reward_xp: int) -> Dict[str, Any]:
-        """Выдает ежедневную награду и возвращает информацию о награде."""
-        await self._ensure_connected()
+        """Выдает ежедневную награду и возвращает информацию о награде.
 
-        reward_info = await self.get_daily_reward_info(user_id)
+        Проверка "уже получал сегодня", стрик и счетчик наград - один UPSERT:
+        условие WHERE в DO UPDATE не даст выдать награду дважды за день.
+        """
         today = datetime.now().date()
-
-        # Если уже получал награду сегодня
-        if reward_info["last_reward_date"] == str(today):
-            return {"success": False, "message": "Сегодня вы уже получали награду"}
-
-        # Проверяем стрик (последовательные дни)
         yesterday = today - timedelta(days=1)
-        new_streak = 1
-
-        if reward_info["last_reward_date"] == str(yesterday):
-            new_streak = reward_info["streak_count"] + 1
-        elif reward_info["last_reward_date"] and reward_info["last_reward_date"] != str(today):
-            # Пропустил день - сбрасываем стрик
-            new_streak = 1
-
-        # Вычисляем бонус за стрик
-        streak_bonus = min(new_streak * 5, 50)  # Макс +50% за 10 дней
-        total_xp = reward_xp + (reward_xp * streak_bonus // 100)
-
-        # Обновляем данные
-        await self.conn.execute(
-            """UPDATE daily_rewards 
-               SET last_reward_date = ?, streak_count = ?, total_rewards = total_rewards + 1 
-               WHERE user_id = ?""",
-            (today, new_streak, user_id)
-        )
 
-        # Начисляем XP
-        new_xp, new_level = await self.add_xp(user_id, total_xp)
+        async with self.transaction() as conn:
+            async with conn.execute('''
+                INSERT INTO daily_rewards (user_id, last_reward_date, streak_count, total_rewards)
+                VALUES (:user_id, :today, 1, 1)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    -- Стрик растет только если прошлая награда была вчера, иначе сброс
+                    streak_count = CASE
+                        WHEN last_reward_date = :yesterday THEN streak_count + 1
+                        ELSE 1
+                    END,
+                    last_reward_date = excluded.last_reward_date,
+                    total_rewards = total_rewards + 1
+                WHERE last_reward_date IS NULL OR last_reward_date <> excluded.last_reward_date
+                RETURNING streak_count
+            ''', {"user_id": user_id, "today": str(today), "yesterday": str(yesterday)}) as cursor:
+                row = await cursor.fetchone()
 
-        await self.conn.commit()
+            # Строка не вернулась - сегодня награда уже выдана
+            if not row:
+                return {"success": False, "message": "Сегодня вы уже получали награду"}
 
-        return {
-            "success": True,
-            "xp_reward": total_xp,
-            "base_xp": reward_xp,
-            "streak_bonus": streak_bonus,
-            "new_streak": new_streak,
-            "new_xp": new_xp,
-            "new_level": new_level
-        }
+            new_streak = row[0]
 
-    # ---------------- ДУЭЛИ ----------------
+            # Вычисляем бонус за стрик
+            streak_bonus = min(new_streak * 5, 50)  # Макс +50% за 10 дней
+            total_xp = reward_xp + (reward_xp * streak_bonus // 100)
 
-    async def create_duels_table(self):
-        """Создает таблицу для хранения статистики дуэлей"""
-        await self._ensure_connected()
+            # Начисляем XP в той же транзакции
+            new_xp, new_level = await self.add_xp(user_id, total_xp)
 
-        await self.conn.execute('''
-            CREATE TABLE IF NOT EXISTS duels (
-                duel_id TEXT PRIMARY KEY,
-                format_type TEXT,
-                team_a_players TEXT,  -- JSON список user_id
-                team_b_players TEXT,  -- JSON список user_id  
-                winner_team TEXT,
-                team_a_score INTEGER DEFAULT 0,
-                team_b_score INTEGER DEFAULT 0,
-                category TEXT,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                finished_at DATETIME
-            )
-        ''')
-
-        await self.conn.execute('''
-            CREATE TABLE IF NOT EXISTS duel_stats (
-                user_id INTEGER,
-                total_duels INTEGER DEFAULT 0,
-                wins INTEGER DEFAULT 0,
-                losses INTEGER DEFAULT 0,
-                total_score INTEGER DEFAULT 0,
-                average_score REAL DEFAULT 0,
-                favorite_format TEXT,
-                last_duel DATETIME,
-                PRIMARY KEY (user_id),
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-        ''')
+            return {
+                "success": True,
+                "xp_reward": total_xp,
+                "base_xp": reward_xp,
+                "streak_bonus": streak_bonus,
+                "new_streak": new_streak,
+                "new_xp": new_xp,
+                "new_level": new_level
+            }
 
-        await self.conn.commit()
+    # ---------------- ДУЭЛИ ----------------
 
     async def save_duel_result(self, duel_data: Dict):
-        """Сохраняет результат дуэли"""
-        await self._ensure_connected()
+        """Сохраняет результат дуэли и участников.
+
+        Необязательные ключи duel_data: player_scores {user_id: очки}
+        и response_ms {user_id: среднее время ответа в мс}.
+        """
+        team_a = duel_data['team_a_players']
+        team_b = duel_data['team_b_players']
+        player_scores = duel_data.get('player_scores') or {}
+        response_ms = duel_data.get('response_ms') or {}
+        winner_team = duel_data['winner_team']
 
         try:
-            await self.conn.execute('''
-                INSERT INTO duels (duel_id, format_type, team_a_players, team_b_players, 
-                                  winner_team, team_a_score, team_b_score, category, finished_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-            ''', (
-                duel_data['duel_id'],
-                duel_data['format_type'],
-                json.dumps(duel_data['team_a_players']),
-                json.dumps(duel_data['team_b_players']),
-                duel_data['winner_team'],
-                duel_data['team_a_score'],
-                duel_data['team_b_score'],
-                duel_data['category']
-            ))
-
-            # Обновляем статистику игроков
-            for user_id in duel_data['team_a_players'] + duel_data['team_b_players']:
-                await self.update_duel_stats(user_id, duel_data['winner_team'], user_id in duel_data['team_a_players'])
-
-            await self.conn.commit()
+            async with self._writing() as conn:
+                await conn.execute('''
+                    INSERT INTO duels (duel_id, format_type, team_a_players, team_b_players, 
+                                      winner_team, team_a_score, team_b_score, category, finished_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ''', (
+                    duel_data['duel_id'],
+                    duel_data['format_type'],
+                    json.dumps(team_a),
+                    json.dumps(team_b),
+                    winner_team,
+                    duel_data['team_a_score'],
+                    duel_data['team_b_score'],
+                    duel_data['category']
+                ))
+
+                # Участники - одной пачкой, finished_at берем из только что вставленной дуэли
+                participants = [(user_id, "team_a") for user_id in team_a] + [(user_id, "team_b") for user_id in team_b]
+
+                # Игрок мог прийти в дуэль, ни разу не сыграв соло - duel_stats ссылается на users
+                new_users = []
+                for user_id, _ in participants:
+                    cursor = await conn.execute('''
+                        INSERT OR IGNORE INTO users (user_id, username, created_at, last_active)
+                        VALUES (?, '', CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+                    ''', (user_id,))
+                    if cursor.rowcount:
+                        new_users.append(user_id)
+                    await cursor.close()
+
+                await conn.executemany('''
+                    INSERT INTO duel_participants (duel_id, user_id, team, score, response_ms, finished_at)
+                    SELECT duel_id, ?, ?, ?, ?, finished_at FROM duels WHERE duel_id = ?
+                ''', [
+                    (user_id, team, player_scores.get(user_id, 0), response_ms.get(user_id), duel_data['duel_id'])
+                    for user_id, team in participants
+                ])
+
+                # Обновляем статистику игроков
+                await conn.executemany(UPDATE_DUEL_STATS_SQL, [
+                    self._duel_stats_params(user_id, winner_team, team == "team_a")
+                    for user_id, team in participants
+                ])
+
+            for user_id in new_users:
+                self._on_commit(partial(self.leaderboard.add_user, user_id))
             logger.info(f"✅ Сохранен результат дуэли {duel_data['duel_id']}")
 
         except Exception as e:
             logger.error(f"❌ Ошибка сохранения дуэли {duel_data['duel_id']}: {e}")
-            await self.conn.rollback()
-
-    async def update_duel_stats(self, user_id: int, winner_team: str, is_team_a: bool):
-        """Обновляет статистику дуэлей игрока"""
-        await self._ensure_connected()
 
+    @staticmethod
+    def _duel_stats_params(user_id: int, winner_team: str, is_team_a: bool) -> Tuple:
         won = (winner_team == "team_a" and is_team_a) or (winner_team == "team_b" and not is_team_a)
+        return user_id, 1 if won else 0, 0 if won else 1, 1 if won else 0, 0 if won else 1
 
-        await self.conn.execute('''
-            INSERT INTO duel_stats (user_id, total_duels, wins, losses, last_duel)
-            VALUES (?, 1, ?, ?, CURRENT_TIMESTAMP)
-            ON CONFLICT(user_id) 
-            DO UPDATE SET 
-                total_duels = total_duels + 1,
-                wins = wins + ?,
-                losses = losses + ?,
-                last_duel = CURRENT_TIMESTAMP
-        ''', (user_id, 1 if won else 0, 0 if won else 1, 1 if won else 0, 0 if won else 1))
-
-        await self.conn.commit()
+    async def update_duel_stats(self, user_id: int, winner_team: str, is_team_a: bool):
+        """Обновляет статистику дуэлей игрока"""
+        async with self._writing() as conn:
+            await conn.execute(UPDATE_DUEL_STATS_SQL, self._duel_stats_params(user_id, winner_team, is_team_a))
 
     async def get_duel_stats(self, user_id: int) -> Dict:
         """Получает статистику дуэлей игрока"""
-        await self._ensure_connected()
+        async with self._reading() as conn:
+            async with conn.execute(
+                    "SELECT * FROM duel_stats WHERE user_id = ?", (user_id,)
+            ) as cursor:
+                row = await cursor.fetchone()
 
-        async with self.conn.execute(
-                "SELECT * FROM duel_stats WHERE user_id = ?", (user_id,)
-        ) as cursor:
-            row = await cursor.fetchone()
+            if row:
+                return {
+                    "user_id": row[0],
+                    "total_duels": row[1],
+                    "wins": row[2],
+                    "losses": row[3],
+                    "total_score": row[4],
+                    "average_score": row[5],
+                    "favorite_format": row[6],
+                    "last_duel": row[7],
+                    "win_rate": round((row[2] / row[1] * 100) if row[1] > 0 else 0, 1)
+                }
 
-        if row:
             return {
-                "user_id": row[0],
-                "total_duels": row[1],
-                "wins": row[2],
-                "losses": row[3],
-                "total_score": row[4],
-                "average_score": row[5],
-                "favorite_format": row[6],
-                "last_duel": row[7],
-                "win_rate": round((row[2] / row[1] * 100) if row[1] > 0 else 0, 1)
+                "user_id": user_id,
+                "total_duels": 0,
+                "wins": 0,
+                "losses": 0,
+                "total_score": 0,
+                "average_score": 0,
+                "favorite_format": None,
+                "last_duel": None,
+                "win_rate": 0
             }
 
-        return {
-            "user_id": user_id,
-            "total_duels": 0,
-            "wins": 0,
-            "losses": 0,
-            "total_score": 0,
-            "average_score": 0,
-            "favorite_format": None,
-            "last_duel": None,
-            "win_rate": 0
-        }
-
     async def get_user_duel_history(self, user_id: int, limit: int = 10) -> List[Dict[str, Any]]:
-        """Получает историю дуэлей пользователя"""
-        await self._ensure_connected()
+        """Получает историю дуэлей пользователя (по индексу duel_participants)"""
+        async with self._reading() as conn:
+            async with conn.execute('''
+                SELECT d.duel_id, d.format_type, d.winner_team, d.team_a_score, d.team_b_score, 
+                       d.category, d.created_at, p.team, p.score, p.response_ms
+                FROM duel_participants p
+                JOIN duels d ON d.duel_id = p.duel_id
+                WHERE p.user_id = ?
+                ORDER BY p.finished_at DESC
+                LIMIT ?
+            ''', (user_id, limit)) as cursor:
+                rows = await cursor.fetchall()
 
-        async with self.conn.execute('''
-            SELECT d.duel_id, d.format_type, d.winner_team, d.team_a_score, d.team_b_score, 
-                   d.category, d.created_at,
-                   (CASE 
-                       WHEN ? IN (SELECT value FROM json_each(d.team_a_players)) THEN 'team_a'
-                       ELSE 'team_b' 
-                    END) as user_team
-            FROM duels d
-            WHERE d.team_a_players LIKE ? OR d.team_b_players LIKE ?
-            ORDER BY d.created_at DESC
-            LIMIT ?
-        ''', (user_id, f'%{user_id}%', f'%{user_id}%', limit)) as cursor:
-            rows = await cursor.fetchall()
+            history = []
+            for row in rows:
+                (duel_id, format_type, winner_team, team_a_score, team_b_score, category, created_at,
+                 user_team, personal_score, response_ms) = row
+
+                history.append({
+                    "duel_id": duel_id,
+                    "format_type": format_type,
+                    "user_team": user_team,
+                    "user_won": winner_team == user_team,
+                    "score": f"{team_a_score}-{team_b_score}",
+                    "personal_score": personal_score,
+                    "response_ms": response_ms,
+                    "category": category,
+                    "created_at": created_at
+                })
+
+            return history
 
-        history = []
-        for row in rows:
-            duel_id, format_type, winner_team, team_a_score, team_b_score, category, created_at, user_team = row
+    async def get_duel_leaderboard(self, limit: int = 10) -> List[Dict[str, Any]]:
+        """Возвращает таблицу лидеров по дуэлям"""
+        async with self._reading() as conn:
+            async with conn.execute('''
+                SELECT ds.user_id, u.username, ds.wins, ds.losses, ds.total_duels,
+                       ROUND((ds.wins * 100.0 / ds.total_duels), 1) as win_rate,
+                       ds.total_score
+                FROM duel_stats ds
+                JOIN users u ON ds.user_id = u.user_id
+                WHERE ds.total_duels >= 5
+                ORDER BY win_rate DESC, ds.wins DESC
+                LIMIT ?
+            ''', (limit,)) as cursor:
+                rows = await cursor.fetchall()
+
+            return [
+                {
+                    "user_id": row[0],
+                    "username": row[1] or "Аноним",
+                    "wins": row[2],
+                    "losses": row[3],
+                    "total_duels": row[4],
+                    "win_rate": row[5],
+                    "total_score": row[6]
+                }
+                for row in rows
+            ]
 
-            history.append({
-                "duel_id": duel_id,
-                "format_type": format_type,
-                "user_team": user_team,
-                "user_won": winner_team == user_team,
-                "score": f"{team_a_score}-{team_b_score}",
-                "category": category,
-                "created_at": created_at
-            })
+    # ---------------- РАССЫЛКИ ----------------
+
+    async def create_broadcast_job(self, text: str, total: int, admin_chat_id: int,
+                                   status_message_id: Optional[int] = None) -> int:
+        """Создает задание рассылки и возвращает его id"""
+        async with self._writing() as conn:
+            async with conn.execute('''
+                INSERT INTO broadcast_jobs (text, total, admin_chat_id, status_message_id)
+                VALUES (?, ?, ?, ?)
+                RETURNING job_id
+            ''', (text, total, admin_chat_id, status_message_id)) as cursor:
+                row = await cursor.fetchone()
 
-        return history
+        return row[0]
 
-    async def get_duel_leaderboard(self, limit: int = 10) -> List[Dict[str, Any]]:
-        """Возвращает таблицу лидеров по дуэлям"""
-        await self._ensure_connected()
+    async def get_broadcast_job(self, job_id: int) -> Optional[Dict[str, Any]]:
+        """Возвращает задание рассылки"""
+        async with self._reading() as conn:
+            async with conn.execute(
+                    f"SELECT {', '.join(_BROADCAST_JOB_COLUMNS)} FROM broadcast_jobs WHERE job_id = ?",
+                    (job_id,)
+            ) as cursor:
+                row = await cursor.fetchone()
 
-        async with self.conn.execute('''
-            SELECT ds.user_id, u.username, ds.wins, ds.losses, ds.total_duels,
-                   ROUND((ds.wins * 100.0 / ds.total_duels), 1) as win_rate,
-                   ds.total_score
-            FROM duel_stats ds
-            JOIN users u ON ds.user_id = u.user_id
-            WHERE ds.total_duels >= 5
-            ORDER BY win_rate DESC, ds.wins DESC
-            LIMIT ?
-        ''', (limit,)) as cursor:
-            rows = await cursor.fetchall()
+        return dict(zip(_BROADCAST_JOB_COLUMNS, row)) if row else None
+
+    async def get_broadcast_jobs(self, statuses: Sequence[str] = (), limit: int = 20) -> List[Dict[str, Any]]:
+        """Последние задания рассылок (при statuses - только с этими статусами)"""
+        where = f"WHERE status IN ({','.join('?' * len(statuses))})" if statuses else ""
+        async with self._reading() as conn:
+            async with conn.execute(
+                    f"SELECT {', '.join(_BROADCAST_JOB_COLUMNS)} FROM broadcast_jobs {where} "
+                    "ORDER BY job_id DESC LIMIT ?",
+                    (*statuses, limit)
+            ) as cursor:
+                rows = await cursor.fetchall()
 
-        return [
-            {
-                "user_id": row[0],
-                "username": row[1] or "Аноним",
-                "wins": row[2],
-                "losses": row[3],
-                "total_duels": row[4],
-                "win_rate": row[5],
-                "total_score": row[6]
-            }
-            for row in rows
-        ]
+        return [dict(zip(_BROADCAST_JOB_COLUMNS, row)) for row in rows]
+
+    async def update_broadcast_job(self, job_id: int, **fields):
+        """Сохраняет прогресс/статус задания рассылки"""
+        allowed = {"status", "cursor_user_id", "sent", "failed", "unreachable", "status_message_id"}
+        unknown = set(fields) - allowed
+        if unknown:
+            raise ValueError(f"Неизвестные поля задания рассылки: {', '.join(sorted(unknown))}")
+
+        assignments = [f"{name} = ?" for name in fields] + ["updated_at = CURRENT_TIMESTAMP"]
+        if fields.get("status") in ("done", "cancelled"):
+            assignments.append("finished_at = CURRENT_TIMESTAMP")
+
+        async with self._writing() as conn:
+            await conn.execute(
+                f"UPDATE broadcast_jobs SET {', '.join(assignments)} WHERE job_id = ?",
+                (*fields.values(), job_id)
+            )
+
+    async def get_broadcast_totals(self) -> Dict[str, int]:
+        """Итоги всех рассылок: {"jobs", "sent", "failed", "unreachable"}"""
+        async with self._reading() as conn:
+            async with conn.execute(
+                    "SELECT COUNT(*), SUM(sent), SUM(failed), SUM(unreachable) FROM broadcast_jobs"
+            ) as cursor:
+                row = await cursor.fetchone()
+
+        return {"jobs": row[0], "sent": row[1] or 0, "failed": row[2] or 0, "unreachable": row[3] or 0}
+
+    # ---------------- СТАТУС ДОСТАВКИ ----------------
+
+    async def mark_undeliverable(self, user_id: int, status: str) -> bool:
+        """Помечает пользователя недоступным (blocked / not_found) - рассылки его пропускают"""
+        if status not in DELIVERY_STATUSES or status == "active":
+            raise ValueError(f"Недопустимый статус доставки: {status!r}")
+
+        async with self._writing() as conn:
+            cursor = await conn.execute(
+                "UPDATE users SET delivery_status = ?, delivery_failed_at = CURRENT_TIMESTAMP "
+                "WHERE user_id = ? AND delivery_status <> ?",
+                (status, user_id, status)
+            )
+            return cursor.rowcount > 0
+
+    async def mark_reachable(self, user_id: int) -> bool:
+        """Снова разрешает доставку (пользователь написал боту). True - статус изменился"""
+        async with self._writing() as conn:
+            cursor = await conn.execute(
+                f"UPDATE users SET delivery_status = 'active', delivery_failed_at = NULL "
+                f"WHERE user_id = ? AND NOT ({REACHABLE_SQL})",
+                (user_id,)
+            )
+            return cursor.rowcount > 0
+
+    async def get_reachable_users_count(self) -> int:
+        """Количество пользователей, которым доходят сообщения"""
+        async with self._reading() as conn:
+            async with conn.execute(f"SELECT COUNT(*) FROM users WHERE {REACHABLE_SQL}") as cursor:
+                return (await cursor.fetchone())[0]
+
+    async def get_delivery_stats(self) -> Dict[str, int]:
+        """Аудитория по статусам доставки: {"total", "active", "blocked", "not_found"}"""
+        stats = dict.fromkeys(DELIVERY_STATUSES, 0)
+        async with self._reading() as conn:
+            # Оба запроса идут по частичным индексам, таблица users не читается
+            async with conn.execute(f"SELECT COUNT(*) FROM users WHERE {REACHABLE_SQL}") as cursor:
+                stats["active"] = (await cursor.fetchone())[0]
+            async with conn.execute(
+                    "SELECT delivery_status, COUNT(*) FROM users "
+                    "WHERE delivery_status <> 'active' GROUP BY delivery_status"
+            ) as cursor:
+                for status, count in await cursor.fetchall():
+                    stats[status] = count
+
+        stats["total"] = sum(stats.values())
+        return stats
 
     # ---------------- МЕТОДЫ ДЛЯ АДМИН-ПАНЕЛИ ----------------
 
     async def get_total_users_count(self) -> int:
         """Возвращает общее количество пользователей"""
-        await self._ensure_connected()
-
-        async with self.conn.execute("SELECT COUNT(*) FROM users") as cursor:
-            result = await cursor.fetchone()
-            return result[0] if result else 0
+        async with self._reading() as conn:
+            async with conn.execute("SELECT COUNT(*) FROM users") as cursor:
+                result = await cursor.fetchone()
+                return result[0] if result else 0
 
     async def get_active_users_count(self, days: int = 7) -> int:
         """Возвращает количество активных пользователей за последние N дней"""
-        await self._ensure_connected()
+        async with self._reading() as conn:
+            cutoff_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+
+            async with conn.execute('''
+                SELECT COUNT(DISTINCT user_id) 
+                FROM user_stats 
+                WHERE last_activity >= ?
+            ''', (cutoff_date,)) as cursor:
+                result = await cursor.fetchone()
+                return result[0] if result else 0
+
+    async def iter_users(self, batch_size: int = 1000, columns: Sequence[str] = ("user_id",),
+                         where: str = "", params: Sequence[Any] = ()) -> AsyncIterator[Tuple]:
+        """Потоково перебирает пользователей по возрастанию user_id.
+
+        Отдает кортежи с колонками columns таблицы users. where - SQL-условие
+        с плейсхолдерами params (только из кода, не из ввода пользователя).
+        Пачки читаются по ключу (user_id > последний), каждая - отдельным
+        коротким запросом, поэтому память не зависит от числа пользователей.
+
+        Пример:
+            async for user_id, xp in db.iter_users(columns=("user_id", "xp"), where="xp > ?", params=(0,)):
+                ...
+        """
+        for column in columns:
+            if not column.isidentifier():
+                raise ValueError(f"Недопустимое имя колонки: {column!r}")
+        select = ", ".join(f"u.{column}" for column in columns)
+        condition = f"AND ({where})" if where else ""
+        sql = f"""
+            SELECT {select}, u.user_id FROM users u
+            WHERE u.user_id > ? {condition}
+            ORDER BY u.user_id
+            LIMIT ?
+        """
 
-        cutoff_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+        last_id = -(2 ** 63)
+        while True:
+            async with self._reading() as conn:
+                async with conn.execute(sql, (last_id, *params, batch_size)) as cursor:
+                    rows = await cursor.fetchall()
+            if not rows:
+                return
 
-        async with self.conn.execute('''
-            SELECT COUNT(DISTINCT user_id) 
-            FROM user_stats 
-            WHERE last_activity >= ?
-        ''', (cutoff_date,)) as cursor:
-            result = await cursor.fetchone()
-            return result[0] if result else 0
+            for row in rows:
+                yield row[:-1]
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1][-1]
 
     async def get_all_users(self) -> List[Dict[str, Any]]:
-        """Возвращает список всех пользователей"""
-        await self._ensure_connected()
-
-        try:
-            # Пробуем выполнить запрос с created_at
-            async with self.conn.execute('''
-                SELECT u.user_id, u.username, u.level, u.xp, u.max_combo, u.created_at,
-                       us.total_answers, us.correct_answers, us.last_activity
-                FROM users u
-                LEFT JOIN user_stats us ON u.user_id = us.user_id
-                ORDER BY u.xp DESC
-            ''') as cursor:
-                rows = await cursor.fetchall()
-        except Exception as e:
-            # Если ошибка, выполняем упрощенный запрос без created_at
-            logger.warning("⚠️ Ошибка при получении пользователей: %s. Использую упрощенный запрос.", e)
-            async with self.conn.execute('''
-                SELECT u.user_id, u.username, u.level, u.xp, u.max_combo,
-                       us.total_answers, us.correct_answers, us.last_activity
-                FROM users u
-                LEFT JOIN user_stats us ON u.user_id = us.user_id
-                ORDER BY u.xp DESC
-            ''') as cursor:
+        """Возвращает список всех пользователей (для больших выборок - iter_users)"""
+        async with self._reading() as conn:
+            try:
+                # Пробуем выполнить запрос с created_at
+                async with conn.execute('''
+                    SELECT u.user_id, u.username, u.level, u.xp, u.max_combo, u.created_at,
+                           us.total_answers, us.correct_answers, us.last_activity
+                    FROM users u
+                    LEFT JOIN user_stats us ON u.user_id = us.user_id
+                    ORDER BY u.xp DESC
+                ''') as cursor:
+                    rows = await cursor.fetchall()
+            except Exception as e:
+                # Если ошибка, выполняем упрощенный запрос без created_at
+                logger.warning("⚠️ Ошибка при получении пользователей: %s. Использую упрощенный запрос.", e)
+                async with conn.execute('''
+                    SELECT u.user_id, u.username, u.level, u.xp, u.max_combo,
+                           us.total_answers, us.correct_answers, us.last_activity
+                    FROM users u
+                    LEFT JOIN user_stats us ON u.user_id = us.user_id
+                    ORDER BY u.xp DESC
+                ''') as cursor:
+                    rows = await cursor.fetchall()
+
+            users = []
+            for row in rows:
+                # Обрабатываем разное количество колонок в зависимости от запроса
+                if len(row) >= 9:  # Запрос с created_at
+                    user_id, username, level, xp, max_combo, created_at, total_answers, correct_answers, last_activity = row[
+                                                                                                                         :9]
+                else:  # Упрощенный запрос
+                    user_id, username, level, xp, max_combo, total_answers, correct_answers, last_activity = row[:8]
+                    created_at = None
+
+                total_answers = total_answers or 0
+                correct_answers = correct_answers or 0
+                accuracy = round((correct_answers / total_answers * 100) if total_answers and total_answers > 0 else 0, 1)
+
+                users.append({
+                    "user_id": user_id,
+                    "username": username or "Аноним",
+                    "level": level,
+                    "xp": xp,
+                    "max_combo": max_combo,
+                    "created_at": created_at,
+                    "total_answers": total_answers,
+                    "correct_answers": correct_answers,
+                    "last_activity": last_activity,
+                    "accuracy": accuracy
+                })
+            return users
+
+    async def browse_users(self, order: str = "xp", after: Optional[Tuple[Any, int]] = None,
+                           before: Optional[Tuple[Any, int]] = None,
+                           limit: int = SEARCH_PAGE_SIZE) -> Dict[str, Any]:
+        """Страница списка пользователей для админ-панели (keyset-пагинация).
+
+        order - ключ из USER_BROWSE_ORDERS; строки идут по убыванию ключа, при
+        равенстве - по убыванию user_id. after - позиция (ключ, user_id) последней
+        строки предыдущей страницы, before - первой строки следующей (листание
+        назад). Любая страница - один поиск по составному индексу (миграция 13),
+        без OFFSET и подсчета всех строк. Возвращает {"users", "has_prev",
+        "has_next", "first", "last"}; first/last - позиции крайних строк для курсоров.
+        """
+        if order not in USER_BROWSE_ORDERS:
+            raise ValueError(f"Неизвестная сортировка: {order}")
+        key, source = USER_BROWSE_ORDERS[order]
+        id_column = "s.user_id" if order == "activity" else "u.user_id"
+
+        # Отдельное условие на ключ: по выражению SQLite ищет в индексе только так
+        if before is not None:
+            where = f"WHERE {key} >= ? AND ({key}, {id_column}) > (?, ?)"
+            params, direction = [before[0], *before], "ASC"
+        elif after is not None:
+            where = f"WHERE {key} <= ? AND ({key}, {id_column}) < (?, ?)"
+            params, direction = [after[0], *after], "DESC"
+        else:
+            where, params, direction = "", [], "DESC"
+
+        async with self._reading() as conn:
+            async with conn.execute(f'''
+                SELECT u.user_id, u.username, u.level, u.xp, u.created_at, s.last_activity, {key}
+                FROM {source}
+                {where}
+                ORDER BY {key} {direction}, {id_column} {direction}
+                LIMIT ?
+            ''', (*params, limit + 1)) as cursor:
                 rows = await cursor.fetchall()
 
-        users = []
-        for row in rows:
-            # Обрабатываем разное количество колонок в зависимости от запроса
-            if len(row) >= 9:  # Запрос с created_at
-                user_id, username, level, xp, max_combo, created_at, total_answers, correct_answers, last_activity = row[
-                                                                                                                     :9]
-            else:  # Упрощенный запрос
-                user_id, username, level, xp, max_combo, total_answers, correct_answers, last_activity = row[:8]
-                created_at = None
-
-            total_answers = total_answers or 0
-            correct_answers = correct_answers or 0
-            accuracy = round((correct_answers / total_answers * 100) if total_answers and total_answers > 0 else 0, 1)
-
-            users.append({
+        more = len(rows) > limit
+        rows = rows[:limit]
+        if before is not None:
+            rows.reverse()
+            has_prev, has_next = more, True
+        else:
+            has_prev, has_next = after is not None, more
+
+        users = [
+            {
                 "user_id": user_id,
                 "username": username or "Аноним",
                 "level": level,
                 "xp": xp,
-                "max_combo": max_combo,
                 "created_at": created_at,
-                "total_answers": total_answers,
-                "correct_answers": correct_answers,
                 "last_activity": last_activity,
-                "accuracy": accuracy
-            })
-        return users
+            }
+            for user_id, username, level, xp, created_at, last_activity, _ in rows
+        ]
+        return {
+            "users": users,
+            "has_prev": has_prev and bool(rows),
+            "has_next": has_next and bool(rows),
+            "first": (rows[0][-1], rows[0][0]) if rows else None,
+            "last": (rows[-1][-1], rows[-1][0]) if rows else None,
+        }
 
     async def get_user_detailed_stats(self, user_id: int) -> Dict[str, Any]:
         """Получает детальную статистику пользователя для админ-панели"""
-        await self._ensure_connected()
+        async with self._reading() as conn:
+            try:
+                # Пробуем запрос с created_at
+                async with conn.execute('''
+                    SELECT u.user_id, u.username, u.level, u.xp, u.max_combo, u.created_at,
+                           us.total_answers, us.correct_answers, us.total_combo, 
+                           us.perfect_quizzes, us.categories_completed, us.last_activity,
+                           (SELECT COUNT(*) FROM achievements a WHERE a.user_id = u.user_id) as achievements_count,
+                           dr.streak_count, dr.total_rewards, dr.last_reward_date,
+                           ds.total_duels, ds.wins, ds.losses
+                    FROM users u
+                    LEFT JOIN user_stats us ON u.user_id = us.user_id
+                    LEFT JOIN daily_rewards dr ON u.user_id = dr.user_id
+                    LEFT JOIN duel_stats ds ON u.user_id = ds.user_id
+                    WHERE u.user_id = ?
+                ''', (user_id,)) as cursor:
+                    row = await cursor.fetchone()
+            except Exception as e:
+                # Если ошибка с created_at, используем упрощенный запрос
+                logger.warning(f"Использую упрощенный запрос детальной статистики: {e}")
+                async with conn.execute('''
+                    SELECT u.user_id, u.username, u.level, u.xp, u.max_combo,
+                           us.total_answers, us.correct_answers, us.total_combo, 
+                           us.perfect_quizzes, us.categories_completed, us.last_activity,
+                           (SELECT COUNT(*) FROM achievements a WHERE a.user_id = u.user_id) as achievements_count,
+                           dr.streak_count, dr.total_rewards, dr.last_reward_date,
+                           ds.total_duels, ds.wins, ds.losses
+                    FROM users u
+                    LEFT JOIN user_stats us ON u.user_id = us.user_id
+                    LEFT JOIN daily_rewards dr ON u.user_id = dr.user_id
+                    LEFT JOIN duel_stats ds ON u.user_id = ds.user_id
+                    WHERE u.user_id = ?
+                ''', (user_id,)) as cursor:
+                    row = await cursor.fetchone()
+
+            if row:
+                # Обрабатываем разное количество колонок в зависимости от запроса
+                if len(row) >= 19:  # Запрос с created_at
+                    user_id, username, level, xp, max_combo, created_at, total_answers, correct_answers, total_combo, perfect_quizzes, categories_completed, last_activity, achievements_count, streak_count, total_rewards, last_reward_date, total_duels, wins, losses = row[
+                                                                                                                                                                                                                                                                           :19]
+                else:  # Упрощенный запрос
+                    user_id, username, level, xp, max_combo, total_answers, correct_answers, total_combo, perfect_quizzes, categories_completed, last_activity, achievements_count, streak_count, total_rewards, last_reward_date, total_duels, wins, losses = row[
+                                                                                                                                                                                                                                                               :18]
+                    created_at = "Неизвестно"
+
+                total_answers = total_answers or 0
+                correct_answers = correct_answers or 0
+                accuracy = round((correct_answers / total_answers * 100) if total_answers > 0 else 0, 1)
+
+                total_duels = total_duels or 0
+                duel_win_rate = round((wins / total_duels * 100) if total_duels > 0 else 0, 1)
+
+                return {
+                    "user_id": user_id,
+                    "username": username or "Аноним",
+                    "level": level,
+                    "xp": xp,
+                    "max_combo": max_combo,
+                    "created_at": created_at,
+                    "total_answers": total_answers,
+                    "correct_answers": correct_answers,
+                    "total_combo": total_combo or 0,
+                    "perfect_quizzes": perfect_quizzes or 0,
+                    "categories_completed": categories_completed or 0,
+                    "last_activity": last_activity,
+                    "achievements_count": achievements_count or 0,
+                    "daily_streak": streak_count or 0,
+                    "total_rewards": total_rewards or 0,
+                    "last_reward_date": last_reward_date,
+                    "total_duels": total_duels,
+                    "duel_wins": wins or 0,
+                    "duel_losses": losses or 0,
+                    "duel_win_rate": duel_win_rate,
+                    "accuracy": accuracy
+                }
+
+            return {}
 
-        try:
-            # Пробуем запрос с created_at
-            async with self.conn.execute('''
-                SELECT u.user_id, u.username, u.level, u.xp, u.max_combo, u.created_at,
-                       us.total_answers, us.correct_answers, us.total_combo, 
-                       us.perfect_quizzes, us.categories_completed, us.last_activity,
-                       (SELECT COUNT(*) FROM achievements a WHERE a.user_id = u.user_id) as achievements_count,
-                       dr.streak_count, dr.total_rewards, dr.last_reward_date,
-                       ds.total_duels, ds.wins, ds.losses
-                FROM users u
-                LEFT JOIN user_stats us ON u.user_id = us.user_id
-                LEFT JOIN daily_rewards dr ON u.user_id = dr.user_id
-                LEFT JOIN duel_stats ds ON u.user_id = ds.user_id
-                WHERE u.user_id = ?
-            ''', (user_id,)) as cursor:
-                row = await cursor.fetchone()
-        except Exception as e:
-            # Если ошибка с created_at, используем упрощенный запрос
-            logger.warning(f"Использую упрощенный запрос детальной статистики: {e}")
-            async with self.conn.execute('''
-                SELECT u.user_id, u.username, u.level, u.xp, u.max_combo,
-                       us.total_answers, us.correct_answers, us.total_combo, 
-                       us.perfect_quizzes, us.categories_completed, us.last_activity,
-                       (SELECT COUNT(*) FROM achievements a WHERE a.user_id = u.user_id) as achievements_count,
-                       dr.streak_count, dr.total_rewards, dr.last_reward_date,
-                       ds.total_duels, ds.wins, ds.losses
-                FROM users u
-                LEFT JOIN user_stats us ON u.user_id = us.user_id
-                LEFT JOIN daily_rewards dr ON u.user_id = dr.user_id
-                LEFT JOIN duel_stats ds ON u.user_id = ds.user_id
-                WHERE u.user_id = ?
-            ''', (user_id,)) as cursor:
+    async def get_system_stats(self) -> Dict[str, Any]:
+        """Возвращает системную статистику для админ-панели.
+
+        Все счетчики считаются одним запросом: активные и новые пользователи -
+        поиском по диапазону в покрывающих индексах (миграция 9), суммы ответов -
+        одним проходом по индексу без чтения строк user_stats. На больших базах
+        запрос все равно не мгновенный - админка берет готовый снимок из system_stats.
+        """
+        now = datetime.now()
+        today = now.date()
+        params = {
+            "today": str(today),
+            "tomorrow": str(today + timedelta(days=1)),
+            **{f"since_{days}": (now - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+               for days in (1, 7, 30)},
+        }
+        async with self._reading() as conn:
+            async with conn.execute('''
+                SELECT
+                    (SELECT COUNT(*) FROM users),
+                    (SELECT COUNT(*) FROM users WHERE created_at >= :today AND created_at < :tomorrow),
+                    (SELECT COUNT(*) FROM user_stats WHERE last_activity >= :since_1),
+                    (SELECT COUNT(*) FROM user_stats WHERE last_activity >= :since_7),
+                    (SELECT COUNT(*) FROM user_stats WHERE last_activity >= :since_30),
+                    s.answers, s.correct,
+                    (SELECT COUNT(*) FROM achievements),
+                    r.claimed_today, r.rewards_today, d.duels, d.wins
+                FROM (SELECT COALESCE(SUM(total_answers), 0) AS answers,
+                             COALESCE(SUM(correct_answers), 0) AS correct
+                      FROM user_stats INDEXED BY idx_user_stats_activity) s,
+                     (SELECT COUNT(*) AS claimed_today, COALESCE(SUM(total_rewards), 0) AS rewards_today
+                      FROM daily_rewards WHERE last_reward_date = :today) r,
+                     (SELECT COALESCE(SUM(total_duels), 0) AS duels, COALESCE(SUM(wins), 0) AS wins
+                      FROM duel_stats) d
+            ''', params) as cursor:
                 row = await cursor.fetchone()
 
-        if row:
-            # Обрабатываем разное количество колонок в зависимости от запроса
-            if len(row) >= 19:  # Запрос с created_at
-                user_id, username, level, xp, max_combo, created_at, total_answers, correct_answers, total_combo, perfect_quizzes, categories_completed, last_activity, achievements_count, streak_count, total_rewards, last_reward_date, total_duels, wins, losses = row[
-                                                                                                                                                                                                                                                                       :19]
-            else:  # Упрощенный запрос
-                user_id, username, level, xp, max_combo, total_answers, correct_answers, total_combo, perfect_quizzes, categories_completed, last_activity, achievements_count, streak_count, total_rewards, last_reward_date, total_duels, wins, losses = row[
-                                                                                                                                                                                                                                                           :18]
-                created_at = "Неизвестно"
-
-            total_answers = total_answers or 0
-            correct_answers = correct_answers or 0
-            accuracy = round((correct_answers / total_answers * 100) if total_answers > 0 else 0, 1)
-
-            total_duels = total_duels or 0
-            duel_win_rate = round((wins / total_duels * 100) if total_duels > 0 else 0, 1)
+        stats = dict(zip((
+            "total_users", "new_users_today",
+            "active_today", "active_week", "active_month", "total_answers", "total_correct_answers",
+            "total_achievements_unlocked", "daily_rewards_today", "total_rewards_claimed",
+            "total_duels_played", "total_duel_wins"
+        ), row))
 
-            return {
+        # Топ 5 пользователей (из таблицы лидеров в памяти)
+        stats["top_users"] = await self.get_top_users(5)
+
+        return stats
+
+    async def search_users(self, query: str, offset: int = 0,
+                           limit: int = SEARCH_PAGE_SIZE) -> Dict[str, Any]:
+        """Поиск пользователей для админ-панели.
+
+        1. Число - точное совпадение user_id (первичный ключ).
+        2. @username - точное совпадение имени без учета регистра (idx_users_username).
+        3. Иначе (и если точных совпадений нет) - подстрока имени: от 3 символов
+           по триграммному индексу users_search, короче - по началу имени.
+        Совпадения по подстроке ранжируются: имя целиком, начало имени, затем
+        короткие имена и больше XP. Рассматривается не больше SEARCH_MAX_RESULTS
+        совпадений. Возвращает {"users": страница [offset, offset + limit),
+        "total": всего найдено, "capped": совпадений больше SEARCH_MAX_RESULTS}.
+        """
+        query = query.strip()
+        text = query[1:] if query.startswith("@") else query
+        columns = "user_id, username, level, xp, created_at"
+
+        async with self._reading() as conn:
+            rows: List[Tuple] = []
+            if query.isdigit():
+                async with conn.execute(f"SELECT {columns} FROM users WHERE user_id = ?", (int(query),)) as cursor:
+                    rows = await cursor.fetchall()
+            elif query.startswith("@") and text:
+                async with conn.execute(
+                        f"SELECT {columns} FROM users WHERE username = ? COLLATE NOCASE LIMIT ?",
+                        (text, SEARCH_MAX_RESULTS + 1)
+                ) as cursor:
+                    rows = await cursor.fetchall()
+
+            if not rows and text:
+                if len(text) < 3:
+                    # Триграммам нужно 3 символа: ищем по началу имени (регистр - только для латиницы)
+                    sql = (f"SELECT {columns} FROM users "
+                           "WHERE username >= :q COLLATE NOCASE AND username < :q || char(1114111) COLLATE NOCASE "
+                           "LIMIT :cap")
+                elif await self._has_table(conn, "users_search"):
+                    sql = (f"SELECT {columns} FROM users WHERE user_id IN ("
+                           "SELECT rowid FROM users_search WHERE users_search MATCH :match LIMIT :cap)")
+                else:
+                    sql = f"SELECT {columns} FROM users WHERE username LIKE '%' || :q || '%' LIMIT :cap"
+                params = {"q": text, "match": '"' + text.replace('"', '""') + '"', "cap": SEARCH_MAX_RESULTS + 1}
+                async with conn.execute(sql, params) as cursor:
+                    rows = await cursor.fetchall()
+
+        capped = len(rows) > SEARCH_MAX_RESULTS
+        needle = text.casefold()
+
+        def relevance(row: Tuple) -> Tuple:
+            name = (row[1] or "").casefold()
+            return name != needle, not name.startswith(needle), len(name), -(row[3] or 0), row[0]
+
+        rows = sorted(rows[:SEARCH_MAX_RESULTS], key=relevance)
+        users = [
+            {
                 "user_id": user_id,
                 "username": username or "Аноним",
                 "level": level,
                 "xp": xp,
-                "max_combo": max_combo,
                 "created_at": created_at,
-                "total_answers": total_answers,
-                "correct_answers": correct_answers,
-                "total_combo": total_combo or 0,
-                "perfect_quizzes": perfect_quizzes or 0,
-                "categories_completed": categories_completed or 0,
-                "last_activity": last_activity,
-                "achievements_count": achievements_count or 0,
-                "daily_streak": streak_count or 0,
-                "total_rewards": total_rewards or 0,
-                "last_reward_date": last_reward_date,
-                "total_duels": total_duels,
-                "duel_wins": wins or 0,
-                "duel_losses": losses or 0,
-                "duel_win_rate": duel_win_rate,
-                "accuracy": accuracy
             }
+            for user_id, username, level, xp, created_at in rows[offset:offset + limit]
+        ]
+        return {"users": users, "total": len(rows), "capped": capped}
 
-        return {}
-
-    async def get_system_stats(self) -> Dict[str, Any]:
-        """Возвращает системную статистику для админ-панели"""
-        await self._ensure_connected()
+    @staticmethod
+    async def _has_table(conn: aiosqlite.Connection, name: str) -> bool:
+        async with conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (name,)) as cursor:
+            return await cursor.fetchone() is not None
 
-        stats = {}
+    async def delete_user(self, user_id: int) -> bool:
+        """Удаляет пользователя и все его данные (админская функция)"""
+        try:
+            async with self._writing() as conn:
+                # Удаляем все связанные данные пользователя
+                self.counters.discard(user_id)
+                await conn.execute("DELETE FROM achievements WHERE user_id = ?", (user_id,))
+                await conn.execute("DELETE FROM user_stats WHERE user_id = ?", (user_id,))
+                await conn.execute("DELETE FROM daily_rewards WHERE user_id = ?", (user_id,))
+                await conn.execute("DELETE FROM category_stats WHERE user_id = ?", (user_id,))
+                await conn.execute("DELETE FROM duel_stats WHERE user_id = ?", (user_id,))
+                await conn.execute("DELETE FROM duel_participants WHERE user_id = ?", (user_id,))
+                self.asked_questions.discard(user_id)
+                await conn.execute("DELETE FROM user_question_history WHERE user_id = ?", (user_id,))
+                self.answer_events.discard(user_id)
+                for partition in await self._answer_event_partitions(conn):
+                    await conn.execute(f"DELETE FROM {partition} WHERE user_id = ?", (user_id,))
+                old_xp = await self._current_xp(conn, user_id)
+                await conn.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
+
+            if old_xp is not None:
+                self._on_commit(partial(self.leaderboard.remove_user, user_id, old_xp))
+            return True
+        except Exception as e:
+            logger.error("Error deleting user %d: %s", user_id, e)
+            return False
 
-        # Общее количество пользователей
-        async with self.conn.execute("SELECT COUNT(*) FROM users") as cursor:
-            stats["total_users"] = (await cursor.fetchone())[0]
+    # ---------------- БАНК ВОПРОСОВ ----------------
 
-        # Новые пользователи за сегодня
-        today = datetime.now().date()
-        async with self.conn.execute(
-                "SELECT COUNT(*) FROM users WHERE DATE(created_at) = ?",
-                (today,)
-        ) as cursor:
-            stats["new_users_today"] = (await cursor.fetchone())[0]
+    async def get_question_bank(self) -> Dict[str, Any]:
+        """Весь банк вопросов для индекса в памяти (question_bank.load).
 
-        # Активные пользователи за разные периоды
-        stats["active_today"] = await self.get_active_users_count(1)
-        stats["active_week"] = await self.get_active_users_count(7)
-        stats["active_month"] = await self.get_active_users_count(30)
+        Возвращает {"categories": {category_id: name}, "questions": [...]}; вопросы
+        по возрастанию question_id, включая удаленные (is_active = 0) - их номера
+        остаются в журнале ответов.
+        """
+        async with self._reading() as conn:
+            async with conn.execute("SELECT category_id, name FROM question_categories ORDER BY category_id") as cursor:
+                categories = dict(await cursor.fetchall())
+            async with conn.execute('''
+                SELECT question_id, category_id, difficulty, question, options, answer_index, is_active
+                FROM questions
+                ORDER BY question_id
+            ''') as cursor:
+                rows = await cursor.fetchall()
 
-        # Общая статистика ответов
-        async with self.conn.execute('''
-            SELECT SUM(total_answers), SUM(correct_answers) 
-            FROM user_stats
-        ''') as cursor:
-            result = await cursor.fetchone()
-            stats["total_answers"] = result[0] or 0
-            stats["total_correct_answers"] = result[1] or 0
-
-        # Статистика достижений
-        async with self.conn.execute("SELECT COUNT(*) FROM achievements") as cursor:
-            stats["total_achievements_unlocked"] = (await cursor.fetchone())[0]
-
-        # Статистика ежедневных наград
-        async with self.conn.execute('''
-            SELECT SUM(streak_count), SUM(total_rewards), COUNT(*) 
-            FROM daily_rewards 
-            WHERE last_reward_date = ?
-        ''', (today,)) as cursor:
-            result = await cursor.fetchone()
-            stats["daily_rewards_today"] = result[2] or 0
-            stats["total_rewards_claimed"] = result[1] or 0
-
-        # Статистика дуэлей
-        async with self.conn.execute('''
-            SELECT COUNT(*), SUM(total_duels), SUM(wins) 
-            FROM duel_stats
-        ''') as cursor:
-            result = await cursor.fetchone()
-            stats["total_duels_played"] = result[1] or 0
-            stats["total_duel_wins"] = result[2] or 0
-
-        # Топ 5 пользователей
-        stats["top_users"] = await self.get_top_users(5)
+        columns = ("question_id", "category_id", "difficulty", "question", "options", "answer_index", "is_active")
+        questions = []
+        for row in rows:
+            question = dict(zip(columns, row))
+            question["options"] = json.loads(question["options"])
+            questions.append(question)
+        return {"categories": categories, "questions": questions}
+
+    async def add_question(self, category_id: int, difficulty: str, question: str, options: List[str],
+                           answer_index: int) -> int:
+        """Добавляет вопрос в банк и возвращает его question_id"""
+        async with self._writing() as conn:
+            async with conn.execute('''
+                INSERT INTO questions (category_id, difficulty, question, options, answer_index)
+                VALUES (?, ?, ?, ?, ?)
+                RETURNING question_id
+            ''', (category_id, difficulty, question, json.dumps(options, ensure_ascii=False), answer_index)) as cursor:
+                row = await cursor.fetchone()
 
-        return stats
+        return row[0]
 
-    async def search_users(self, query: str) -> List[Dict[str, Any]]:
-        """Поиск пользователей по username или ID"""
-        await self._ensure_connected()
+    async def delete_question(self, question_id: int) -> bool:
+        """Убирает вопрос из банка (is_active = 0, номер не переиспользуется)"""
+        async with self._writing() as conn:
+            cursor = await conn.execute(
+                "UPDATE questions SET is_active = 0 WHERE question_id = ? AND is_active = 1", (question_id,)
+            )
+            return cursor.rowcount > 0
 
-        search_term = f"%{query}%"
+    async def get_questions_stats(self) -> Dict[str, Any]:
+        """Статистика банка вопросов: всего, по категориям и сложности.
 
-        try:
-            # Пробуем запрос с created_at
-            async with self.conn.execute('''
-                SELECT u.user_id, u.username, u.level, u.xp, u.created_at
-                FROM users u
-                WHERE u.username LIKE ? OR CAST(u.user_id AS TEXT) LIKE ?
-                ORDER BY u.xp DESC
-                LIMIT 20
-            ''', (search_term, search_term)) as cursor:
-                rows = await cursor.fetchall()
-        except Exception as e:
-            # Если ошибка с created_at, используем упрощенный запрос
-            logger.warning(f"Использую упрощенный запрос поиска: {e}")
-            async with self.conn.execute('''
-                SELECT u.user_id, u.username, u.level, u.xp
-                FROM users u
-                WHERE u.username LIKE ? OR CAST(u.user_id AS TEXT) LIKE ?
-                ORDER BY u.xp DESC
-                LIMIT 20
-            ''', (search_term, search_term)) as cursor:
+        average_difficulty - сложность, ближайшая к среднему уровню
+        (легкий = 1, средний = 2, сложный = 3).
+        """
+        async with self._reading() as conn:
+            async with conn.execute('''
+                SELECT c.name, q.difficulty, COUNT(*)
+                FROM questions q JOIN question_categories c ON c.category_id = q.category_id
+                WHERE q.is_active = 1
+                GROUP BY q.category_id, q.difficulty
+            ''') as cursor:
                 rows = await cursor.fetchall()
 
-        users = []
-        for row in rows:
-            # Обрабатываем разное количество колонок в зависимости от запроса
-            if len(row) >= 5:  # Запрос с created_at
-                user_id, username, level, xp, created_at = row[:5]
-            else:  # Упрощенный запрос
-                user_id, username, level, xp = row[:4]
-                created_at = "Неизвестно"
-
-            users.append({
-                "user_id": user_id,
-                "username": username or "Аноним",
-                "level": level,
-                "xp": xp,
-                "created_at": created_at
-            })
+        by_category: Dict[str, int] = {}
+        by_difficulty: Dict[str, int] = {}
+        for category, difficulty, count in rows:
+            by_category[category] = by_category.get(category, 0) + count
+            by_difficulty[difficulty] = by_difficulty.get(difficulty, 0) + count
 
-        return users
+        levels = ("легкий", "средний", "сложный")
+        ranked = sum(by_difficulty.get(level, 0) for level in levels)
+        average_difficulty = "N/A"
+        if ranked:
+            mean = sum(i * by_difficulty.get(level, 0) for i, level in enumerate(levels)) / ranked
+            average_difficulty = levels[round(mean)]
 
-    async def delete_user(self, user_id: int) -> bool:
-        """Удаляет пользователя и все его данные (админская функция)"""
-        await self._ensure_connected()
+        return {
+            "total_questions": sum(by_category.values()),
+            "categories_count": len(by_category),
+            "average_difficulty": average_difficulty,
+            "by_category": by_category,
+            "by_difficulty": by_difficulty,
+        }
 
-        try:
-            # Удаляем все связанные данные пользователя
-            await self.conn.execute("DELETE FROM achievements WHERE user_id = ?", (user_id,))
-            await self.conn.execute("DELETE FROM user_stats WHERE user_id = ?", (user_id,))
-            await self.conn.execute("DELETE FROM daily_rewards WHERE user_id = ?", (user_id,))
-            await self.conn.execute("DELETE FROM category_stats WHERE user_id = ?", (user_id,))
-            await self.conn.execute("DELETE FROM duel_stats WHERE user_id = ?", (user_id,))
-            await self.conn.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
-
-            await self.conn.commit()
-            return True
-        except Exception as e:
-            logger.error("Error deleting user %d: %s", user_id, e)
-            return False
+    # ---------------- ДНЕВНЫЕ АГРЕГАТЫ (АНАЛИТИКА) ----------------
 
-    async def get_questions_stats(self) -> Dict[str, Any]:
-        """Статистика по вопросам (если вопросы хранятся в БД)"""
-        await self._ensure_connected()
+    async def _rollup_loop(self):
+        """Периодически досчитывает дневные агрегаты."""
+        while True:
+            try:
+                await self.update_daily_rollups()
+            except Exception as e:
+                logger.error("❌ Ошибка пересчета дневных агрегатов: %s", e)
+            await asyncio.sleep(ROLLUP_INTERVAL)
+
+    @staticmethod
+    async def _rollup_day(conn: aiosqlite.Connection, day: date):
+        """Пересчитывает агрегаты одного дня (локальная дата) по базовым таблицам.
+
+        Все выборки - поиск по диапазону в индексах: users.created_at,
+        duels.created_at, daily_rewards.last_reward_date и индекс разделов
+        журнала ответов по времени.
+        """
+        start = int(datetime.combine(day, datetime.min.time()).timestamp())
+        end = int(datetime.combine(day + timedelta(days=1), datetime.min.time()).timestamp())
+        params = {
+            "day": str(day),
+            "start": start,
+            "end": end,
+            # created_at хранится как CURRENT_TIMESTAMP - в UTC
+            "start_utc": datetime.fromtimestamp(start, timezone.utc).strftime('%Y-%m-%d %H:%M:%S'),
+            "end_utc": datetime.fromtimestamp(end, timezone.utc).strftime('%Y-%m-%d %H:%M:%S'),
+            "session_gap": ROLLUP_SESSION_GAP,
+        }
+
+        async with conn.execute('''
+            SELECT
+                (SELECT COUNT(*) FROM users WHERE created_at >= :start_utc AND created_at < :end_utc),
+                (SELECT COUNT(*) FROM duels WHERE created_at >= :start_utc AND created_at < :end_utc),
+                (SELECT COUNT(*) FROM daily_rewards WHERE last_reward_date = :day)
+        ''', params) as cursor:
+            new_users, duels, rewards = await cursor.fetchone()
+
+        # Сессия - ответы пользователя с паузами не больше ROLLUP_SESSION_GAP
+        async with conn.execute('''
+            WITH day_events AS (
+                SELECT user_id, correct,
+                       ts - LAG(ts) OVER (PARTITION BY user_id ORDER BY ts) AS gap
+                FROM answer_events
+                WHERE ts >= :start AND ts < :end
+            )
+            SELECT COUNT(DISTINCT user_id), COUNT(*), COALESCE(SUM(correct), 0),
+                   COALESCE(SUM(gap IS NULL OR gap > :session_gap), 0),
+                   COALESCE(SUM(CASE WHEN gap <= :session_gap THEN gap ELSE 0 END), 0)
+            FROM day_events
+        ''', params) as cursor:
+            dau, answers, correct, sessions, session_seconds = await cursor.fetchone()
+
+        # daily_rewards хранит только последнюю дату награды: за прошедший день
+        # часть наград уже перезаписана, поэтому счетчик наград только растет
+        await conn.execute('''
+            INSERT INTO daily_rollups (day, new_users, dau, answers, correct, sessions, session_seconds,
+                                       duels, rewards, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(day) DO UPDATE SET
+                new_users = excluded.new_users,
+                dau = excluded.dau,
+                answers = excluded.answers,
+                correct = excluded.correct,
+                sessions = excluded.sessions,
+                session_seconds = excluded.session_seconds,
+                duels = excluded.duels,
+                rewards = MAX(rewards, excluded.rewards),
+                updated_at = excluded.updated_at
+        ''', (str(day), new_users, dau, answers, correct, sessions, session_seconds, duels, rewards))
+
+        await conn.execute("DELETE FROM daily_question_rollups WHERE day = ?", (str(day),))
+        await conn.execute('''
+            INSERT INTO daily_question_rollups (day, question_id, answers, correct)
+            SELECT :day, question_id, COUNT(*), SUM(correct)
+            FROM answer_events
+            WHERE ts >= :start AND ts < :end AND question_id > 0
+            GROUP BY question_id
+        ''', params)
+
+    async def update_daily_rollups(self) -> int:
+        """Досчитывает дневные агрегаты daily_rollups и daily_question_rollups.
+
+        Пересчитывается только последний посчитанный день (он мог быть неполным)
+        и дни после него до сегодняшнего; первый запуск заполняет
+        ROLLUP_BACKFILL_DAYS дней истории. Возвращает количество пересчитанных дней.
+        """
+        await self.flush_answer_events()  # Агрегаты включают ответы из буфера
 
-        # TODO: Реализовать, когда вопросы будут в БД
+        today = datetime.now().date()
+        days = 0
+        async with self._writing() as conn:
+            async with conn.execute("SELECT MAX(day) FROM daily_rollups") as cursor:
+                last_day = (await cursor.fetchone())[0]
+            day = date.fromisoformat(last_day) if last_day else today - timedelta(days=ROLLUP_BACKFILL_DAYS - 1)
+            while day <= today:
+                await self._rollup_day(conn, day)
+                day += timedelta(days=1)
+                days += 1
+
+        logger.debug("📊 Пересчитаны дневные агрегаты: %d дн.", days)
+        return days
+
+    async def get_daily_rollups(self, days: int = 30) -> List[Dict[str, Any]]:
+        """Дневные агрегаты за последние days дней, по возрастанию даты (дни без данных пропущены)"""
+        since = str(datetime.now().date() - timedelta(days=days - 1))
+        async with self._reading() as conn:
+            async with conn.execute('''
+                SELECT day, new_users, dau, answers, correct, sessions, session_seconds, duels, rewards
+                FROM daily_rollups
+                WHERE day >= ?
+                ORDER BY day
+            ''', (since,)) as cursor:
+                rows = await cursor.fetchall()
+
+        columns = ("day", "new_users", "dau", "answers", "correct", "sessions", "session_seconds",
+                   "duels", "rewards")
+        return [dict(zip(columns, row)) for row in rows]
+
+    async def get_user_growth(self, days: int = 30) -> Dict[str, int]:
+        """Новые пользователи за сегодня, 7 дней и days дней (по дневным агрегатам)"""
+        rows = await self.get_daily_rollups(days)
+        today = datetime.now().date()
+        week_start = str(today - timedelta(days=6))
         return {
-            "total_questions": 0,
-            "categories_count": 0,
-            "average_difficulty": "N/A"
+            "today": sum(row["new_users"] for row in rows if row["day"] == str(today)),
+            "week": sum(row["new_users"] for row in rows if row["day"] >= week_start),
+            "month": sum(row["new_users"] for row in rows),
         }
 
-    async def get_activity_heatmap(self, days: int = 30) -> Dict[str, int]:
-        """Возвращает тепловую карту активности за последние N дней"""
-        await self._ensure_connected()
+    async def get_activity_stats(self, days: int = 7) -> Dict[str, Any]:
+        """Средняя дневная активность за последние days дней (по дневным агрегатам).
 
-        cutoff_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
+        avg_session - средняя длина сессии в секундах, accuracy - процент
+        правильных ответов; rewards_today - награды за сегодня.
+        """
+        rows = await self.get_daily_rollups(days)
+        answers = sum(row["answers"] for row in rows)
+        correct = sum(row["correct"] for row in rows)
+        sessions = sum(row["sessions"] for row in rows)
+        today = str(datetime.now().date())
+        return {
+            "dau": round(sum(row["dau"] for row in rows) / days, 1),
+            "answers_per_day": round(answers / days, 1),
+            "accuracy": round(correct / answers * 100, 1) if answers else 0,
+            "avg_session": round(sum(row["session_seconds"] for row in rows) / sessions) if sessions else 0,
+            "duels_per_day": round(sum(row["duels"] for row in rows) / days, 1),
+            "rewards_today": sum(row["rewards"] for row in rows if row["day"] == today),
+        }
 
-        async with self.conn.execute('''
-            SELECT DATE(last_activity), COUNT(*) 
-            FROM user_stats 
-            WHERE last_activity >= ?
-            GROUP BY DATE(last_activity)
-            ORDER BY DATE(last_activity)
-        ''', (cutoff_date,)) as cursor:
-            rows = await cursor.fetchall()
+    async def get_question_difficulty(self, days: int = 30, min_answers: int = 20) -> Dict[str, Any]:
+        """Самый сложный и самый легкий вопрос за days дней по доле правильных ответов.
 
-        heatmap = {}
-        for row in rows:
-            heatmap[row[0]] = row[1]
+        Учитываются вопросы, на которые ответили хотя бы min_answers раз.
+        Возвращает {"hardest", "easiest"} - словари {question_id, answers, accuracy} или None.
+        """
+        since = str(datetime.now().date() - timedelta(days=days - 1))
+        async with self._reading() as conn:
+            async with conn.execute('''
+                SELECT question_id, SUM(answers) AS total, SUM(correct) * 100.0 / SUM(answers) AS accuracy
+                FROM daily_question_rollups
+                WHERE day >= ?
+                GROUP BY question_id
+                HAVING total >= ?
+                ORDER BY accuracy, total DESC
+            ''', (since, min_answers)) as cursor:
+                rows = await cursor.fetchall()
 
-        return heatmap
+        questions = [{"question_id": q, "answers": total, "accuracy": round(accuracy, 1)}
+                     for q, total, accuracy in rows]
+        return {
+            "hardest": questions[0] if questions else None,
+            "easiest": questions[-1] if questions else None,
+        }
+
+    async def get_activity_heatmap(self, days: int = 30) -> Dict[str, int]:
+        """Возвращает тепловую карту активности за последние N дней: дата -> DAU"""
+        return {row["day"]: row["dau"] for row in await self.get_daily_rollups(days)}
 
     async def cleanup_old_data(self, days: int = 30):
         """Очищает устаревшие данные (админская функция)"""
-        await self._ensure_connected()
-
         cutoff_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
 
         try:
-            # Удаляем старые дуэли
-            await self.conn.execute(
-                "DELETE FROM duels WHERE created_at < ?",
-                (cutoff_date,)
-            )
+            async with self._writing() as conn:
+                # Удаляем старые дуэли (участники удаляются каскадом)
+                await conn.execute(
+                    "DELETE FROM duels WHERE created_at < ?",
+                    (cutoff_date,)
+                )
 
-            # Удаляем неактивных пользователей (без статистики и давно не активных)
-            await self.conn.execute('''
-                DELETE FROM users 
-                WHERE user_id NOT IN (SELECT user_id FROM user_stats WHERE last_activity > ?)
-                AND created_at < ?
-            ''', (cutoff_date, cutoff_date))
+                # Удаляем неактивных пользователей (без статистики и давно не активных)
+                await conn.execute('''
+                    DELETE FROM users 
+                    WHERE user_id NOT IN (SELECT user_id FROM user_stats WHERE last_activity > ?)
+                    AND created_at < ?
+                ''', (cutoff_date, cutoff_date))
 
-            await self.conn.commit()
+            self._on_commit(self.invalidate_leaderboard)
             logger.info(f"✅ Очищены данные старше {days} дней")
 
         except Exception as e:
             logger.error(f"❌ Ошибка при очистке данных: {e}")
-            await self.conn.rollback()
 
 
     async def update_user_level(self, user_id: int, new_level: int):
         """Обновляет уровень пользователя"""
-        await self._ensure_connected()
         try:
-            await self.conn.execute(
-                "UPDATE users SET level = ? WHERE user_id = ?",
-                (new_level, user_id)
-            )
-            await self.conn.commit()
+            async with self._writing() as conn:
+                await conn.execute(
+                    "UPDATE users SET level = ? WHERE user_id = ?",
+                    (new_level, user_id)
+                )
+            self._on_commit(partial(self.leaderboard.update_details, user_id, level=new_level))
             logger.info(f"✅ Уровень пользователя {user_id} обновлен на {new_level}")
             return True
         except Exception as e:
@@ -1148,13 +2727,16 @@ class Database:  # ← ТОЛЬКО ОДИН РАЗ!
 
     async def update_user_xp(self, user_id: int, new_xp: int):
         """Обновляет XP пользователя"""
-        await self._ensure_connected()
         try:
-            await self.conn.execute(
-                "UPDATE users SET xp = ? WHERE user_id = ?",
-                (new_xp, user_id)
-            )
-            await self.conn.commit()
+            async with self._writing() as conn:
+                old_xp = await self._current_xp(conn, user_id)
+                async with conn.execute(
+                        "UPDATE users SET xp = ? WHERE user_id = ? RETURNING level",
+                        (new_xp, user_id)
+                ) as cursor:
+                    row = await cursor.fetchone()
+            if row:
+                self._on_commit(partial(self.leaderboard.set_xp, user_id, old_xp, new_xp, row[0]))
             logger.info(f"✅ XP пользователя {user_id} обновлен на {new_xp}")
             return True
         except Exception as e:
@@ -1166,65 +2748,67 @@ class Database:  # ← ТОЛЬКО ОДИН РАЗ!
         Полный сброс прогресса всех пользователей
         Возвращает количество сброшенных пользователей
         """
-        await self._ensure_connected()
-
         try:
-            # Получаем общее количество пользователей до сброса
-            total_users = await self.get_total_users_count()
-
-            # Сбрасываем основные данные пользователей (без last_active)
-            await self.conn.execute('''
-                UPDATE users 
-                SET level = 1, 
-                    xp = 0, 
-                    max_combo = 0
-            ''')
-
-            # Сбрасываем статистику пользователей
-            await self.conn.execute('''
-                UPDATE user_stats 
-                SET total_answers = 0,
-                    correct_answers = 0,
-                    total_combo = 0,
-                    perfect_quizzes = 0,
-                    categories_completed = 0,
-                    last_activity = CURRENT_TIMESTAMP
-            ''')
-
-            # Очищаем достижения
-            await self.conn.execute("DELETE FROM achievements")
-
-            # Сбрасываем ежедневные награды
-            await self.conn.execute('''
-                UPDATE daily_rewards 
-                SET last_reward_date = NULL,
-                    streak_count = 0,
-                    total_rewards = 0
-            ''')
-
-            # Очищаем статистику по категориям
-            await self.conn.execute("DELETE FROM category_stats")
-
-            # Сбрасываем статистику дуэлей
-            await self.conn.execute('''
-                UPDATE duel_stats 
-                SET total_duels = 0,
-                    wins = 0,
-                    losses = 0,
-                    total_score = 0,
-                    average_score = 0,
-                    favorite_format = NULL,
-                    last_duel = NULL
-            ''')
-
-            await self.conn.commit()
-
+            async with self._writing() as conn:
+                # Получаем общее количество пользователей до сброса
+                total_users = await self.get_total_users_count()
+
+                # Сбрасываем основные данные пользователей (без last_active)
+                await conn.execute('''
+                    UPDATE users 
+                    SET level = 1, 
+                        xp = 0, 
+                        max_combo = 0
+                ''')
+
+                # Сбрасываем статистику пользователей
+                await conn.execute('''
+                    UPDATE user_stats 
+                    SET total_answers = 0,
+                        correct_answers = 0,
+                        total_combo = 0,
+                        perfect_quizzes = 0,
+                        categories_completed = 0,
+                        last_activity = CURRENT_TIMESTAMP
+                ''')
+
+                # Очищаем достижения
+                await conn.execute("DELETE FROM achievements")
+
+                # Сбрасываем ежедневные награды
+                await conn.execute('''
+                    UPDATE daily_rewards 
+                    SET last_reward_date = NULL,
+                        streak_count = 0,
+                        total_rewards = 0
+                ''')
+
+                # Очищаем статистику по категориям (и несброшенные счетчики)
+                self.counters.clear()
+                await conn.execute("DELETE FROM category_stats")
+
+                # Очищаем историю заданных вопросов
+                self.asked_questions.clear()
+                await conn.execute("DELETE FROM user_question_history")
+
+                # Сбрасываем статистику дуэлей
+                await conn.execute('''
+                    UPDATE duel_stats 
+                    SET total_duels = 0,
+                        wins = 0,
+                        losses = 0,
+                        total_score = 0,
+                        average_score = 0,
+                        favorite_format = NULL,
+                        last_duel = NULL
+                ''')
+
+            self._on_commit(self.invalidate_leaderboard)
             logger.info(f"✅ Полный сброс системы завершен. Сброшено пользователей: {total_users}")
             return total_users
 
         except Exception as e:
             logger.error(f"❌ Ошибка при полном сбросе системы: {e}")
-            await self.conn.rollback()
             raise
 
 
@@ -1244,27 +2828,3 @@ async def init_db():
 async def close_db():
     """Закрытие соединения с базой данных"""
     await db.close()
-
-async def _migrate_database(self):
-    """Упрощенная миграция базы данных"""
-    try:
-        # Простая миграция без DEFAULT значений
-        migrations = [
-            ('users', 'created_at', 'TEXT'),
-            ('users', 'last_active', 'TEXT'),
-            ('user_stats', 'last_activity', 'TEXT'),
-        ]
-
-        for table, column, definition in migrations:
-            async with self.conn.execute(f"PRAGMA table_info({table})") as cursor:
-                columns = [row[1] for row in await cursor.fetchall()]
-
-            if column not in columns:
-                await self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
-                logger.info(f"✅ Добавлена колонка {column} в таблицу {table}")
-
-        await self.conn.commit()
-
-    except Exception as e:
-        logger.error(f"❌ Ошибка миграции базы данных: {e}")
-        # Не прерываем выполнение при ошибке миграции
\ No newline at end of file
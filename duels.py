@@ -12,7 +12,11 @@ from keyboards import (
     duels_main_keyboard,
     quiz_options
 )
-from questions import get_random_question
+from question_bank import question_bank, question_ref
+from question_sampler import question_sampler
+from db import db
+from broadcast import record_delivery_failure
+from events import SOURCE_DUEL
 
 
 router = Router()
@@ -227,6 +231,7 @@ async def complete_duel_cleanup(duel_id: str):
         del active_duels[duel_id]
     if duel_id in duel_locks:
         del duel_locks[duel_id]
+    question_sampler.discard(duel_id)
 
 
 # ------------------- Основные функции для дуэлей -------------------
@@ -246,6 +251,7 @@ def create_duel_data(duel_id: str, format_type: str, creator_id: int) -> Dict:
         "current_question": None,
         "answered_players": set(),
         "player_answers": {},
+        "player_response_ms": {},  # user_id -> [время ответа в мс, ...]
         "status": "waiting",
         "category": None,
         "questions_asked": 0,
@@ -513,6 +519,12 @@ async def process_player_answer(duel: Dict, user_id: int, answer_index: int, ans
         "timestamp": answer_time,
         "response_time": (answer_time - duel["question_start_time"]).total_seconds()
     }
+    response_ms = int(duel["player_answers"][user_id]["response_time"] * 1000)
+    duel["player_response_ms"].setdefault(user_id, []).append(response_ms)
+
+    # Событие в журнал ответов (пишется в БД пачкой)
+    question_id, category_id = question_ref(question)
+    db.record_answer_event(user_id, question_id, category_id, answer_index, is_correct, response_ms, SOURCE_DUEL)
 
     # ОБНОВЛЕНО: Используем персональную статистику вместо глобальной
     player_stats = get_user_duel_stats(user_id)
@@ -1024,6 +1036,7 @@ async def start_duel(duel_id: str, bot):
             )
         except Exception as e:
             logger.error(f"Не удалось уведомить игрока {user_id}: {e}")
+            await record_delivery_failure(user_id, e)
 
     # Запускаем первый вопрос
     await asyncio.sleep(3)
@@ -1044,8 +1057,9 @@ async def ask_duel_question(duel_id: str, bot):
             await finish_duel(duel_id, bot)
             return
 
-        # Получаем случайный вопрос
-        question = get_random_question(duel["category"])
+        # Следующий вопрос из мешка дуэли (без повторов внутри дуэли)
+        question_id = question_sampler.draw(duel_id, duel["category"] or "random")
+        question = question_bank.get(question_id) if question_id is not None else None
         if not question:
             logger.error(f"Не удалось получить вопрос для категории: {duel['category']}")
             await asyncio.sleep(2)
@@ -1256,6 +1270,24 @@ async def finish_duel(duel_id: str, bot):
             else:
                 player_stats.increment_duels_lost()
 
+        # Сохраняем результат и участников в БД
+        response_ms = {
+            user_id: sum(times) // len(times)
+            for user_id, times in duel["player_response_ms"].items() if times
+        }
+        await db.save_duel_result({
+            "duel_id": duel_id,
+            "format_type": duel["format_type"],
+            "team_a_players": list(duel["teams"]["team_a"]),
+            "team_b_players": list(duel["teams"]["team_b"]),
+            "winner_team": winner,
+            "team_a_score": team_a_score,
+            "team_b_score": team_b_score,
+            "category": duel["category"],
+            "player_scores": duel["player_scores"],
+            "response_ms": response_ms
+        })
+
         # Отправляем результаты всем игрокам
         for user_id in duel["players"]:
             try:
@@ -1299,6 +1331,7 @@ async def finish_duel(duel_id: str, bot):
 
             except Exception as e:
                 logger.error(f"Не удалось отправить результаты игроку {user_id}: {e}")
+                await record_delivery_failure(user_id, e)
 
         # Очищаем данные дуэли
         for user_id in duel["players"]:
@@ -0,0 +1,121 @@
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Deque, Dict, Iterable, List, Tuple
+
+# Источник ответа (answer_events.source)
+SOURCE_SOLO = 0
+SOURCE_DUEL = 1
+
+# Колонки answer_events в порядке вставки (все целочисленные, ts - unix-время в секундах)
+ANSWER_EVENT_COLUMNS = ("user_id", "question_id", "category_id", "chosen", "correct", "latency_ms", "source", "ts")
+
+# Событие ответа - кортеж значений ANSWER_EVENT_COLUMNS
+AnswerEvent = Tuple[int, ...]
+
+# Префикс таблиц-разделов answer_events_ГГГГММДД (дата начала раздела, UTC)
+PARTITION_PREFIX = "answer_events_"
+
+
+class AnswerEventBuffer:
+    """Кольцевой буфер событий ответов до пакетной записи в БД.
+
+    Память ограничена capacity: если БД долго недоступна и буфер заполнен,
+    вытесняются самые старые события (их количество копится в dropped).
+    """
+
+    def __init__(self, capacity: int):
+        self._events: Deque[AnswerEvent] = deque(maxlen=capacity)
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def append(self, event: AnswerEvent):
+        """Добавляет событие (O(1), без обращения к БД)."""
+        if len(self._events) == self._events.maxlen:
+            self.dropped += 1
+        self._events.append(event)
+
+    def drain(self) -> List[AnswerEvent]:
+        """Забирает все накопленные события в порядке поступления."""
+        events = list(self._events)
+        self._events.clear()
+        return events
+
+    def restore(self, events: List[AnswerEvent]):
+        """Возвращает события в начало буфера после неудачной записи.
+
+        Новые события, пришедшие за время записи, не вытесняются: если места
+        не хватает, теряются самые старые из возвращаемых.
+        """
+        room = self._events.maxlen - len(self._events)
+        kept = events[len(events) - room:] if room < len(events) else events
+        self.dropped += len(events) - len(kept)
+        self._events.extendleft(reversed(kept))
+
+    def discard(self, user_id: int):
+        """Забывает события пользователя (удаление пользователя)."""
+        kept = [event for event in self._events if event[0] != user_id]
+        self._events.clear()
+        self._events.extend(kept)
+
+    def clear(self):
+        self._events.clear()
+
+
+def partition_start(ts: int, days: int) -> int:
+    """Начало раздела длиной days суток, в который попадает момент ts."""
+    span = days * 86400
+    return ts - ts % span
+
+
+def partition_name(start: int) -> str:
+    return PARTITION_PREFIX + datetime.fromtimestamp(start, timezone.utc).strftime("%Y%m%d")
+
+
+def group_by_partition(events: Iterable[AnswerEvent], days: int) -> Dict[int, List[AnswerEvent]]:
+    """Раскладывает события по началу их раздела."""
+    groups: Dict[int, List[AnswerEvent]] = {}
+    for event in events:
+        groups.setdefault(partition_start(event[-1], days), []).append(event)
+    return groups
+
+
+def partition_ddl(name: str) -> List[str]:
+    """SQL создания таблицы-раздела и ее индекса"""
+    return [
+        f'''CREATE TABLE IF NOT EXISTS {name} (
+            user_id INTEGER NOT NULL,
+            question_id INTEGER NOT NULL,
+            category_id INTEGER NOT NULL,
+            chosen INTEGER NOT NULL,
+            correct INTEGER NOT NULL,
+            latency_ms INTEGER,
+            source INTEGER NOT NULL,
+            ts INTEGER NOT NULL
+        )''',
+        f"CREATE INDEX IF NOT EXISTS idx_{name}_user ON {name} (user_id, ts)",
+        *partition_ts_index_ddl(name),
+    ]
+
+
+def partition_ts_index_ddl(name: str) -> List[str]:
+    """Покрывающий индекс раздела по времени - для дневных агрегатов (db.update_daily_rollups)"""
+    return [f"CREATE INDEX IF NOT EXISTS idx_{name}_ts ON {name} (ts, user_id, correct, question_id)"]
+
+
+def view_sql(names: Iterable[str]) -> str:
+    """SQL представления answer_events - объединения всех разделов.
+
+    Без разделов представление пустое, но с теми же колонками.
+    """
+    columns = ", ".join(ANSWER_EVENT_COLUMNS)
+    selects = [f"SELECT {columns} FROM {name}" for name in sorted(names)]
+    if not selects:
+        selects = ["SELECT " + ", ".join(f"0 AS {column}" for column in ANSWER_EVENT_COLUMNS) + " LIMIT 0"]
+    return "CREATE VIEW answer_events AS " + " UNION ALL ".join(selects)
+
+
+def now_ts() -> int:
+    return int(time.time())
@@ -1,13 +1,14 @@
-import random
 import asyncio
 import logging
+import time
+from functools import partial
 from aiogram import Router, types, F
 from aiogram.filters import Command
 from aiogram.exceptions import TelegramBadRequest, TelegramNetworkError, TelegramAPIError
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from typing import Dict, Set, List
+from typing import Dict, Optional
 from datetime import datetime
 from achievement_checker import achievement_checker
 from achievements import get_achievement_full_info, get_achievement_display, ACHIEVEMENTS
@@ -15,14 +16,17 @@ from db import db
 from keyboards import quiz_options, main_menu, confirmation_keyboard, \
     achievements_keyboard, daily_reward_keyboard, categories_keyboard, difficulty_keyboard, \
     profile_keyboard
-from questions import QUESTIONS_BY_CATEGORY, DIFFICULTY_SETTINGS
+from questions import DIFFICULTY_SETTINGS
+from question_bank import question_bank, question_ref
+from question_sampler import question_sampler
+from events import SOURCE_SOLO
 from daily_rewards import daily_rewards, WEEKLY_REWARDS
 
 router = Router()
 
 # ------------------- Состояние пользователей -------------------
 current_question: Dict[int, dict] = {}
-asked_questions: Dict[int, Set[str]] = {}  # Изменено на str для хранения question_id
+question_sent_at: Dict[int, float] = {}  # user_id -> time.monotonic() отправки вопроса
 last_message_id: Dict[int, int] = {}
 user_stats: Dict[int, Dict] = {}  # user_id -> {"correct": 0, "total": 0, "combo": 0}
 user_quiz_settings: Dict[int, Dict] = {}  # user_id -> {"category": "", "difficulty": ""}
@@ -31,52 +35,21 @@ logger = logging.getLogger(__name__)
 
 
 # ------------------- Вспомогательные функции -------------------
-def get_question_id(question: dict) -> str:
-    """Генерирует уникальный ID для вопроса"""
-    return f"{question.get('category', 'unknown')}_{hash(question.get('question', ''))}"
-
-
-def get_available_questions(user_id: int, category: str, difficulty: str = "random") -> List[dict]:
-    """Получает доступные вопросы для пользователя с учетом уже заданных"""
-    asked = asked_questions.get(user_id, set())
-
-    # Получаем вопросы для категории
-    if category == "random":
-        # Объединяем все вопросы из всех категорий
-        all_questions = []
-        for cat_questions in QUESTIONS_BY_CATEGORY.values():
-            all_questions.extend(cat_questions)
-        category_questions = all_questions
-    else:
-        category_questions = QUESTIONS_BY_CATEGORY.get(category, [])
-
-    # Фильтруем по сложности если нужно
-    if difficulty != "random":
-        category_questions = [q for q in category_questions if q.get("difficulty") == difficulty]
-
-    # Исключаем уже заданные вопросы
-    available_questions = [q for q in category_questions if get_question_id(q) not in asked]
-
-    return available_questions
-
-
-def reset_user_questions_if_needed(user_id: int, category: str, difficulty: str = "random"):
-    """Сбрасывает историю вопросов если все доступные вопросы были использованы"""
-    available_questions = get_available_questions(user_id, category, difficulty)
-
-    if not available_questions:
-        # Сбрасываем историю вопросов для этой категории/сложности
-        if user_id in asked_questions:
-            # Удаляем только вопросы относящиеся к текущей категории
-            if category == "random":
-                asked_questions[user_id].clear()
-            else:
-                # Удаляем только вопросы из текущей категории
-                asked_questions[user_id] = {
-                    q_id for q_id in asked_questions[user_id]
-                    if not q_id.startswith(f"{category}_")
-                }
+def draw_question(user_id: int, category: str, difficulty: str = "random") -> Optional[int]:
+    """Следующий еще не заданный пользователю вопрос категории и сложности.
+
+    Берется из мешка question_sampler (O(1)), заданные вопросы пропускаются
+    по истории db.asked_questions (должна быть загружена). Если заданы все
+    вопросы категории, ее история сбрасывается. None - вопросов нет.
+    """
+    asked = partial(db.asked_questions.is_asked, user_id)
+    question_id = question_sampler.draw(user_id, category, difficulty, skip=asked)
+    if question_id is None and question_bank.question_ids(category, difficulty):
+        # Сбрасываем историю вопросов текущей категории ("random" - всех)
+        db.asked_questions.reset(user_id, question_bank.category_mask(category))
         logger.info("Reset question history for user %d, category: %s", user_id, category)
+        question_id = question_sampler.draw(user_id, category, difficulty, skip=asked)
+    return question_id
 
 
 # ------------------- FSM для профиля -------------------
@@ -90,6 +63,21 @@ class QuizStates(StatesGroup):
     playing_quiz = State()
 
 
+async def get_user_answer_stats(user_id: int, user: Dict) -> Dict[str, int]:
+    """Статистика ответов для профиля из БД (с учетом несброшенных счетчиков)"""
+    db_stats = await db.get_user_stats(user_id)
+    return {
+        "correct": db_stats["correct_answers"] or 0,
+        "total": db_stats["total_answers"] or 0,
+        "max_combo": user.get("max_combo") or 0,
+    }
+
+
+def format_user_rank(rank: Dict) -> str:
+    """Строка с местом игрока в общем рейтинге"""
+    return f"#{rank['rank']} из {rank['total']} (топ {rank['top_percent']}%)"
+
+
 async def show_achievement_unlocked(message: types.Message, achievement_id: str):
     """Показывает уведомление о разблокированном достижении"""
     try:
@@ -227,6 +215,9 @@ async def claim_daily_callback(callback: types.CallbackQuery):
 async def cmd_start(message: types.Message):
     user_id = message.from_user.id
     await db.get_user(user_id, message.from_user.username or "")
+    # Пользователь снова пишет боту - возвращаем его в рассылки
+    if await db.mark_reachable(user_id):
+        logger.info(f"Пользователь {user_id} снова доступен для рассылок")
 
     # Инициализация статистики
     user_stats[user_id] = {"correct": 0, "total": 0, "combo": 0, "max_combo": 0}
@@ -250,6 +241,9 @@ async def cmd_menu(message: types.Message):
     """Команда для открытия главного меню"""
     user_id = message.from_user.id
     await db.get_user(user_id, message.from_user.username or "")
+    # Пользователь снова пишет боту - возвращаем его в рассылки
+    if await db.mark_reachable(user_id):
+        logger.info(f"Пользователь {user_id} снова доступен для рассылок")
 
     # Инициализация статистики если нужно
     if user_id not in user_stats:
@@ -367,9 +361,10 @@ async def handle_menu_action_types(message: types.Message, action: str):
     if action == "profile":
         try:
             user = await db.get_user(user_id)
-            stats = user_stats.get(user_id, {"correct": 0, "total": 0, "max_combo": 0})
+            stats = await get_user_answer_stats(user_id, user)
             accuracy = (stats["correct"] / stats["total"] * 100) if stats["total"] > 0 else 0
             favorite_category = await db.get_user_favorite_category(user_id)
+            rank = await db.get_user_rank(user_id)
 
             text = (
                 f"👤 Личный кабинет\n\n"
@@ -377,6 +372,7 @@ async def handle_menu_action_types(message: types.Message, action: str):
                 f"• 🧍 Ник: {user.get('username') or '—'}\n"
                 f"• 🏅 Уровень: {user.get('level', 1)}\n"
                 f"• ✨ XP: {user.get('xp', 0)}\n"
+                f"• 🏆 Место в рейтинге: {format_user_rank(rank)}\n"
                 f"• ✅ Правильных ответов: {stats['correct']}\n"
                 f"• 📈 Точность: {accuracy:.1f}%\n"
                 f"• 🔥 Макс. комбо: {stats['max_combo']}\n"
@@ -404,6 +400,8 @@ async def handle_menu_action_types(message: types.Message, action: str):
                     lines.append(f"{medal} {username} - Ур. {level} • {xp} XP")
 
                 text = "🏆 Топ 10 игроков\n\n" + "\n".join(lines)
+                rank = await db.get_user_rank(user_id)
+                text += f"\n\n📍 Твое место: {format_user_rank(rank)}"
 
             await message.answer(text)
         except Exception as e:
@@ -560,24 +558,20 @@ async def cmd_quiz(message: types.Message, user_id: int):
         category = settings.get("category", "random")
         difficulty = settings.get("difficulty", "random")
 
-        # Проверяем и сбрасываем историю вопросов если нужно
-        reset_user_questions_if_needed(user_id, category, difficulty)
+        # История заданных вопросов хранится в БД, в памяти - по требованию
+        await db.load_asked_questions(user_id)
 
-        # Получаем доступные вопросы
-        available_questions = get_available_questions(user_id, category, difficulty)
+        # Выбираем следующий незаданный вопрос
+        question_id = draw_question(user_id, category, difficulty)
 
-        if not available_questions:
+        if question_id is None:
             await message.answer("❌ В выбранной категории пока нет вопросов")
             return
 
-        # Выбираем случайный вопрос
-        question = random.choice(available_questions)
-        question_id = get_question_id(question)
+        question = question_bank.get(question_id)
 
-        # Сохраняем информацию о заданном вопросе
-        if user_id not in asked_questions:
-            asked_questions[user_id] = set()
-        asked_questions[user_id].add(question_id)
+        # Сохраняем информацию о заданном вопросе (в БД маска пишется пачкой)
+        db.asked_questions.mark(user_id, question_id)
         current_question[user_id] = question
 
         # Добавляем информацию о категории и сложности
@@ -602,6 +596,7 @@ async def cmd_quiz(message: types.Message, user_id: int):
                 reply_markup=quiz_options(options)
             )
             last_message_id[user_id] = msg.message_id
+            question_sent_at[user_id] = time.monotonic()
         except (TelegramBadRequest, TelegramNetworkError) as e:
             logger.error("Error sending quiz question: %s", e)
             await message.answer("❌ Ошибка при отправке вопроса. Попробуйте еще раз.")
@@ -627,6 +622,7 @@ async def handle_quiz_answer(callback: types.CallbackQuery, chosen: str):
         return
 
     q = current_question.pop(user_id)
+    sent_at = question_sent_at.pop(user_id, None)
     stats = user_stats.setdefault(user_id, {"correct": 0, "total": 0, "combo": 0, "max_combo": 0})
     stats["total"] += 1
 
@@ -686,6 +682,11 @@ async def handle_quiz_answer(callback: types.CallbackQuery, chosen: str):
         logger.info(f"Answer comparison: user='{user_answer_text}' vs correct='{correct_answer_text}' -> {is_correct}")
         logger.info(f"Normalized: user='{normalized_user}' vs correct='{normalized_correct}' -> {is_correct}")
 
+        # Событие в журнал ответов (пишется в БД пачкой)
+        question_id, category_id = question_ref(q)
+        latency_ms = int((time.monotonic() - sent_at) * 1000) if sent_at is not None else None
+        db.record_answer_event(user_id, question_id, category_id, chosen_index, is_correct, latency_ms, SOURCE_SOLO)
+
         if is_correct:
             # Правильный ответ
             stats["correct"] += 1
@@ -693,26 +694,40 @@ async def handle_quiz_answer(callback: types.CallbackQuery, chosen: str):
             stats["max_combo"] = max(stats["max_combo"], stats["combo"])
 
             xp_reward = base_xp + (stats["combo"] // 3) * 5  # Бонус за комбо
-            new_xp, new_level = await db.add_xp(user_id, xp_reward)
-
-            # Обновляем статистику по категории
-            await db.update_user_category_stats(user_id, question_category, True)
-
-            # Проверяем достижения
-            unlocked_achievements = await achievement_checker.check_achievements(
-                user_id=user_id,
-                event_type="answer",
-                is_correct=True,
-                current_combo=stats["combo"],
-                user_xp=new_xp,
-                total_answers=stats["total"]
-            )
 
-            # Показываем уведомления о достижениях
+            # Счетчики ответов копятся в памяти и сбрасываются в БД пачкой
+            db.record_answer(user_id, question_category, True)
+
+            # XP, рекорд комбо, достижения и их награды - одним коммитом
+            try:
+                async with db.transaction():
+                    new_xp, new_level = await db.add_xp(user_id, xp_reward)
+
+                    # Рекорд комбо храним в БД (условный UPDATE, без лишней записи)
+                    if stats["combo"] == stats["max_combo"]:
+                        await db.update_max_combo(user_id, stats["combo"])
+
+                    # Проверяем достижения
+                    unlocked_achievements = await achievement_checker.check_achievements(
+                        user_id=user_id,
+                        event_type="answer",
+                        is_correct=True,
+                        current_combo=stats["combo"],
+                        user_xp=new_xp,
+                        total_answers=stats["total"]
+                    )
+
+                    for achievement_id in unlocked_achievements:
+                        achievement_xp = ACHIEVEMENTS[achievement_id]["xp_reward"]
+                        await db.add_xp(user_id, achievement_xp)
+            except Exception:
+                # Транзакция откатилась - кэш достижений мог разойтись с БД
+                await achievement_checker.clear_user_cache(user_id)
+                raise
+
+            # Показываем уведомления о достижениях уже после коммита
             for achievement_id in unlocked_achievements:
                 await show_achievement_unlocked(callback.message, achievement_id)
-                achievement_xp = ACHIEVEMENTS[achievement_id]["xp_reward"]
-                await db.add_xp(user_id, achievement_xp)
 
             combo_bonus = ""
             if stats["combo"] >= 3:
@@ -730,18 +745,22 @@ async def handle_quiz_answer(callback: types.CallbackQuery, chosen: str):
             stats["combo"] = 0
             accuracy = (stats["correct"] / stats["total"] * 100) if stats["total"] > 0 else 0
 
-            # Обновляем статистику по категории
-            await db.update_user_category_stats(user_id, question_category, False)
-
-            # Проверяем достижения
-            await achievement_checker.check_achievements(
-                user_id=user_id,
-                event_type="answer",
-                is_correct=False,
-                current_combo=0,
-                user_xp=await db.get_user_xp(user_id),
-                total_answers=stats["total"]
-            )
+            db.record_answer(user_id, question_category, False)
+
+            try:
+                async with db.transaction():
+                    # Проверяем достижения
+                    await achievement_checker.check_achievements(
+                        user_id=user_id,
+                        event_type="answer",
+                        is_correct=False,
+                        current_combo=0,
+                        user_xp=await db.get_user_xp(user_id),
+                        total_answers=stats["total"]
+                    )
+            except Exception:
+                await achievement_checker.clear_user_cache(user_id)
+                raise
 
             result_text = (
                 f"❌ Неправильно\n"
@@ -782,6 +801,7 @@ async def handle_menu_action(callback: types.CallbackQuery, action: str):
     # ------------------- Главное меню -------------------
     if action == "main":
         current_question.pop(user_id, None)
+        question_sent_at.pop(user_id, None)
 
         # Пытаемся удалить предыдущее сообщение с квизом, если есть
         try:
@@ -812,12 +832,13 @@ async def handle_menu_action(callback: types.CallbackQuery, action: str):
     elif action == "profile":
         try:
             user = await db.get_user(user_id)
-            stats = user_stats.get(user_id, {"correct": 0, "total": 0, "max_combo": 0})
+            stats = await get_user_answer_stats(user_id, user)
             accuracy = (stats["correct"] / stats["total"] * 100) if stats["total"] > 0 else 0
 
             # Получаем статистику по категориям
             category_stats = await db.get_user_category_stats(user_id)
             favorite_category = await db.get_user_favorite_category(user_id)
+            rank = await db.get_user_rank(user_id)
 
             text = (
                 f"👤 Личный кабинет\n\n"
@@ -825,6 +846,7 @@ async def handle_menu_action(callback: types.CallbackQuery, action: str):
                 f"• 🧍 Ник: {user.get('username') or '—'}\n"
                 f"• 🏅 Уровень: {user.get('level', 1)}\n"
                 f"• ✨ XP: {user.get('xp', 0)}\n"
+                f"• 🏆 Место в рейтинге: {format_user_rank(rank)}\n"
                 f"• ✅ Правильных ответов: {stats['correct']}\n"
                 f"• 📈 Точность: {accuracy:.1f}%\n"
                 f"• 🔥 Макс. комбо: {stats['max_combo']}\n"
@@ -871,6 +893,8 @@ async def handle_menu_action(callback: types.CallbackQuery, action: str):
                     lines.append(f"{medal} {username} - Ур. {level} • {xp} XP")
 
                 text = "🏆 Топ 10 игроков\n\n" + "\n".join(lines)
+                rank = await db.get_user_rank(user_id)
+                text += f"\n\n📍 Твое место: {format_user_rank(rank)}"
 
             await callback.message.edit_text(
                 text=text,
@@ -888,7 +912,7 @@ async def handle_menu_action(callback: types.CallbackQuery, action: str):
     elif action == "stats":
         try:
             user = await db.get_user(user_id)
-            stats = user_stats.get(user_id, {"correct": 0, "total": 0, "max_combo": 0})
+            stats = await get_user_answer_stats(user_id, user)
             accuracy = (stats["correct"] / stats["total"] * 100) if stats["total"] > 0 else 0
 
             text = (
@@ -1009,7 +1033,7 @@ async def cmd_stats(message: types.Message):
     user_id = message.from_user.id
     try:
         user = await db.get_user(user_id)
-        stats = user_stats.get(user_id, {"correct": 0, "total": 0, "max_combo": 0})
+        stats = await get_user_answer_stats(user_id, user)
         accuracy = (stats["correct"] / stats["total"] * 100) if stats["total"] > 0 else 0
 
         text = (
@@ -1062,8 +1086,8 @@ async def handle_confirm_reset(callback: types.CallbackQuery):
         try:
             await db.reset_progress(user_id)
             user_stats[user_id] = {"correct": 0, "total": 0, "combo": 0, "max_combo": 0}
-            asked_questions.pop(user_id, None)
             current_question.pop(user_id, None)
+            question_sent_at.pop(user_id, None)
             await callback.answer("🔄 Прогресс сброшен!", show_alert=True)
             await show_main_menu(callback.message.bot, callback.message.chat.id, user_id)
         except Exception as e:
@@ -1219,7 +1243,8 @@ async def debug_questions(message: types.Message):
     total_questions = 0
     categories_with_issues = []
 
-    for category, questions in QUESTIONS_BY_CATEGORY.items():
+    for category in question_bank.categories():
+        questions = question_bank.by_category(category)
         total_questions += len(questions)
         debug_text += f"📚 {category.upper()} ({len(questions)} вопросов):\n"
 
@@ -1245,11 +1270,11 @@ async def debug_questions(message: types.Message):
                     categories_with_issues.append(category)
 
             debug_text += f"      Сложность: {question.get('difficulty', 'N/A')}\n"
-            debug_text += f"      ID: {get_question_id(question)}\n\n"
+            debug_text += f"      ID: {question['question_id']}\n\n"
 
     # Сводка
     debug_text += f"📊 СВОДКА:\n"
-    debug_text += f"• Всего категорий: {len(QUESTIONS_BY_CATEGORY)}\n"
+    debug_text += f"• Всего категорий: {len(question_bank.categories())}\n"
     debug_text += f"• Всего вопросов: {total_questions}\n"
     debug_text += f"• Категории с проблемами: {categories_with_issues if categories_with_issues else 'нет'}\n"
 
@@ -1280,8 +1305,8 @@ async def cleanup_old_data():
 
             # Очищаем данные
             for user_id in users_to_clean[:10]:
-                asked_questions.pop(user_id, None)
                 current_question.pop(user_id, None)
+                question_sent_at.pop(user_id, None)
                 user_stats.pop(user_id, None)
                 user_quiz_settings.pop(user_id, None)
 
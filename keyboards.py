@@ -1,6 +1,6 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from typing import Optional, List
+from typing import Dict, Optional, List
 
 
 def main_menu() -> InlineKeyboardMarkup:
@@ -604,6 +604,43 @@ def admin_questions_keyboard(show_pagination: bool = False, current_page: int =
     return keyboard.as_markup()
 
 
+def admin_question_category_keyboard(categories: Dict[str, int]) -> InlineKeyboardMarkup:
+    """Выбор категории нового вопроса (categories: название -> category_id)"""
+    keyboard = InlineKeyboardBuilder()
+
+    buttons = [
+        InlineKeyboardButton(text=name.capitalize(), callback_data=f"admin_qcat:{category_id}")
+        for name, category_id in categories.items()
+    ]
+    for i in range(0, len(buttons), 2):
+        keyboard.row(*buttons[i:i + 2])
+
+    keyboard.row(
+        InlineKeyboardButton(text="❌ Отмена", callback_data="admin_questions")
+    )
+
+    return keyboard.as_markup()
+
+
+def admin_question_difficulty_keyboard() -> InlineKeyboardMarkup:
+    """Выбор сложности нового вопроса"""
+    keyboard = InlineKeyboardBuilder()
+
+    difficulties = [
+        ("🟢 Легкий", "легкий"),
+        ("🟡 Средний", "средний"),
+        ("🔴 Сложный", "сложный")
+    ]
+    for name, difficulty in difficulties:
+        keyboard.row(InlineKeyboardButton(text=name, callback_data=f"admin_qdiff:{difficulty}"))
+
+    keyboard.row(
+        InlineKeyboardButton(text="❌ Отмена", callback_data="admin_questions")
+    )
+
+    return keyboard.as_markup()
+
+
 def admin_stats_keyboard() -> InlineKeyboardMarkup:
     """Клавиатура статистики"""
     keyboard = InlineKeyboardBuilder()
@@ -631,6 +668,9 @@ def admin_users_keyboard() -> InlineKeyboardMarkup:
         InlineKeyboardButton(text="⚡ Активные пользователи", callback_data="admin_active_users"),
         InlineKeyboardButton(text="🎯 Топ игроков", callback_data="admin_top_users")
     )
+    keyboard.row(
+        InlineKeyboardButton(text="📋 Все пользователи", callback_data="ub_created_page:0:")
+    )
     keyboard.row(
         InlineKeyboardButton(text="⬅️ Назад", callback_data="admin_main")
     )
@@ -672,6 +712,27 @@ def admin_broadcast_keyboard() -> InlineKeyboardMarkup:
     return keyboard.as_markup()
 
 
+def broadcast_control_keyboard(job_id: int, status: str) -> InlineKeyboardMarkup:
+    """Клавиатура управления идущей рассылкой"""
+    keyboard = InlineKeyboardBuilder()
+
+    if status == "running":
+        keyboard.row(
+            InlineKeyboardButton(text="⏸ Пауза", callback_data=f"bcast_pause:{job_id}"),
+            InlineKeyboardButton(text="⛔ Отменить", callback_data=f"bcast_cancel:{job_id}")
+        )
+    elif status == "paused":
+        keyboard.row(
+            InlineKeyboardButton(text="▶️ Продолжить", callback_data=f"bcast_resume:{job_id}"),
+            InlineKeyboardButton(text="⛔ Отменить", callback_data=f"bcast_cancel:{job_id}")
+        )
+    keyboard.row(
+        InlineKeyboardButton(text="⬅️ Назад", callback_data="admin_broadcast")
+    )
+
+    return keyboard.as_markup()
+
+
 def admin_manage_admins_keyboard() -> InlineKeyboardMarkup:
     """Клавиатура управления администраторами"""
     keyboard = InlineKeyboardBuilder()
@@ -698,6 +759,9 @@ def admin_backup_keyboard() -> InlineKeyboardMarkup:
         InlineKeyboardButton(text="📦 Создать бэкап", callback_data="admin_create_backup"),
         InlineKeyboardButton(text="🔄 Восстановить", callback_data="admin_restore_backup")
     )
+    keyboard.row(
+        InlineKeyboardButton(text="🧩 Инкрементальный бэкап", callback_data="admin_incremental_backup")
+    )
     keyboard.row(
         InlineKeyboardButton(text="📋 Список бэкапов", callback_data="admin_list_backups")
     )
@@ -708,6 +772,24 @@ def admin_backup_keyboard() -> InlineKeyboardMarkup:
     return keyboard.as_markup()
 
 
+def admin_restore_keyboard(chains: List[dict]) -> InlineKeyboardMarkup:
+    """Клавиатура восстановления: локальные цепочки бэкапов"""
+    keyboard = InlineKeyboardBuilder()
+
+    for chain in chains:
+        keyboard.row(
+            InlineKeyboardButton(
+                text=f"🧩 {chain['chain']} (+{len(chain['deltas'])} дельт)",
+                callback_data=f"admin_restore_chain:{chain['chain']}"
+            )
+        )
+    keyboard.row(
+        InlineKeyboardButton(text="❌ Отмена", callback_data="admin_restore_cancel")
+    )
+
+    return keyboard.as_markup()
+
+
 def admin_logs_keyboard() -> InlineKeyboardMarkup:
     """Клавиатура просмотра логов"""
     keyboard = InlineKeyboardBuilder()
@@ -836,17 +918,25 @@ def admin_confirm_broadcast_keyboard() -> InlineKeyboardMarkup:
 
 
 def admin_pagination_keyboard(current_page: int, total_pages: int, prefix: str = "admin",
-                              additional_buttons: List[InlineKeyboardButton] = None) -> InlineKeyboardMarkup:
-    """Улучшенная клавиатура пагинации с дополнительными кнопками"""
+                              additional_buttons: List[InlineKeyboardButton] = None,
+                              prev_cursor: Optional[str] = None, next_cursor: Optional[str] = None,
+                              back_callback: Optional[str] = None) -> InlineKeyboardMarkup:
+    """Улучшенная клавиатура пагинации с дополнительными кнопками.
+
+    prev_cursor/next_cursor - keyset-курсоры соседних страниц: попадают в
+    callback_data ({prefix}_page:{страница}:{курсор}, не больше 64 байт),
+    и кнопки показываются только при наличии курсора.
+    """
     keyboard = InlineKeyboardBuilder()
 
+    keyed = prev_cursor is not None or next_cursor is not None
     buttons = []
 
-    if current_page > 0:
+    if prev_cursor is not None or (not keyed and current_page > 0):
         buttons.append(
             InlineKeyboardButton(
                 text="⬅️ Назад",
-                callback_data=f"{prefix}_page:{current_page - 1}"
+                callback_data=f"{prefix}_page:{current_page - 1}" + (f":{prev_cursor}" if keyed else "")
             )
         )
 
@@ -857,11 +947,11 @@ def admin_pagination_keyboard(current_page: int, total_pages: int, prefix: str =
         )
     )
 
-    if current_page < total_pages - 1:
+    if next_cursor is not None or (not keyed and current_page < total_pages - 1):
         buttons.append(
             InlineKeyboardButton(
                 text="Вперед ➡️",
-                callback_data=f"{prefix}_page:{current_page + 1}"
+                callback_data=f"{prefix}_page:{current_page + 1}" + (f":{next_cursor}" if keyed else "")
             )
         )
 
@@ -871,6 +961,9 @@ def admin_pagination_keyboard(current_page: int, total_pages: int, prefix: str =
     if additional_buttons:
         keyboard.row(*additional_buttons)
 
+    if back_callback:
+        keyboard.row(InlineKeyboardButton(text="⬅️ Назад", callback_data=back_callback))
+
     return keyboard.as_markup()
 
 
@@ -0,0 +1,293 @@
+import math
+from bisect import bisect_right, insort
+from functools import partial
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+# Сколько лидеров держим в памяти (топ-10 на экране + запас на вытеснение)
+LEADERBOARD_TOP_K = 100
+# До какого XP гистограмма точная (дерево растет удвоением до этой границы);
+# редкие значения выше хранятся в отсортированном списке
+MAX_EXACT_XP = 1 << 20
+
+
+def rank_info(above: int, total: int) -> Dict[str, Any]:
+    """Место по количеству игроков выше: {"rank", "total", "top_percent"}.
+
+    Процент округляется вверх, чтобы первое место не превращалось в "топ 0%".
+    """
+    total = max(total, 1)
+    rank = above + 1
+    return {"rank": rank, "total": total, "top_percent": math.ceil(rank * 1000 / total) / 10}
+
+
+class _Fenwick:
+    """Дерево Фенвика над счетчиками: прибавление и префиксная сумма за O(log n)."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.tree = [0] * (size + 1)
+
+    @classmethod
+    def from_counts(cls, counts: List[int]) -> "_Fenwick":
+        """Строит дерево по готовым счетчикам за O(n)."""
+        fenwick = cls(len(counts))
+        tree = fenwick.tree
+        for i, count in enumerate(counts, start=1):
+            tree[i] += count
+            parent = i + (i & -i)
+            if parent <= fenwick.size:
+                tree[parent] += tree[i]
+        return fenwick
+
+    def add(self, index: int, delta: int):
+        i = index + 1
+        while i <= self.size:
+            self.tree[i] += delta
+            i += i & -i
+
+    def prefix(self, index: int) -> int:
+        """Сумма счетчиков [0..index]."""
+        total = 0
+        i = min(index + 1, self.size)
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+
+class XPHistogram:
+    """Распределение пользователей по XP: "сколько игроков выше меня" за O(log n).
+
+    Хранит только количество пользователей на каждое значение XP, а не сами
+    user_id, поэтому вызывающий код передает старое и новое значение опыта.
+    """
+
+    def __init__(self, max_exact: int = MAX_EXACT_XP):
+        self.max_exact = max_exact
+        self._counts: List[int] = [0] * 1024
+        self._tree = _Fenwick(len(self._counts))
+        self._overflow: List[int] = []  # XP >= max_exact, по возрастанию
+        self.total = 0
+
+    def _grow(self, xp: int):
+        size = len(self._counts)
+        while size <= xp and size < self.max_exact:
+            size *= 2
+        self._counts.extend([0] * (size - len(self._counts)))
+        self._tree = _Fenwick.from_counts(self._counts)
+
+    def add(self, xp: int, count: int = 1):
+        xp = max(0, xp)
+        if xp >= self.max_exact:
+            for _ in range(count):
+                insort(self._overflow, xp)
+        else:
+            if xp >= len(self._counts):
+                self._grow(xp)
+            self._counts[xp] += count
+            self._tree.add(xp, count)
+        self.total += count
+
+    def remove(self, xp: int):
+        xp = max(0, xp)
+        if xp >= self.max_exact:
+            i = bisect_right(self._overflow, xp) - 1
+            if i < 0 or self._overflow[i] != xp:
+                return
+            self._overflow.pop(i)
+        else:
+            if xp >= len(self._counts) or self._counts[xp] == 0:
+                return
+            self._counts[xp] -= 1
+            self._tree.add(xp, -1)
+        self.total -= 1
+
+    def count_above(self, xp: int) -> int:
+        """Количество пользователей со строго большим XP."""
+        xp = max(0, xp)
+        if xp >= self.max_exact:
+            return len(self._overflow) - bisect_right(self._overflow, xp)
+        exact_total = self.total - len(self._overflow)
+        return len(self._overflow) + exact_total - self._tree.prefix(xp)
+
+    @classmethod
+    def from_values(cls, values: Iterable[int], max_exact: int = MAX_EXACT_XP) -> "XPHistogram":
+        """Строит гистограмму по всем значениям XP за один проход."""
+        histogram = cls(max_exact)
+        counts = histogram._counts
+        overflow = []
+        total = 0
+        for xp in values:
+            xp = max(0, xp or 0)
+            total += 1
+            if xp >= max_exact:
+                overflow.append(xp)
+                continue
+            if xp >= len(counts):
+                size = len(counts)
+                while size <= xp:
+                    size *= 2
+                counts.extend([0] * (size - len(counts)))
+            counts[xp] += 1
+        overflow.sort()
+        histogram._overflow = overflow
+        histogram._tree = _Fenwick.from_counts(counts)
+        histogram.total = total
+        return histogram
+
+
+class Leaderboard:
+    """Таблица лидеров в памяти: топ-K и место любого игрока без сканирования users.
+
+    Изменения XP применяются инкрементально (set_xp/add_user/remove_user).
+    Если что-то нельзя применить точно (массовые операции, откат транзакции,
+    вытеснение из топа игрока, чье место мог занять неизвестный нам игрок),
+    таблица помечается устаревшей и перестраивается из БД (rebuild).
+
+    Перестроение читает снимок БД, пока запись продолжается: после
+    begin_rebuild изменения запоминаются и rebuild применяет их поверх снимка.
+    """
+
+    def __init__(self, top_k: int = LEADERBOARD_TOP_K):
+        self.top_k = top_k
+        self.histogram = XPHistogram()
+        # user_id -> {"user_id", "username", "level", "xp", "max_combo"}
+        self._top: Dict[int, Dict[str, Any]] = {}
+        self.ready = False  # гистограмма соответствует БД
+        self.top_valid = False  # _top содержит ровно K лучших
+        # Изменения после снимка для rebuild (None - снимок не читается)
+        self._journal: Optional[List[Callable[[], None]]] = None
+        self._invalidated_during_rebuild = False
+
+    # ---------------- Перестроение ----------------
+
+    def begin_rebuild(self):
+        """Снимок БД для rebuild зафиксирован: дальнейшие изменения запоминаются.
+
+        Вызывать в момент, когда снимок совпадает с примененными изменениями
+        (между батчами записи), иначе изменение учтется дважды или потеряется.
+        """
+        self._journal = []
+        self._invalidated_during_rebuild = False
+
+    def cancel_rebuild(self):
+        """Перестроение не состоялось: журнал больше не нужен, данные устарели."""
+        self._journal = None
+        self.invalidate()
+
+    def rebuild(self, histogram: XPHistogram, top_rows: Iterable[Tuple]) -> int:
+        """Подменяет данные таблицы построенными по БД.
+
+        histogram - XPHistogram.from_values по всем users.xp,
+        top_rows: (user_id, username, level, xp, max_combo) по убыванию xp, не больше K.
+        Изменения после begin_rebuild применяются к новым данным.
+        Возвращает расхождение числа пользователей со старой гистограммой.
+        """
+        changes, self._journal = self._journal or [], None
+        previous_total = self.histogram.total if self.ready else None
+        self.histogram = histogram
+        self.set_top(top_rows)
+        self.ready = True
+        for change in changes:
+            change()
+        if self._invalidated_during_rebuild:
+            # Массовое изменение после снимка: новые данные тоже устарели
+            self._invalidated_during_rebuild = False
+            self.invalidate()
+            return 0
+        return 0 if previous_total is None else self.histogram.total - previous_total
+
+    def set_top(self, top_rows: Iterable[Tuple]):
+        self._top = {
+            row[0]: {"user_id": row[0], "username": row[1], "level": row[2], "xp": row[3], "max_combo": row[4]}
+            for row in top_rows
+        }
+        self.top_valid = True
+
+    def invalidate(self):
+        """Данные разошлись с БД - до перестроения пользуемся SQL."""
+        self.ready = False
+        self.top_valid = False
+        if self._journal is not None:
+            self._invalidated_during_rebuild = True
+
+    def _record(self, method: Callable, *args, **kwargs):
+        """Запоминает изменение, сделанное во время чтения снимка для rebuild."""
+        if self._journal is not None:
+            self._journal.append(partial(method, *args, **kwargs))
+
+    # ---------------- Инкрементальные изменения ----------------
+
+    def add_user(self, user_id: int, xp: int = 0, level: int = 1, username: Optional[str] = None):
+        """Новый пользователь."""
+        self._record(self.add_user, user_id, xp, level, username)
+        if self.ready:
+            self.histogram.add(xp)
+        self._update_top(user_id, xp, level, username)
+
+    def remove_user(self, user_id: int, xp: int):
+        """Пользователь удален."""
+        self._record(self.remove_user, user_id, xp)
+        if self.ready:
+            self.histogram.remove(xp)
+        was_full = len(self._top) >= self.top_k
+        if self._top.pop(user_id, None) is not None and was_full:
+            # Освободившееся место займет игрок, которого мы не отслеживаем
+            self.top_valid = False
+
+    def set_xp(self, user_id: int, old_xp: Optional[int], new_xp: int, level: int):
+        """XP пользователя изменился (old_xp=None - пользователь только что создан)."""
+        self._record(self.set_xp, user_id, old_xp, new_xp, level)
+        if self.ready:
+            if old_xp is not None:
+                self.histogram.remove(old_xp)
+            self.histogram.add(new_xp)
+        self._update_top(user_id, new_xp, level)
+
+    def update_details(self, user_id: int, **fields):
+        """Обновляет имя/уровень/комбо игрока, если он в топе."""
+        self._record(self.update_details, user_id, **fields)
+        entry = self._top.get(user_id)
+        if entry:
+            entry.update(fields)
+
+    def _floor(self) -> int:
+        return min(entry["xp"] for entry in self._top.values())
+
+    def _update_top(self, user_id: int, xp: int, level: int, username: Optional[str] = None):
+        if not self.top_valid:
+            return
+
+        entry = self._top.get(user_id)
+        if entry:
+            # Игроки вне полного топа имеют не больше XP, чем его нижняя граница до изменения
+            floor = self._floor()
+            entry["xp"] = xp
+            entry["level"] = level
+            # Игрок опустился ниже этой границы: вне топа может быть кто-то выше него
+            if len(self._top) >= self.top_k and xp < floor:
+                self.top_valid = False
+            return
+
+        # Пока в топе меньше K игроков, он содержит всех пользователей
+        if len(self._top) < self.top_k or xp > self._floor():
+            self._top[user_id] = {"user_id": user_id, "username": username, "level": level,
+                                  "xp": xp, "max_combo": None}
+            if len(self._top) > self.top_k:
+                lowest = min(self._top.values(), key=lambda e: e["xp"])
+                del self._top[lowest["user_id"]]
+
+    # ---------------- Чтение ----------------
+
+    def top(self, limit: int) -> Optional[List[Dict[str, Any]]]:
+        """Топ игроков по убыванию XP или None, если кэш не годится."""
+        if not self.top_valid or limit > self.top_k:
+            return None
+        entries = sorted(self._top.values(), key=lambda e: (-e["xp"], e["user_id"]))
+        return [dict(entry) for entry in entries[:limit]]
+
+    def rank(self, xp: int) -> Optional[Dict[str, Any]]:
+        """Место игрока с данным XP: {"rank", "total", "top_percent"} или None."""
+        if not self.ready or self.histogram.total == 0:
+            return None
+        return rank_info(self.histogram.count_above(xp), self.histogram.total)
@@ -5,7 +5,7 @@ from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties  # ← ВАЖНО!
 import sys
 import os
-from typing import Optional
+from typing import List, Optional
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -26,6 +26,9 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 
+# Фоновые циклы (бэкапы, статистика): останавливаются в on_shutdown до закрытия базы
+background_tasks: List[asyncio.Task] = []
+
 async def setup_bot_commands(bot: Bot):
     from aiogram.types import BotCommand, BotCommandScopeDefault
     commands = [
@@ -44,7 +47,7 @@ async def check_database_connection():
         await db.connect()
         user_count = await db.get_total_users_count()
         logger.info(f"✅ База данных подключена. Пользователей: {user_count}")
-        await db.close()
+        # Соединение не закрываем: для :memory: базы это стерло бы все данные
         return True
     except Exception as e:
         logger.error(f"❌ Ошибка подключения к базе данных: {e}")
@@ -55,6 +58,11 @@ async def on_startup(bot: Bot):
     if not await check_database_connection():
         logger.error("❌ Проблемы с подключением к базе данных!")
         return
+    try:
+        from question_bank import question_bank
+        await question_bank.load()
+    except Exception as e:
+        logger.error(f"❌ Ошибка загрузки банка вопросов: {e}")
     await setup_bot_commands(bot)
     try:
         from duels import start_background_tasks
@@ -62,12 +70,42 @@ async def on_startup(bot: Bot):
         logger.info("✅ Фоновые задачи дуэлей запущены")
     except Exception as e:
         logger.error(f"❌ Ошибка запуска фоновых задач: {e}")
+    try:
+        from backup import BACKUP_INTERVAL, incremental_backup_loop
+        if BACKUP_INTERVAL > 0:
+            background_tasks.append(asyncio.create_task(incremental_backup_loop()))
+            logger.info(f"✅ Инкрементальные бэкапы каждые {BACKUP_INTERVAL:.0f} сек")
+    except Exception as e:
+        logger.error(f"❌ Ошибка запуска бэкапов: {e}")
+    try:
+        from system_stats import STATS_SNAPSHOT_TTL, system_stats
+        background_tasks.append(asyncio.create_task(system_stats.refresh_loop()))
+        logger.info(f"✅ Статистика админ-панели обновляется каждые {STATS_SNAPSHOT_TTL:.0f} сек")
+    except Exception as e:
+        logger.error(f"❌ Ошибка запуска обновления статистики: {e}")
+    try:
+        from broadcast import broadcast_manager
+        await broadcast_manager.resume_unfinished(bot)
+    except Exception as e:
+        logger.error(f"❌ Ошибка возобновления рассылок: {e}")
     logger.info("🎉 Все системы запущены и готовы к работе!")
 
 async def on_shutdown(bot: Bot):
     logger.info("🛑 Бот выключается...")
+    try:
+        from broadcast import broadcast_manager
+        # Прогресс рассылок сохраняется, они продолжатся при следующем запуске
+        await broadcast_manager.shutdown()
+    except Exception as e:
+        logger.error(f"❌ Ошибка остановки рассылок: {e}")
+    # Циклы пишут в базу - дожидаемся их остановки до db.close()
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
     try:
         from db import db
+        # close() сбрасывает счетчики и сохраняет снимок :memory: базы
         await db.close()
         logger.info("✅ Соединение с базой данных закрыто")
     except Exception as e:
@@ -0,0 +1,627 @@
+import json
+import logging
+from typing import Any, Awaitable, Callable, List, Sequence, Tuple
+
+import aiosqlite
+
+from events import partition_ts_index_ddl, view_sql
+
+logger = logging.getLogger(__name__)
+
+# Размер пачки для миграций, переписывающих данные больших таблиц
+MIGRATION_BATCH_SIZE = 1000
+
+MigrationFunc = Callable[[aiosqlite.Connection], Awaitable[None]]
+
+# Реестр миграций: (версия, описание, batched, функция), по возрастанию версии.
+# Версия схемы хранится в PRAGMA user_version.
+MIGRATIONS: List[Tuple[int, str, bool, MigrationFunc]] = []
+
+
+def migration(version: int, description: str, batched: bool = False):
+    """Регистрирует миграцию схемы.
+
+    Обычная миграция выполняется целиком в одной транзакции вместе с записью
+    user_version. batched=True - миграция данных, которая сама коммитит пачки
+    (см. update_in_batches); она обязана быть идемпотентной, чтобы после сбоя
+    продолжить с того же места.
+    """
+    def register(func: MigrationFunc) -> MigrationFunc:
+        if any(v == version for v, *_ in MIGRATIONS):
+            raise ValueError(f"Миграция {version} уже зарегистрирована")
+        MIGRATIONS.append((version, description, batched, func))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return func
+    return register
+
+
+def latest_version() -> int:
+    """Последняя известная версия схемы."""
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+async def get_schema_version(conn: aiosqlite.Connection) -> int:
+    async with conn.execute("PRAGMA user_version") as cursor:
+        return (await cursor.fetchone())[0]
+
+
+async def apply_migrations(conn: aiosqlite.Connection) -> int:
+    """Применяет недостающие миграции по порядку. Возвращает итоговую версию."""
+    current = await get_schema_version(conn)
+    if current >= latest_version():
+        return current
+
+    for version, description, batched, func in MIGRATIONS:
+        if version <= current:
+            continue
+
+        logger.info("🔧 Миграция схемы %d: %s", version, description)
+        try:
+            if batched:
+                # Пачки коммитятся внутри, здесь только фиксируем версию
+                await func(conn)
+                await conn.execute("BEGIN")
+            else:
+                await conn.execute("BEGIN")
+                await func(conn)
+            await conn.execute(f"PRAGMA user_version = {int(version)}")
+            await conn.commit()
+        except Exception:
+            if conn.in_transaction:
+                await conn.rollback()
+            logger.error("❌ Миграция %d не применена", version)
+            raise
+
+        current = version
+
+    logger.info("✅ Схема БД обновлена до версии %d", current)
+    return current
+
+
+async def column_exists(conn: aiosqlite.Connection, table: str, column: str) -> bool:
+    async with conn.execute(f"PRAGMA table_info({table})") as cursor:
+        return any(row[1] == column for row in await cursor.fetchall())
+
+
+async def update_in_batches(conn: aiosqlite.Connection, table: str, set_clause: str,
+                            where_clause: str = "1", params: Sequence[Any] = (),
+                            batch_size: int = MIGRATION_BATCH_SIZE) -> int:
+    """UPDATE большой таблицы пачками по rowid, каждая пачка - своя транзакция.
+
+    Границы пачек ищутся по ключу (rowid > последний), поэтому разреженные
+    rowid (например, user_id из Telegram) не создают пустых итераций.
+    Возвращает количество обновленных строк.
+    """
+    updated = 0
+    last_rowid = None
+    while True:
+        async with conn.execute(
+                f"SELECT rowid FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT 1 OFFSET ?",
+                (last_rowid if last_rowid is not None else -(2 ** 63), batch_size - 1)
+        ) as cursor:
+            row = await cursor.fetchone()
+        upper = row[0] if row else None
+
+        lower_sql = "" if last_rowid is None else "rowid > ? AND "
+        upper_sql = "" if upper is None else "rowid <= ? AND "
+        bounds = ([] if last_rowid is None else [last_rowid]) + ([] if upper is None else [upper])
+
+        await conn.execute("BEGIN")
+        try:
+            cursor = await conn.execute(
+                f"UPDATE {table} SET {set_clause} WHERE {lower_sql}{upper_sql}({where_clause})",
+                (*params, *bounds)
+            )
+            updated += cursor.rowcount
+            await cursor.close()
+            await conn.commit()
+        except Exception:
+            await conn.rollback()
+            raise
+
+        if upper is None:
+            return updated
+        last_rowid = upper
+
+
+async def track_changes(conn: aiosqlite.Connection, table: str, key: Sequence[str]):
+    """Колонка updated_at, ее индекс и триггеры журнала изменений таблицы (см. миграцию 8)"""
+    if not await column_exists(conn, table, "updated_at"):
+        await conn.execute(f"ALTER TABLE {table} ADD COLUMN updated_at DATETIME")
+    await conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_updated_at ON {table} (updated_at)")
+
+    match_new = " AND ".join(f"{column} = NEW.{column}" for column in key)
+    old_key = ", ".join(f"OLD.{column}" for column in key)
+    await conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_inserted AFTER INSERT ON {table}
+        FOR EACH ROW WHEN NEW.updated_at IS NULL
+        BEGIN
+            UPDATE {table} SET updated_at = CURRENT_TIMESTAMP WHERE {match_new};
+        END
+    ''')
+    await conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_updated AFTER UPDATE ON {table}
+        FOR EACH ROW WHEN NEW.updated_at IS OLD.updated_at
+            AND (OLD.updated_at IS NULL OR OLD.updated_at <> CURRENT_TIMESTAMP)
+        BEGIN
+            UPDATE {table} SET updated_at = CURRENT_TIMESTAMP WHERE {match_new};
+        END
+    ''')
+    await conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_deleted AFTER DELETE ON {table}
+        FOR EACH ROW
+        BEGIN
+            INSERT INTO row_tombstones (table_name, row_key) VALUES ('{table}', json_array({old_key}));
+        END
+    ''')
+
+
+# ---------------- Миграции ----------------
+
+@migration(1, "базовая схема: пользователи, достижения, статистика, награды, дуэли")
+async def _base_schema(conn: aiosqlite.Connection):
+    # Таблица пользователей
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            level INTEGER DEFAULT 1,
+            xp INTEGER DEFAULT 0,
+            max_combo INTEGER DEFAULT 0,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            last_active DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    # Таблица достижений
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS achievements (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            achievement_id TEXT,
+            unlocked_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id),
+            UNIQUE(user_id, achievement_id)
+        )
+    """)
+
+    # Таблица статистики пользователей
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS user_stats (
+            user_id INTEGER PRIMARY KEY,
+            total_answers INTEGER DEFAULT 0,
+            correct_answers INTEGER DEFAULT 0,
+            total_combo INTEGER DEFAULT 0,
+            perfect_quizzes INTEGER DEFAULT 0,
+            categories_completed INTEGER DEFAULT 0,
+            last_activity DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    """)
+
+    # Таблица ежедневных наград
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS daily_rewards (
+            user_id INTEGER PRIMARY KEY,
+            last_reward_date DATE,
+            streak_count INTEGER DEFAULT 0,
+            total_rewards INTEGER DEFAULT 0,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    """)
+
+    # Таблица статистики по категориям
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS category_stats (
+            user_id INTEGER,
+            category TEXT,
+            total_answers INTEGER DEFAULT 0,
+            correct_answers INTEGER DEFAULT 0,
+            last_played DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, category),
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    """)
+
+    # Таблицы для дуэлей
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS duels (
+            duel_id TEXT PRIMARY KEY,
+            format_type TEXT,
+            team_a_players TEXT,  -- JSON список user_id
+            team_b_players TEXT,  -- JSON список user_id
+            winner_team TEXT,
+            team_a_score INTEGER DEFAULT 0,
+            team_b_score INTEGER DEFAULT 0,
+            category TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            finished_at DATETIME
+        )
+    ''')
+
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS duel_stats (
+            user_id INTEGER,
+            total_duels INTEGER DEFAULT 0,
+            wins INTEGER DEFAULT 0,
+            losses INTEGER DEFAULT 0,
+            total_score INTEGER DEFAULT 0,
+            average_score REAL DEFAULT 0,
+            favorite_format TEXT,
+            last_duel DATETIME,
+            PRIMARY KEY (user_id),
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    ''')
+
+    # Индексы
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_xp ON users (xp DESC)")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_achievements_user ON achievements (user_id)")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_daily_rewards_date ON daily_rewards (last_reward_date)")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_category_stats_user ON category_stats (user_id)")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_duels_created ON duels (created_at DESC)")
+
+
+@migration(2, "колонки users.created_at и users.last_active для старых баз")
+async def _users_activity_columns(conn: aiosqlite.Connection):
+    # ALTER TABLE ADD COLUMN не принимает DEFAULT CURRENT_TIMESTAMP
+    # ("Cannot add a column with non-constant default"), поэтому колонки
+    # добавляются без значения по умолчанию, а данные заполняет миграция 3.
+    # В новые строки значения пишет сам код (get_user, add_xp).
+    for column in ("created_at", "last_active"):
+        if not await column_exists(conn, "users", column):
+            await conn.execute(f"ALTER TABLE users ADD COLUMN {column} DATETIME")
+            logger.info("✅ Добавлена колонка %s в таблицу users", column)
+
+
+@migration(3, "заполнение users.created_at/last_active по истории активности", batched=True)
+async def _backfill_users_activity(conn: aiosqlite.Connection):
+    # Точная дата регистрации старых пользователей неизвестна - берем самое раннее
+    # известное событие (первое достижение или последняя активность).
+    # Без истории оставляем NULL, чтобы не записать их в "новые за сегодня".
+    updated = await update_in_batches(
+        conn, "users",
+        set_clause="""
+            created_at = COALESCE(
+                created_at,
+                MIN(
+                    COALESCE((SELECT MIN(a.unlocked_at) FROM achievements a WHERE a.user_id = users.user_id),
+                             (SELECT s.last_activity FROM user_stats s WHERE s.user_id = users.user_id)),
+                    COALESCE((SELECT s.last_activity FROM user_stats s WHERE s.user_id = users.user_id),
+                             (SELECT MIN(a.unlocked_at) FROM achievements a WHERE a.user_id = users.user_id))
+                )
+            ),
+            last_active = COALESCE(
+                last_active,
+                (SELECT s.last_activity FROM user_stats s WHERE s.user_id = users.user_id)
+            )
+        """,
+        where_clause="created_at IS NULL OR last_active IS NULL",
+    )
+    logger.info("✅ Заполнены даты активности для %d пользователей", updated)
+
+
+@migration(4, "таблица участников дуэлей duel_participants")
+async def _duel_participants(conn: aiosqlite.Connection):
+    # Одна строка на игрока в дуэли: история игрока ищется по индексу,
+    # а не LIKE по JSON-спискам команд. finished_at продублирован из duels,
+    # чтобы индекс (user_id, finished_at) сразу отдавал последние дуэли.
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS duel_participants (
+            duel_id TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            team TEXT NOT NULL,
+            score INTEGER,  -- NULL для дуэлей, перенесенных из JSON (личный счет не сохранялся)
+            response_ms INTEGER,  -- среднее время ответа, мс
+            finished_at DATETIME,
+            PRIMARY KEY (duel_id, user_id),
+            FOREIGN KEY (duel_id) REFERENCES duels (duel_id) ON DELETE CASCADE
+        ) WITHOUT ROWID
+    ''')
+    await conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_duel_participants_user
+        ON duel_participants (user_id, finished_at DESC)
+    ''')
+
+
+@migration(5, "перенос участников дуэлей из JSON-колонок в duel_participants", batched=True)
+async def _backfill_duel_participants(conn: aiosqlite.Connection):
+    # Пачки по rowid дуэлей; INSERT OR IGNORE делает повтор после сбоя безопасным
+    moved = 0
+    last_rowid = -(2 ** 63)
+    while True:
+        async with conn.execute(
+                "SELECT rowid FROM duels WHERE rowid > ? ORDER BY rowid LIMIT 1 OFFSET ?",
+                (last_rowid, MIGRATION_BATCH_SIZE - 1)
+        ) as cursor:
+            row = await cursor.fetchone()
+        upper = row[0] if row else 2 ** 63 - 1
+
+        await conn.execute("BEGIN")
+        try:
+            cursor = await conn.execute('''
+                INSERT OR IGNORE INTO duel_participants (duel_id, user_id, team, finished_at)
+                SELECT d.duel_id, CAST(p.value AS INTEGER), p.team, COALESCE(d.finished_at, d.created_at)
+                FROM duels d
+                JOIN (
+                    SELECT d2.rowid AS duel_rowid, j.value, 'team_a' AS team
+                    FROM duels d2, json_each(d2.team_a_players) j
+                    WHERE d2.rowid > ? AND d2.rowid <= ? AND json_valid(d2.team_a_players)
+                    UNION ALL
+                    SELECT d2.rowid, j.value, 'team_b'
+                    FROM duels d2, json_each(d2.team_b_players) j
+                    WHERE d2.rowid > ? AND d2.rowid <= ? AND json_valid(d2.team_b_players)
+                ) p ON p.duel_rowid = d.rowid
+            ''', (last_rowid, upper, last_rowid, upper))
+            moved += cursor.rowcount
+            await cursor.close()
+            await conn.commit()
+        except Exception:
+            await conn.rollback()
+            raise
+
+        if row is None:
+            break
+        last_rowid = upper
+
+    logger.info("✅ Перенесено участников дуэлей: %d", moved)
+
+
+@migration(6, "задания рассылок broadcast_jobs")
+async def _broadcast_jobs(conn: aiosqlite.Connection):
+    # cursor_user_id - все получатели с user_id <= курсора уже обработаны,
+    # после перезапуска рассылка продолжается с user_id > курсора
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS broadcast_jobs (
+            job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            text TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',  -- running / paused / done / cancelled
+            cursor_user_id INTEGER NOT NULL DEFAULT 0,
+            total INTEGER DEFAULT 0,
+            sent INTEGER DEFAULT 0,
+            failed INTEGER DEFAULT 0,
+            admin_chat_id INTEGER,
+            status_message_id INTEGER,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            finished_at DATETIME
+        )
+    ''')
+
+
+@migration(7, "статус доставки сообщений users.delivery_status")
+async def _users_delivery_status(conn: aiosqlite.Connection):
+    # active - сообщения доходят; blocked - бот заблокирован или аккаунт удален;
+    # not_found - чат не найден. Недоступные пропускаются рассылками до /start.
+    if not await column_exists(conn, "users", "delivery_status"):
+        await conn.execute("ALTER TABLE users ADD COLUMN delivery_status TEXT NOT NULL DEFAULT 'active'")
+    if not await column_exists(conn, "users", "delivery_failed_at"):
+        await conn.execute("ALTER TABLE users ADD COLUMN delivery_failed_at DATETIME")
+
+    # Частичные индексы: рассылка идет по idx_users_reachable (только user_id,
+    # без чтения строк users), статистика по недоступным - по маленькому idx_users_unreachable.
+    # Условия должны дословно совпадать с REACHABLE_SQL в db.py, иначе SQLite их не использует.
+    await conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_users_reachable ON users(user_id) WHERE delivery_status = 'active'"
+    )
+    await conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_users_unreachable ON users(delivery_status) "
+        "WHERE delivery_status <> 'active'"
+    )
+
+    # Сколько получателей рассылки оказались недоступны (входят в failed)
+    if not await column_exists(conn, "broadcast_jobs", "unreachable"):
+        await conn.execute("ALTER TABLE broadcast_jobs ADD COLUMN unreachable INTEGER DEFAULT 0")
+
+
+@migration(8, "updated_at и журнал удалений для инкрементальных бэкапов")
+async def _change_tracking(conn: aiosqlite.Connection):
+    # Таблица -> ключ строки. Триггеры проставляют updated_at при вставке и
+    # изменении (если код не задал его сам), удаления пишутся в row_tombstones.
+    # Время - CURRENT_TIMESTAMP (UTC, точность до секунды): экспорт изменений
+    # берет окно с запасом, поэтому повторное выставление в ту же секунду пропускаем.
+    tracked = {
+        "users": ("user_id",),
+        "user_stats": ("user_id",),
+        "category_stats": ("user_id", "category"),
+        "daily_rewards": ("user_id",),
+        "achievements": ("user_id", "achievement_id"),
+        "duel_stats": ("user_id",),
+        "duels": ("duel_id",),
+        "duel_participants": ("duel_id", "user_id"),
+    }
+
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS row_tombstones (
+            table_name TEXT NOT NULL,
+            row_key TEXT NOT NULL,  -- JSON-массив значений ключа
+            deleted_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_row_tombstones_deleted ON row_tombstones (deleted_at)")
+
+    for table, key in tracked.items():
+        await track_changes(conn, table, key)
+
+
+@migration(9, "покрывающие индексы для статистики админ-панели")
+async def _stats_indexes(conn: aiosqlite.Connection):
+    # Активные за 1/7/30 дней и суммы ответов считаются одним проходом по индексу,
+    # без чтения строк user_stats; новые пользователи - диапазоном по created_at
+    await conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_user_stats_activity "
+        "ON user_stats (last_activity, total_answers, correct_answers)"
+    )
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_created ON users (created_at)")
+
+
+@migration(10, "журнал ответов answer_events: реестр разделов и представление")
+async def _answer_events(conn: aiosqlite.Connection):
+    # Сами разделы answer_events_ГГГГММДД создаются при записи событий (db.flush_answer_events)
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS answer_event_partitions (
+            name TEXT PRIMARY KEY,
+            starts_at INTEGER NOT NULL,
+            ends_at INTEGER NOT NULL
+        )
+    ''')
+    await conn.execute("DROP VIEW IF EXISTS answer_events")
+    await conn.execute(view_sql([]))
+
+
+@migration(11, "дневные агрегаты для аналитики: daily_rollups, daily_question_rollups")
+async def _daily_rollups(conn: aiosqlite.Connection):
+    # Дни - локальная дата бота, как у ежедневных наград
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS daily_rollups (
+            day TEXT PRIMARY KEY,
+            new_users INTEGER NOT NULL DEFAULT 0,
+            dau INTEGER NOT NULL DEFAULT 0,
+            answers INTEGER NOT NULL DEFAULT 0,
+            correct INTEGER NOT NULL DEFAULT 0,
+            sessions INTEGER NOT NULL DEFAULT 0,
+            session_seconds INTEGER NOT NULL DEFAULT 0,
+            duels INTEGER NOT NULL DEFAULT 0,
+            rewards INTEGER NOT NULL DEFAULT 0,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS daily_question_rollups (
+            day TEXT NOT NULL,
+            question_id INTEGER NOT NULL,
+            answers INTEGER NOT NULL DEFAULT 0,
+            correct INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, question_id)
+        ) WITHOUT ROWID
+    ''')
+
+    # Разделы журнала ответов, созданные до появления индекса по времени
+    async with conn.execute("SELECT name FROM answer_event_partitions") as cursor:
+        partitions = [row[0] for row in await cursor.fetchall()]
+    for name in partitions:
+        for statement in partition_ts_index_ddl(name):
+            await conn.execute(statement)
+
+
+@migration(12, "поиск пользователей: триграммный индекс FTS5 users_search и индекс имен")
+async def _users_search(conn: aiosqlite.Connection):
+    # Точное совпадение @username и поиск по префиксу без учета регистра
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_username ON users (username COLLATE NOCASE)")
+
+    # Триграммный токенизатор есть в SQLite 3.34+ со сборкой FTS5; без него
+    # db.search_users ищет по username LIKE полным просмотром
+    try:
+        await conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS users_search USING fts5(username, tokenize='trigram')")
+    except aiosqlite.OperationalError as e:
+        logger.warning("⚠️ FTS5 trigram недоступен, поиск пользователей будет без индекса: %s", e)
+        return
+
+    # Обычная (не external content) таблица: INSERT OR REPLACE в users без
+    # срабатывания триггера удаления не оставляет в индексе устаревших имен
+    await conn.execute('''
+        INSERT OR REPLACE INTO users_search (rowid, username)
+        SELECT user_id, username FROM users WHERE username <> ''
+    ''')
+    await conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_users_search_inserted AFTER INSERT ON users
+        FOR EACH ROW WHEN NEW.username <> ''
+        BEGIN
+            INSERT OR REPLACE INTO users_search (rowid, username) VALUES (NEW.user_id, NEW.username);
+        END
+    ''')
+    await conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_users_search_renamed AFTER UPDATE OF username ON users
+        FOR EACH ROW
+        BEGIN
+            DELETE FROM users_search WHERE rowid = OLD.user_id;
+            INSERT INTO users_search (rowid, username)
+            SELECT NEW.user_id, NEW.username WHERE NEW.username <> '';
+        END
+    ''')
+    await conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_users_search_deleted AFTER DELETE ON users
+        FOR EACH ROW
+        BEGIN
+            DELETE FROM users_search WHERE rowid = OLD.user_id;
+        END
+    ''')
+
+
+@migration(13, "составные индексы для постраничного просмотра пользователей")
+async def _browse_indexes(conn: aiosqlite.Connection):
+    # Keyset-курсор (ключ, user_id): следующая страница - поиск по индексу с этой позиции.
+    # idx_users_xp (xp DESC) при равном xp упорядочен по user_id в другую сторону - заменяем
+    await conn.execute("DROP INDEX IF EXISTS idx_users_xp")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_xp_id ON users (xp, user_id)")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_level_id ON users (level, user_id)")
+    # У пользователей до миграций created_at/last_activity бывают NULL: сравнение (ключ, user_id)
+    # с NULL не истинно, поэтому ключ - COALESCE(колонка, ''), индекс по тому же выражению
+    # (см. db.USER_BROWSE_ORDERS)
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_created_id ON users (COALESCE(created_at, ''), user_id)")
+    await conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_user_stats_last_activity_id "
+        "ON user_stats (COALESCE(last_activity, ''), user_id)"
+    )
+
+
+@migration(14, "банк вопросов: таблицы question_categories и questions, начальное заполнение")
+async def _question_bank(conn: aiosqlite.Connection):
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS question_categories (
+            category_id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
+        )
+    ''')
+    # AUTOINCREMENT: номер удаленного вопроса не достанется новому, на question_id
+    # ссылаются журнал ответов и агрегаты. Удаление - is_active = 0
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS questions (
+            question_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            category_id INTEGER NOT NULL REFERENCES question_categories (category_id),
+            difficulty TEXT NOT NULL,
+            question TEXT NOT NULL,
+            options TEXT NOT NULL,  -- JSON-массив вариантов ответа
+            answer_index INTEGER NOT NULL,  -- номер правильного варианта в options (с 0)
+            is_active INTEGER NOT NULL DEFAULT 1,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    await conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_questions_category
+        ON questions (category_id, difficulty) WHERE is_active = 1
+    ''')
+    for table, key in (("question_categories", ("category_id",)), ("questions", ("question_id",))):
+        await track_changes(conn, table, key)
+
+    # questions.py - только источник начального заполнения. Номера категорий и
+    # вопросов совпадают с прежними позиционными (журнал ответов, миграция 10)
+    from questions import QUESTIONS_BY_CATEGORY
+
+    question_id = 0
+    for category_id, (category, questions) in enumerate(QUESTIONS_BY_CATEGORY.items(), 1):
+        await conn.execute(
+            "INSERT OR IGNORE INTO question_categories (category_id, name) VALUES (?, ?)", (category_id, category)
+        )
+        rows = []
+        for question in questions:
+            question_id += 1
+            rows.append((question_id, category_id, question.get("difficulty", "средний"), question["question"],
+                         json.dumps(question["options"], ensure_ascii=False),
+                         question["options"].index(question["answer"])))
+        await conn.executemany('''
+            INSERT OR IGNORE INTO questions (question_id, category_id, difficulty, question, options, answer_index)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', rows)
+
+
+@migration(15, "история заданных вопросов user_question_history (битовые маски)")
+async def _question_history(conn: aiosqlite.Connection):
+    # asked - битовая маска по question_id (little-endian), см. question_history.py
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_question_history (
+            user_id INTEGER PRIMARY KEY,
+            asked BLOB NOT NULL
+        )
+    ''')
+    await track_changes(conn, "user_question_history", ("user_id",))
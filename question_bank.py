@@ -0,0 +1,144 @@
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from db import db
+
+logger = logging.getLogger(__name__)
+
+
+class QuestionBank:
+    """Индекс банка вопросов в памяти.
+
+    Вопросы хранятся в таблице questions (миграция 14) и загружаются один раз
+    при старте (load). Викторина, дуэли и админ-панель читают только отсюда;
+    правки админа пишутся в БД и сразу применяются к индексу.
+
+    Вопрос - словарь {"question_id", "category", "category_id", "difficulty",
+    "question", "options", "answer", "is_active"}, где answer - текст
+    правильного варианта.
+
+    Индекс выборки - неизменяемые кортежи question_id для каждой пары
+    (категория, сложность), включая объединения "random" по любой из осей.
+    Строится при загрузке и после правки; выбор вопроса не перебирает банк.
+    """
+
+    def __init__(self):
+        self._questions: Dict[int, Dict] = {}  # question_id -> вопрос, включая удаленные
+        self._categories: Dict[str, int] = {}  # название -> category_id
+        self._active: Tuple[Dict, ...] = ()
+        self._by_category: Dict[str, Tuple[Dict, ...]] = {}
+        self._ids: Dict[Tuple[str, str], Tuple[int, ...]] = {}  # (категория, сложность) -> question_id
+        self._masks: Dict[str, int] = {}  # категория -> битовая маска ее question_id (для истории вопросов)
+        self.version = 0  # Растет при каждой перестройке индекса (мешки question_sampler перемешиваются заново)
+
+    def __len__(self) -> int:
+        return len(self._active)
+
+    async def load(self):
+        """Загружает банк из БД (при старте бота)"""
+        data = await db.get_question_bank()
+        self._categories = {name: category_id for category_id, name in data["categories"].items()}
+        names = data["categories"]
+        self._questions = {}
+        for row in data["questions"]:
+            self._questions[row["question_id"]] = {
+                "question_id": row["question_id"],
+                "category": names.get(row["category_id"], "unknown"),
+                "category_id": row["category_id"],
+                "difficulty": row["difficulty"],
+                "question": row["question"],
+                "options": row["options"],
+                "answer": row["options"][row["answer_index"]],
+                "is_active": bool(row["is_active"]),
+            }
+        self._reindex()
+        logger.info("📚 Банк вопросов загружен: %d вопросов, %d категорий", len(self), len(self._categories))
+
+    def _reindex(self):
+        active = [question for question in self._questions.values() if question["is_active"]]
+        active.sort(key=lambda question: question["question_id"])
+        by_category: Dict[str, List[Dict]] = {name: [] for name in self._categories}
+        ids: Dict[Tuple[str, str], List[int]] = {}
+        for question in active:
+            by_category.setdefault(question["category"], []).append(question)
+            for category in (question["category"], "random"):
+                for difficulty in (question["difficulty"], "random"):
+                    ids.setdefault((category, difficulty), []).append(question["question_id"])
+        self._active = tuple(active)
+        self._by_category = {name: tuple(questions) for name, questions in by_category.items()}
+        self._ids = {key: tuple(question_ids) for key, question_ids in ids.items()}
+        self._masks = {
+            category: sum(1 << question_id for question_id in question_ids)
+            for (category, difficulty), question_ids in self._ids.items() if difficulty == "random"
+        }
+        self.version += 1
+
+    def get(self, question_id: int) -> Optional[Dict]:
+        """Вопрос по question_id, в том числе удаленный (None, если такого нет)"""
+        return self._questions.get(question_id)
+
+    def all(self) -> Tuple[Dict, ...]:
+        """Все действующие вопросы по возрастанию question_id"""
+        return self._active
+
+    def categories(self) -> Dict[str, int]:
+        """Категории: название -> category_id"""
+        return dict(self._categories)
+
+    def by_category(self, category: str) -> Tuple[Dict, ...]:
+        """Действующие вопросы категории ("random" - все)"""
+        if category == "random":
+            return self._active
+        return self._by_category.get(category, ())
+
+    def question_ids(self, category: str = "random", difficulty: str = "random") -> Tuple[int, ...]:
+        """Номера действующих вопросов категории и сложности ("random" - любые).
+
+        Готовый кортеж из индекса, без копирования.
+        """
+        return self._ids.get((category, difficulty), ())
+
+    def category_mask(self, category: str = "random") -> int:
+        """Битовая маска question_id действующих вопросов категории ("random" - всех)"""
+        return self._masks.get(category, 0)
+
+    def category_stats(self) -> Dict[str, int]:
+        """Количество действующих вопросов по категориям"""
+        return {name: len(questions) for name, questions in self._by_category.items()}
+
+    async def add(self, category: str, difficulty: str, question: str, options: List[str],
+                  answer_index: int) -> Dict:
+        """Сохраняет новый вопрос в БД и добавляет в индекс"""
+        category_id = self._categories[category]
+        question_id = await db.add_question(category_id, difficulty, question, options, answer_index)
+        self._questions[question_id] = {
+            "question_id": question_id,
+            "category": category,
+            "category_id": category_id,
+            "difficulty": difficulty,
+            "question": question,
+            "options": list(options),
+            "answer": options[answer_index],
+            "is_active": True,
+        }
+        self._reindex()
+        return self._questions[question_id]
+
+    async def delete(self, question_id: int) -> Optional[Dict]:
+        """Удаляет вопрос из банка; возвращает удаленный вопрос или None"""
+        question = self._questions.get(question_id)
+        if not question or not question["is_active"]:
+            return None
+        await db.delete_question(question_id)
+        question["is_active"] = False
+        self._reindex()
+        return question
+
+
+def question_ref(question: Dict) -> Tuple[int, int]:
+    """Возвращает (question_id, category_id) вопроса для журнала ответов"""
+    return question.get("question_id", 0), question.get("category_id", 0)
+
+
+# Глобальный экземпляр
+question_bank = QuestionBank()
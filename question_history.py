@@ -0,0 +1,109 @@
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+
+def bits_to_blob(bits: int) -> bytes:
+    """Битовая маска -> BLOB (little-endian, бит n - question_id n)"""
+    return bits.to_bytes((bits.bit_length() + 7) // 8, "little")
+
+
+def blob_to_bits(blob: Optional[bytes]) -> int:
+    return int.from_bytes(blob, "little") if blob else 0
+
+
+class AskedQuestions:
+    """История заданных вопросов: битовая маска по question_id на пользователя.
+
+    Бит question_id установлен - вопрос уже задавался. Номера вопросов
+    постоянные (банк вопросов, миграция 14), поэтому история переживает
+    перезапуск: маски хранятся в user_question_history.asked (BLOB),
+    загружаются при первом обращении (db.load_asked_questions) и пишутся
+    обратно пачкой (db.flush_asked_questions).
+
+    В памяти держится не больше capacity масок (LRU); вытесняются только
+    уже записанные в БД.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._bits: "OrderedDict[int, int]" = OrderedDict()
+        self._dirty: Set[int] = set()
+        # Маски, которые сейчас записываются в БД: их нельзя вытеснять до конца записи
+        self._inflight: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._bits)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._bits
+
+    def put(self, user_id: int, bits: int):
+        """Кладет загруженную из БД маску (если ее еще нет в памяти)"""
+        if user_id not in self._bits:
+            self._bits[user_id] = bits
+            self._evict()
+
+    def get(self, user_id: int) -> int:
+        bits = self._bits.get(user_id, 0)
+        if user_id in self._bits:
+            self._bits.move_to_end(user_id)
+        return bits
+
+    def is_asked(self, user_id: int, question_id: int) -> bool:
+        return bool(self._bits.get(user_id, 0) >> question_id & 1)
+
+    def mark(self, user_id: int, question_id: int):
+        """Отмечает вопрос заданным (O(1), без обращения к БД).
+
+        Маска пользователя должна быть загружена: при записи она заменяет сохраненную.
+        """
+        self._bits[user_id] = self._bits.get(user_id, 0) | 1 << question_id
+        self._bits.move_to_end(user_id)
+        self._dirty.add(user_id)
+        self._evict()
+
+    def reset(self, user_id: int, mask: int):
+        """Снимает биты mask (маска категории из question_bank.category_mask)"""
+        bits = self._bits.get(user_id, 0)
+        if bits & mask:
+            self._bits[user_id] = bits & ~mask
+            self._dirty.add(user_id)
+
+    def discard(self, user_id: int):
+        """Забывает маску пользователя без записи (данные удалены в БД)"""
+        self._bits.pop(user_id, None)
+        self._dirty.discard(user_id)
+
+    def clear(self):
+        self._bits.clear()
+        self._dirty.clear()
+
+    def drain(self) -> List[Tuple[int, bytes]]:
+        """Забирает измененные маски для записи: [(user_id, blob)]"""
+        self._inflight = {user_id: self._bits[user_id] for user_id in self._dirty if user_id in self._bits}
+        self._dirty = set()
+        return [(user_id, bits_to_blob(bits)) for user_id, bits in self._inflight.items()]
+
+    def written(self):
+        """Маски записаны в БД - их снова можно вытеснять"""
+        self._inflight = {}
+        self._evict()
+
+    def restore(self, rows: Iterable[Tuple[int, bytes]]):
+        """Помечает маски измененными после неудачной записи"""
+        self._dirty.update(user_id for user_id, _ in rows if user_id in self._bits)
+        self._inflight = {}
+
+    def _evict(self):
+        excess = len(self._bits) - self.capacity
+        if excess <= 0:
+            return
+        # От давно не использованных; несохраненные пропускаем
+        victims = []
+        for user_id in self._bits:
+            if user_id not in self._dirty and user_id not in self._inflight:
+                victims.append(user_id)
+                if len(victims) == excess:
+                    break
+        for user_id in victims:
+            del self._bits[user_id]
@@ -0,0 +1,103 @@
+import os
+import random
+import secrets
+from array import array
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional, Tuple
+
+from question_bank import QuestionBank, question_bank
+
+# Зерно перестановок: задайте, чтобы порядок вопросов воспроизводился (тесты, отладка)
+QUESTION_SAMPLER_SEED = os.getenv("QUESTION_SAMPLER_SEED") or secrets.token_hex(8)
+# Для скольких владельцев (игроков и дуэлей) держать мешки в памяти
+QUESTION_SAMPLER_CACHE = int(os.getenv("QUESTION_SAMPLER_CACHE", "50000"))
+
+
+class ShuffleBag:
+    """Перестановка question_id одной пары (категория, сложность) и курсор в ней"""
+
+    __slots__ = ("order", "cursor", "round", "version")
+
+    def __init__(self, version: int):
+        self.order = array("I")
+        self.cursor = 0
+        self.round = 0
+        self.version = version
+
+
+class QuestionSampler:
+    """Выбор вопросов без повторов: "мешок" перемешанных question_id.
+
+    Для каждого владельца (user_id игрока или duel_id дуэли) и пары
+    (категория, сложность) при первом обращении создается перестановка
+    вопросов из индекса банка; draw() отдает следующий вопрос за O(1)
+    (амортизированно, с учетом пропусков). Когда мешок кончился, он
+    перемешивается заново. Перестановка зависит только от seed, владельца,
+    пары и номера круга, поэтому при заданном seed порядок воспроизводим.
+
+    Мешки не сохраняются: после правки банка или вытеснения из памяти
+    мешок строится заново, а повторы у игроков отсекает их история
+    заданных вопросов (skip).
+    """
+
+    def __init__(self, bank: QuestionBank, seed: str = QUESTION_SAMPLER_SEED,
+                 capacity: int = QUESTION_SAMPLER_CACHE):
+        self.bank = bank
+        self.seed = seed
+        self.capacity = capacity
+        self._bags: "OrderedDict[Hashable, Dict[Tuple[str, str], ShuffleBag]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._bags)
+
+    def _shuffle(self, bag: ShuffleBag, owner: Hashable, category: str, difficulty: str):
+        question_ids = list(self.bank.question_ids(category, difficulty))
+        # Строковое зерно хэшируется детерминированно (в отличие от hash())
+        random.Random(f"{self.seed}:{owner}:{category}:{difficulty}:{bag.round}").shuffle(question_ids)
+        bag.order = array("I", question_ids)
+        bag.cursor = 0
+        bag.round += 1
+
+    def _bag(self, owner: Hashable, category: str, difficulty: str) -> ShuffleBag:
+        bags = self._bags.get(owner)
+        if bags is None:
+            bags = self._bags[owner] = {}
+            if len(self._bags) > self.capacity:
+                self._bags.popitem(last=False)
+        else:
+            self._bags.move_to_end(owner)
+
+        bag = bags.get((category, difficulty))
+        if bag is None or bag.version != self.bank.version:
+            # Новый мешок или банк изменился с момента перемешивания
+            bag = bags[(category, difficulty)] = ShuffleBag(self.bank.version)
+            self._shuffle(bag, owner, category, difficulty)
+        return bag
+
+    def draw(self, owner: Hashable, category: str, difficulty: str = "random",
+             skip: Optional[Callable[[int], bool]] = None) -> Optional[int]:
+        """Следующий question_id из мешка владельца.
+
+        Вопросы, для которых skip(question_id) истинно, пропускаются. None -
+        вопросов нет или все в мешке пропущены (например, вся категория уже
+        задана игроку).
+        """
+        bag = self._bag(owner, category, difficulty)
+        # Остаток текущего круга, затем не больше одного нового круга
+        for _ in range(2):
+            order = bag.order
+            while bag.cursor < len(order):
+                question_id = order[bag.cursor]
+                bag.cursor += 1
+                if skip is None or not skip(question_id):
+                    return question_id
+            self._shuffle(bag, owner, category, difficulty)
+        return None
+
+    def discard(self, owner: Hashable):
+        """Забывает мешки владельца (дуэль закончилась)"""
+        self._bags.pop(owner, None)
+
+
+# Глобальный экземпляр
+question_sampler = QuestionSampler(question_bank)
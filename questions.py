@@ -1,7 +1,6 @@
-import random
-from typing import Dict, List
-
-# Вопросы по категориям (по 50 вопросов в каждой)
+# Начальное наполнение банка вопросов: миграция 14 один раз переносит эти
+# вопросы в таблицу questions, дальше бот читает их из БД (question_bank.py).
+# Порядок категорий и вопросов задает их номера - не переставлять.
 QUESTIONS_BY_CATEGORY = {
     "история": [
         {
@@ -1572,49 +1571,3 @@ DIFFICULTY_SETTINGS = {
     "сложный": {"xp": 40, "color": "🔴", "emoji": "🔴"}
 }
 
-
-def get_all_categories() -> List[str]:
-    """Возвращает список всех категорий"""
-    return list(QUESTIONS_BY_CATEGORY.keys())
-
-
-def get_questions_by_category(category: str) -> List[Dict]:
-    """Возвращает вопросы для указанной категории"""
-    return QUESTIONS_BY_CATEGORY.get(category, [])
-
-
-def get_random_question(category: str = None) -> Dict:
-    """Возвращает случайный вопрос (из всех или определенной категории)"""
-    if category and category in QUESTIONS_BY_CATEGORY:
-        questions = QUESTIONS_BY_CATEGORY[category]
-    else:
-        # Собираем все вопросы из всех категорий
-        all_questions = []
-        for cat_questions in QUESTIONS_BY_CATEGORY.values():
-            all_questions.extend(cat_questions)
-        questions = all_questions
-
-    return random.choice(questions) if questions else None
-
-
-def get_category_stats() -> Dict[str, int]:
-    """Возвращает статистику по категориям"""
-    stats = {}
-    for category, questions in QUESTIONS_BY_CATEGORY.items():
-        stats[category] = len(questions)
-    return stats
-
-
-# Для обратной совместимости - все вопросы в одном списке
-ALL_QUESTIONS = []
-for category_questions in QUESTIONS_BY_CATEGORY.values():
-    ALL_QUESTIONS.extend(category_questions)
-
-
-# Старые функции для совместимости
-def get_questions():
-    """Для обратной совместимости"""
-    return ALL_QUESTIONS
-
-
-QUESTIONS = ALL_QUESTIONS
\ No newline at end of file
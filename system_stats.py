@@ -0,0 +1,78 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+
+from db import db
+
+logger = logging.getLogger(__name__)
+
+# Через сколько секунд снимок статистики считается устаревшим
+STATS_SNAPSHOT_TTL = float(os.getenv("STATS_SNAPSHOT_TTL", "60"))
+
+
+class SystemStatsCache:
+    """Кэшированный снимок системной статистики для админ-панели.
+
+    Снимок пересчитывается фоновой задачей раз в STATS_SNAPSHOT_TTL секунд
+    (db.get_system_stats - один совмещенный запрос). get() сразу отдает
+    готовый снимок, даже устаревший, и при необходимости запускает пересчет
+    в фоне; ждать приходится только при самом первом обращении.
+    """
+
+    def __init__(self, ttl: float = STATS_SNAPSHOT_TTL):
+        self.ttl = ttl
+        self._snapshot: Optional[Dict[str, Any]] = None
+        self._computed_at = 0.0
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    @property
+    def age(self) -> float:
+        """Возраст снимка в секундах"""
+        return time.monotonic() - self._computed_at if self._snapshot is not None else 0.0
+
+    async def _compute(self):
+        started = time.perf_counter()
+        try:
+            self._snapshot = await db.get_system_stats()
+        except Exception as e:
+            # Остается предыдущий снимок, следующий пересчет попробует снова
+            logger.error("❌ Ошибка пересчета статистики: %s", e)
+            return
+        self._computed_at = time.monotonic()
+        logger.debug("📊 Снимок статистики пересчитан за %.3f сек", time.perf_counter() - started)
+
+    def refresh(self) -> asyncio.Task:
+        """Запускает пересчет снимка; параллельные вызовы ждут один и тот же пересчет"""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._compute())
+        return self._refresh_task
+
+    async def get(self) -> Dict[str, Any]:
+        """Возвращает снимок статистики; ключ "age" - сколько секунд назад он посчитан"""
+        if self._snapshot is None:
+            await self.refresh()
+            if self._snapshot is None:
+                raise RuntimeError("статистика недоступна")
+        elif self.age >= self.ttl:
+            self.refresh()
+        return {**self._snapshot, "age": int(self.age)}
+
+    async def refresh_loop(self):
+        """Фоновый пересчет снимка раз в ttl секунд"""
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.ttl)
+
+
+def format_age(seconds: int) -> str:
+    if seconds < 60:
+        return f"{seconds} сек назад"
+    if seconds < 3600:
+        return f"{seconds // 60} мин назад"
+    return f"{seconds // 3600} ч назад"
+
+
+# Глобальный экземпляр
+system_stats = SystemStatsCache()
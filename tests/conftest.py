@@ -0,0 +1,38 @@
+import asyncio
+import inspect
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import Database  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def event_loop():
+    """Цикл событий теста: в нем выполняются async-тесты и фикстуры с базой"""
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture
+def db(tmp_path, event_loop):
+    """Файловая база во временном каталоге (WAL, пул читателей); закрывается после теста"""
+    database = Database(str(tmp_path / "test.db"))
+    event_loop.run_until_complete(database.connect())
+    yield database
+    event_loop.run_until_complete(database.close())
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_pyfunc_call(pyfuncitem):
+    """Запускает async def тесты в цикле фикстуры event_loop"""
+    if not inspect.iscoroutinefunction(pyfuncitem.obj):
+        return None
+    loop = pyfuncitem.funcargs["event_loop"]
+    arguments = {name: pyfuncitem.funcargs[name] for name in pyfuncitem._fixtureinfo.argnames}
+    loop.run_until_complete(pyfuncitem.obj(**arguments))
+    return True
@@ -0,0 +1,45 @@
+import gzip
+import json
+import sqlite3
+
+import pytest
+
+from backup import _apply_delta
+
+
+def _write_delta(path, records):
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+
+def _database():
+    conn = sqlite3.connect(":memory:", isolation_level=None)
+    conn.execute("CREATE TABLE users (user_id INTEGER PRIMARY KEY, xp INTEGER)")
+    conn.execute("INSERT INTO users VALUES (1, 10), (2, 20)")
+    return conn
+
+
+def test_apply_delta_upserts_and_deletes(tmp_path):
+    path = str(tmp_path / "delta.jsonl.gz")
+    _write_delta(path, [
+        {"table": "users", "columns": ["user_id", "xp"]},
+        [1, 15],
+        [3, 30],
+        {"table": "users", "deleted": ["user_id"]},
+        [2],
+    ])
+    conn = _database()
+
+    assert _apply_delta(conn, path) == {"rows": 2, "deleted": 1}
+    assert conn.execute("SELECT user_id, xp FROM users ORDER BY user_id").fetchall() == [(1, 15), (3, 30)]
+
+
+def test_apply_delta_rejects_row_before_header(tmp_path):
+    path = str(tmp_path / "delta.jsonl.gz")
+    _write_delta(path, [[1, 15], {"table": "users", "columns": ["user_id", "xp"]}])
+    conn = _database()
+
+    with pytest.raises(ValueError):
+        _apply_delta(conn, path)
+    assert conn.execute("SELECT user_id, xp FROM users ORDER BY user_id").fetchall() == [(1, 10), (2, 20)]
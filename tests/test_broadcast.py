@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("aiogram")
+
+import broadcast  # noqa: E402
+from broadcast import BroadcastManager, ChatRateLimiter, TokenBucket  # noqa: E402
+
+
+class _Bot:
+    """Бот, который "отправляет" сообщения только после открытия gate"""
+
+    def __init__(self):
+        self.gate = asyncio.Event()
+        self.delivered = []
+
+    async def send_message(self, chat_id: int, text: str):
+        await self.gate.wait()
+        self.delivered.append(chat_id)
+
+
+@pytest.fixture
+def manager(db, monkeypatch):
+    monkeypatch.setattr(broadcast, "db", db)
+    manager = BroadcastManager()
+    manager.bucket = TokenBucket(rate=100000)
+    manager.chat_limiter = ChatRateLimiter(interval=0)
+    return manager
+
+
+async def test_pause_and_resume_deliver_to_every_user(db, manager):
+    users = list(range(1, 101))
+    async with db._writing() as conn:
+        await conn.executemany("INSERT INTO users (user_id, username) VALUES (?, ?)",
+                               [(user_id, f"user{user_id}") for user_id in users])
+    job_id = await db.create_broadcast_job("привет", len(users), admin_chat_id=0)
+    bot = _Bot()
+
+    manager._launch(bot, job_id)
+    await asyncio.sleep(0.1)  # отправки заняли все воркеры, очередь заполнена
+    pause = asyncio.create_task(manager.pause(job_id))
+    await asyncio.sleep(0)
+    bot.gate.set()
+    await pause
+
+    job = await db.get_broadcast_job(job_id)
+    assert job["status"] == "paused"
+    # Курсор не обгоняет неотправленных: все до него включительно получили сообщение
+    assert set(range(1, job["cursor_user_id"] + 1)) <= set(bot.delivered)
+    assert len(set(bot.delivered)) < len(users)
+
+    assert await manager.resume(bot, job_id)
+    await asyncio.wait_for(asyncio.gather(*manager._tasks.values()), timeout=10)
+
+    job = await db.get_broadcast_job(job_id)
+    assert job["status"] == "done"
+    assert set(bot.delivered) == set(users)
@@ -0,0 +1,51 @@
+from counters import StatsCounters
+
+
+def test_pending_totals_include_inflight_and_new_deltas():
+    counters = StatsCounters()
+    counters.add_answer(1, "наука", True)
+    counters.add_answer(1, "история", False)
+    counters.drain()  # эти дельты сейчас записываются в БД
+    counters.add_answer(1, "наука", True)
+
+    assert counters.pending_totals(1) == (3, 2)
+    assert {category: c[:2] for category, c in counters.pending_categories(1).items()} == {
+        "наука": [2, 2], "история": [1, 0],
+    }
+
+    counters.categories_written()
+    counters.totals_written()
+    assert counters.pending_totals(1) == (1, 1)
+
+
+def test_restore_returns_failed_deltas_for_next_flush():
+    counters = StatsCounters()
+    counters.add_answer(1, "наука", True)
+    category_rows, total_rows = counters.drain()
+    counters.add_answer(1, "наука", False)
+
+    counters.restore(category_rows, total_rows)
+
+    assert counters.pending_totals(1) == (2, 1)
+    category_rows, total_rows = counters.drain()
+    assert [row[:4] for row in category_rows] == [(1, "наука", 2, 1)]
+    assert [row[:3] for row in total_rows] == [(1, 2, 1)]
+
+
+async def test_user_stats_merge_unflushed_answers(db):
+    await db.get_user(1, "alice")
+    db.record_answer(1, "наука", True)
+    db.record_answer(1, "наука", False)
+
+    stats = await db.get_user_stats(1)
+    assert (stats["total_answers"], stats["correct_answers"]) == (2, 1)
+
+    await db.flush_counters()
+    db.record_answer(1, "история", True)
+
+    stats = await db.get_user_stats(1)
+    assert (stats["total_answers"], stats["correct_answers"]) == (3, 2)
+    categories = await db.get_user_category_stats(1)
+    assert {name: (c["total_answers"], c["correct_answers"]) for name, c in categories.items()} == {
+        "наука": (2, 1), "история": (1, 1),
+    }
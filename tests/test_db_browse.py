@@ -0,0 +1,34 @@
+import pytest
+
+
+async def _pages(db, order: str, limit: int):
+    """Все страницы списка вперед, затем назад от последней"""
+    forward, page = [], await db.browse_users(order, limit=limit)
+    forward.append(page)
+    while page["has_next"]:
+        page = await db.browse_users(order, after=page["last"], limit=limit)
+        forward.append(page)
+    backward = [page]
+    while page["has_prev"]:
+        page = await db.browse_users(order, before=page["first"], limit=limit)
+        backward.append(page)
+    return forward, backward[::-1]
+
+
+@pytest.mark.parametrize("order", ["created", "activity"])
+async def test_browse_users_keeps_rows_with_null_keys(db, order):
+    async with db._writing() as conn:
+        for user_id in range(1, 8):
+            # Пользователи "до миграций": время не заполнено
+            stamp = None if user_id % 2 else f"2024-01-0{user_id} 12:00:00"
+            await conn.execute("INSERT INTO users (user_id, username, created_at) VALUES (?, ?, ?)",
+                               (user_id, f"user{user_id}", stamp))
+            await conn.execute("INSERT INTO user_stats (user_id, last_activity) VALUES (?, ?)",
+                               (user_id, stamp))
+
+    forward, backward = await _pages(db, order, limit=2)
+
+    ids = [[user["user_id"] for user in page["users"]] for page in forward]
+    assert ids == [[6, 4], [2, 7], [5, 3], [1]]
+    assert [[user["user_id"] for user in page["users"]] for page in backward] == ids
+
@@ -0,0 +1,18 @@
+async def test_bulk_reset_progress_clears_question_history(db):
+    async with db._writing() as conn:
+        for user_id in (1, 2):
+            await conn.execute("INSERT INTO users (user_id, username) VALUES (?, ?)", (user_id, f"user{user_id}"))
+    for user_id in (1, 2):
+        await db.load_asked_questions(user_id)
+        db.asked_questions.mark(user_id, 5)
+    await db.flush_asked_questions()
+
+    assert await db.bulk_reset_progress({"user_ids": [1]}) == 1
+
+    assert 1 not in db.asked_questions
+    async with db._reading() as conn:
+        async with conn.execute("SELECT user_id FROM user_question_history ORDER BY user_id") as cursor:
+            assert [row[0] for row in await cursor.fetchall()] == [2]
+    await db.load_asked_questions(1)
+    assert not db.asked_questions.is_asked(1, 5)
+    assert db.asked_questions.is_asked(2, 5)
@@ -0,0 +1,55 @@
+import db as db_module
+
+
+async def _add_users(db, users):
+    async with db._writing() as conn:
+        await conn.executemany("INSERT INTO users (user_id, username, xp) VALUES (?, ?, ?)", users)
+
+
+def _ids(result):
+    return [user["user_id"] for user in result["users"]]
+
+
+async def test_substring_matches_ranked_exact_prefix_then_shorter_and_richer(db):
+    await _add_users(db, [
+        (1, "joanna", 500),
+        (2, "annaby", 10),
+        (3, "Anna", 0),
+        (4, "annika_anna", 0),
+        (5, "annaxx", 90),
+        (6, "boris", 1000),
+    ])
+
+    result = await db.search_users("anna")
+
+    # Имя целиком, затем начало имени, затем подстрока; внутри групп - короче, потом больше XP
+    assert _ids(result) == [3, 5, 2, 1, 4]
+    assert (result["total"], result["capped"]) == (5, False)
+
+
+async def test_exact_id_and_username_fast_paths(db):
+    await _add_users(db, [(42, "Alice", 0), (43, "alice_fan", 0)])
+
+    assert _ids(await db.search_users("42")) == [42]
+    assert _ids(await db.search_users("@ALICE")) == [42]
+    # Точного имени нет - ищем как подстроку
+    assert _ids(await db.search_users("@alic")) == [42, 43]
+
+
+async def test_short_query_matches_name_prefix(db):
+    await _add_users(db, [(1, "bob", 0), (2, "abby", 0), (3, "Bo", 0)])
+
+    assert _ids(await db.search_users("bo")) == [3, 1]
+
+
+async def test_paging_reports_total_and_cap(db, monkeypatch):
+    monkeypatch.setattr(db_module, "SEARCH_MAX_RESULTS", 5)
+    await _add_users(db, [(user_id, f"player{user_id}", user_id) for user_id in range(1, 9)])
+
+    first = await db.search_users("player", offset=0, limit=2)
+    last = await db.search_users("player", offset=4, limit=2)
+
+    assert (first["total"], first["capped"]) == (5, True)
+    assert len(first["users"]) == 2
+    assert len(last["users"]) == 1
+    assert not set(_ids(first)) & set(_ids(last))
@@ -0,0 +1,31 @@
+async def test_export_changes_reads_on_dedicated_connection(db, tmp_path):
+    async with db._writing() as conn:
+        await conn.execute("INSERT INTO users (user_id, username) VALUES (1, 'alice')")
+    busy = []
+
+    def sink(record):
+        # Пока идет долгое чтение, соединения пула свободны для обычных запросов
+        busy.append(any(db._reader_load))
+
+    result = await db.export_changes("1970-01-01 00:00:00", sink)
+    snapshot = await db.backup_to(str(tmp_path / "copy.db"))
+
+    assert db.pooled
+    assert busy and not any(busy)
+    assert result["rows"] >= 1
+    assert snapshot["tables"]["users"] == 1
+
+
+async def test_restore_drops_buffered_answer_events(db, tmp_path):
+    backup = str(tmp_path / "backup.db")
+    await db.backup_to(backup)
+    await db.get_user(1)
+    db.record_answer_event(1, 10, 1, 0, True, 1500, 0)
+
+    await db.restore_from(backup)
+    await db.flush_answer_events()
+
+    assert len(db.answer_events) == 0
+    async with db._reading() as conn:
+        async with conn.execute("SELECT COUNT(*) FROM answer_events") as cursor:
+            assert (await cursor.fetchone())[0] == 0
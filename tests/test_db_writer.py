@@ -0,0 +1,205 @@
+import asyncio
+
+import pytest
+
+import db as db_module
+
+
+async def _count_users(db) -> int:
+    async with db._reading() as conn:
+        async with conn.execute("SELECT COUNT(*) FROM users") as cursor:
+            return (await cursor.fetchone())[0]
+
+
+async def test_write_is_visible_to_readers_after_block(db):
+    async with db._writing() as conn:
+        await conn.execute("INSERT INTO users (user_id, username) VALUES (1, 'alice')")
+
+    # wait_durable: к выходу из блока батч закоммичен и виден читателям пула
+    assert await _count_users(db) == 1
+
+
+async def test_concurrent_writes_share_one_commit(db):
+    db._writer.interval = 0.05
+    commits = db.commits_count
+
+    async def insert(user_id: int):
+        async with db._writing() as conn:
+            await conn.execute("INSERT INTO users (user_id, username) VALUES (?, ?)", (user_id, f"user{user_id}"))
+
+    await asyncio.gather(*(insert(user_id) for user_id in range(1, 6)))
+
+    # Все пять операций - в одном батче (к нему могут присоединиться и фоновые записи)
+    assert db.commits_count == commits + 1
+    assert db.write_metrics["last_batch"] >= 5
+    assert await _count_users(db) == 5
+
+
+async def test_failed_write_rolls_back_only_its_savepoint(db):
+    db._writer.interval = 0.05
+
+    async def insert(user_id: int, fail: bool = False):
+        async with db._writing() as conn:
+            await conn.execute("INSERT INTO users (user_id, username) VALUES (?, ?)", (user_id, f"user{user_id}"))
+            if fail:
+                raise ValueError("ошибка операции")
+
+    results = await asyncio.gather(insert(1), insert(2, fail=True), insert(3), return_exceptions=True)
+
+    assert results[0] is None and results[2] is None
+    assert isinstance(results[1], ValueError)
+    async with db._reading() as conn:
+        async with conn.execute("SELECT user_id FROM users ORDER BY user_id") as cursor:
+            assert [row[0] for row in await cursor.fetchall()] == [1, 3]
+
+
+async def test_transaction_applies_nested_writes_atomically(db):
+    with pytest.raises(ValueError):
+        async with db.transaction():
+            await db.add_xp(1, 50)
+            await db.add_xp(2, 50)
+            raise ValueError("откат всей единицы работы")
+
+    assert await _count_users(db) == 0
+
+
+async def test_exclusive_inside_transaction_is_rejected(db):
+    with pytest.raises(RuntimeError):
+        async with db.transaction():
+            # Ждать очереди здесь бесполезно: ее держит эта же транзакция
+            async with asyncio.timeout(5):
+                async with db._exclusive():
+                    pass
+
+
+async def test_exclusive_runs_between_batches(db):
+    await db.get_user(1, "alice")
+
+    async with db._exclusive() as conn:
+        # Батч уже закоммичен: соединение записи без открытой транзакции
+        assert not conn.in_transaction
+        await conn.execute("UPDATE users SET xp = 10 WHERE user_id = 1")
+
+    assert await db.get_user_xp(1) == 10
+
+
+async def test_commit_callbacks_run_after_durable_commit(db):
+    calls = []
+    commits = db.commits_count
+
+    async with db._writing() as conn:
+        await conn.execute("INSERT INTO users (user_id, username) VALUES (1, 'alice')")
+        db._on_commit(lambda: calls.append(db.commits_count))
+        assert calls == []
+
+    assert calls == [commits + 1]
+
+
+async def test_commit_callbacks_skip_rolled_back_writes(db):
+    calls = []
+
+    with pytest.raises(ValueError):
+        async with db._writing() as conn:
+            await conn.execute("INSERT INTO users (user_id, username) VALUES (1, 'alice')")
+            db._on_commit(lambda: calls.append("commit"))
+            raise ValueError("откат")
+
+    async with db._writing():
+        pass
+    assert calls == []
+
+
+async def test_commit_callbacks_wait_for_commit_without_wait_durable(db):
+    db._writer.interval = 0.05
+    calls = []
+
+    async with db._writing(wait_durable=False) as conn:
+        await conn.execute("INSERT INTO users (user_id, username) VALUES (1, 'alice')")
+        db._on_commit(lambda: calls.append(db.commits_count))
+    commits = db.commits_count
+
+    # Батч еще копится: колбэк не должен видеть незакоммиченные данные
+    assert calls == []
+    async with db._writing():
+        pass
+    assert calls == [commits + 1]
+
+
+def _cancel_when_turn_granted(db, tickets: list):
+    """Отменяет пишущую корутину ровно в момент выдачи ей очереди актором"""
+    submit = db._writer.submit
+
+    async def cancelling_submit(exclusive: bool = False):
+        ticket = await submit(exclusive)
+        tickets.append(ticket)
+        task = asyncio.current_task()
+        ticket.turn.add_done_callback(lambda _: task.cancel())
+        return ticket
+
+    db._writer.submit = cancelling_submit
+    return submit
+
+
+@pytest.mark.parametrize("exclusive", [False, True])
+async def test_cancel_after_turn_granted_does_not_stall_writer(db, exclusive):
+    tickets = []
+    submit = _cancel_when_turn_granted(db, tickets)
+    context = db._exclusive if exclusive else db._writing
+
+    async def write():
+        async with context() as conn:
+            await conn.execute("UPDATE users SET xp = xp + 1 WHERE user_id = 1")
+
+    task = asyncio.create_task(write())
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    # Актор должен продолжить работу: следующая запись проходит
+    db._writer.submit = submit
+    try:
+        user = await asyncio.wait_for(db.get_user(1, "alice"), timeout=5)
+    except asyncio.TimeoutError:
+        # Освобождаем актор, чтобы тест упал, а не завис на закрытии базы
+        for ticket in tickets:
+            if not ticket.done.done():
+                ticket.done.set_result(None)
+        pytest.fail("актор записи завис после отмены")
+    assert user["username"] == "alice"
+
+
+async def test_add_xp_reports_previous_xp_to_leaderboard(db):
+    calls = []
+    db.leaderboard.set_xp = lambda user_id, old_xp, new_xp, level: calls.append((user_id, old_xp, new_xp, level))
+
+    await db.add_xp(7, 150)  # пользователя еще нет - создается этим запросом
+    await db.add_xp(7, 30)
+
+    assert calls == [(7, None, 150, 2), (7, 150, 180, 2)]
+
+
+async def test_add_xp_to_new_user_without_xp_reports_zero(db):
+    await db.get_user(8, "bob")  # создан только что, XP еще нет
+    calls = []
+    db.leaderboard.set_xp = lambda user_id, old_xp, new_xp, level: calls.append((user_id, old_xp, new_xp, level))
+
+    await db.add_xp(8, 20)
+
+    # Игрок уже учтен в таблице лидеров с 0 XP - его нельзя добавить второй раз
+    assert calls == [(8, 0, 20, 1)]
+
+
+async def test_answer_events_flush_started_in_transaction_commits_separately(db, monkeypatch):
+    monkeypatch.setattr(db_module, "ANSWER_EVENTS_FLUSH_SIZE", 3)
+
+    with pytest.raises(RuntimeError):
+        async with db.transaction():
+            for question_id in range(3):
+                db.record_answer_event(1, question_id, 1, 0, True, 1000, 0)
+            await asyncio.sleep(0.05)  # Сброс успевает начаться, пока транзакция открыта
+            raise RuntimeError("откат")
+    await db._events_flush_task
+
+    # Сброс идет своей записью у актора, а не внутри откатившейся транзакции
+    async with db._reading() as conn:
+        async with conn.execute("SELECT COUNT(*) FROM answer_events") as cursor:
+            assert (await cursor.fetchone())[0] == 3
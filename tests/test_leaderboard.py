@@ -0,0 +1,65 @@
+import asyncio
+import logging
+import threading
+
+from leaderboard import Leaderboard, XPHistogram
+
+
+def _leaderboard(users, top_k):
+    """Таблица, построенная как из БД: users - {user_id: xp}"""
+    board = Leaderboard(top_k=top_k)
+    ranked = sorted(users.items(), key=lambda item: (-item[1], item[0]))
+    board.rebuild(XPHistogram.from_values(users.values()),
+                  [(user_id, f"user{user_id}", 1, xp, 0) for user_id, xp in ranked[:top_k]])
+    return board
+
+
+def test_top_player_dropping_below_untracked_player_invalidates_top():
+    users = {1: 100, 2: 90, 3: 80, 4: 70}
+    board = _leaderboard(users, top_k=3)
+
+    # Игрок из топа теряет весь XP: игрок 4 (70 XP) вне кэша теперь выше него
+    board.set_xp(3, 80, 0, 1)
+
+    top = board.top(3)
+    assert top is None or [entry["user_id"] for entry in top] == [1, 2, 4]
+
+
+def test_top_player_drop_above_floor_keeps_top():
+    users = {1: 100, 2: 90, 3: 80, 4: 70}
+    board = _leaderboard(users, top_k=3)
+
+    board.set_xp(1, 100, 85, 1)
+
+    assert [entry["user_id"] for entry in board.top(3)] == [2, 1, 3]
+
+
+async def test_updates_during_rebuild_are_replayed(db, monkeypatch, caplog):
+    await db.add_xp(1, 50)
+    await db.add_xp(2, 30)
+
+    entered, release = threading.Event(), threading.Event()
+    from_values = XPHistogram.from_values
+
+    def gated_from_values(values):
+        # Снимок уже прочитан: пока строится гистограмма, запись продолжается
+        entered.set()
+        release.wait(5)
+        return from_values(values)
+
+    monkeypatch.setattr(XPHistogram, "from_values", gated_from_values)
+    rebuild = asyncio.create_task(db.rebuild_leaderboard())
+    await asyncio.to_thread(entered.wait, 5)
+
+    await db.add_xp(1, 100)
+    await db.get_user(3)
+    await db.add_xp(3, 70)
+    release.set()
+    with caplog.at_level(logging.WARNING, logger="db"):
+        await rebuild
+
+    board = db.leaderboard
+    assert board.ready and board.histogram.total == 3
+    assert [(entry["user_id"], entry["xp"]) for entry in board.top(3)] == [(1, 150), (3, 70), (2, 30)]
+    assert board.rank(70)["rank"] == 2
+    assert not [record for record in caplog.records if "разошлась" in record.getMessage()]
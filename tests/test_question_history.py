@@ -0,0 +1,56 @@
+from question_history import AskedQuestions, bits_to_blob, blob_to_bits
+
+
+def test_blob_round_trip():
+    bits = 1 << 0 | 1 << 9 | 1 << 700
+    assert blob_to_bits(bits_to_blob(bits)) == bits
+    assert blob_to_bits(None) == 0
+
+
+def test_eviction_keeps_dirty_masks():
+    history = AskedQuestions(capacity=2)
+    history.mark(1, 5)
+    history.mark(2, 6)
+    history.mark(3, 7)
+
+    # Несохраненные маски не вытесняются, даже сверх capacity
+    assert len(history) == 3
+    assert all(history.is_asked(user_id, question_id) for user_id, question_id in ((1, 5), (2, 6), (3, 7)))
+
+
+def test_eviction_keeps_inflight_masks_until_written():
+    history = AskedQuestions(capacity=1)
+    history.mark(1, 5)
+    rows = history.drain()
+    history.put(2, 0)
+    history.put(3, 0)
+
+    # Маска 1 записывается: вытесняются только загруженные 2 и 3
+    assert 1 in history
+    assert rows == [(1, bits_to_blob(1 << 5))]
+
+    history.written()
+    history.put(4, 0)
+    assert 1 not in history
+
+
+def test_failed_write_restores_dirty_masks():
+    history = AskedQuestions(capacity=10)
+    history.mark(1, 5)
+    history.mark(2, 6)
+    rows = history.drain()
+    assert history.drain() == []
+
+    history.restore(rows)
+
+    assert sorted(history.drain()) == sorted(rows)
+
+
+def test_mark_during_write_is_saved_by_next_drain():
+    history = AskedQuestions(capacity=10)
+    history.mark(1, 5)
+    history.drain()
+    history.mark(1, 6)
+    history.written()
+
+    assert history.drain() == [(1, bits_to_blob(1 << 5 | 1 << 6))]
@@ -0,0 +1,59 @@
+from question_sampler import QuestionSampler
+
+
+class _Bank:
+    """Индекс банка вопросов: одна пара (категория, сложность)"""
+
+    def __init__(self, question_ids):
+        self.ids = tuple(question_ids)
+        self.version = 1
+
+    def question_ids(self, category="random", difficulty="random"):
+        return self.ids
+
+
+def _draw_many(sampler, owner, count, **kwargs):
+    return [sampler.draw(owner, "наука", "easy", **kwargs) for _ in range(count)]
+
+
+def test_fixed_seed_reproduces_order():
+    bank = _Bank(range(1, 21))
+
+    first = _draw_many(QuestionSampler(bank, seed="s"), owner=1, count=40)
+    second = _draw_many(QuestionSampler(bank, seed="s"), owner=1, count=40)
+
+    assert first == second
+    assert first != _draw_many(QuestionSampler(bank, seed="other"), owner=1, count=40)
+
+
+def test_each_round_is_a_permutation_without_repeats():
+    bank = _Bank(range(1, 21))
+    sampler = QuestionSampler(bank, seed="s")
+
+    rounds = [_draw_many(sampler, owner=1, count=20) for _ in range(3)]
+
+    for drawn in rounds:
+        assert sorted(drawn) == list(range(1, 21))
+    assert rounds[0] != rounds[1]
+
+
+def test_skipped_questions_are_never_drawn():
+    sampler = QuestionSampler(_Bank(range(1, 11)), seed="s")
+    asked = {1, 2, 3, 4, 5, 6, 7}
+
+    drawn = _draw_many(sampler, owner=1, count=6, skip=asked.__contains__)
+
+    assert sorted(drawn[:3]) == [8, 9, 10]
+    assert not set(drawn) & asked
+    assert sampler.draw(1, "наука", "easy", skip=lambda question_id: True) is None
+
+
+def test_bank_change_reshuffles_bag():
+    bank = _Bank(range(1, 11))
+    sampler = QuestionSampler(bank, seed="s")
+    _draw_many(sampler, owner=1, count=5)
+
+    bank.ids = tuple(range(11, 21))
+    bank.version += 1
+
+    assert sorted(_draw_many(sampler, owner=1, count=10)) == list(range(11, 21))